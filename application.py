@@ -7,8 +7,15 @@ import sys
 import traceback
 from pathlib import Path
 
+from coupe_loader import CoupeLoader
+from diagnostics import DiagnosticsWriter
+from journal import Journal, read_journal
+import mask_codec
 from reconstruction import Reconstruction
+from segmentation_worker import BatchSegmentationWorker, SegmentationWorker
 from slide_score_api.slidescore import APIClient
+from slide_score_api.tile_cache import TileCache
+from tile_memory import shared_tile_memory
 
 
 class Application():
@@ -43,6 +50,14 @@ class Application():
         self.reconstruction = None
         # the active slice is used, to track which slice is being rendered on the slice_photo_widget
         self.active_slice = None
+        # the background thread loading the coupes
+        self.coupe_loader = None
+        # the background threads segmenting slices, including the cancelled ones that are still finishing
+        self.segmentation_workers = []
+        # the autosave journal, None if autosave is not enabled or not started yet
+        self.journal = None
+        # the ids of the coupes in the autosave coupes file, None if it has not been written yet
+        self.autosave_coupe_ids = None
 
         if logger is None:
             self.logger = logging.getLogger('session data main')
@@ -62,6 +77,8 @@ class Application():
         else:
             self.logger = logger
 
+        self.diagnostics = DiagnosticsWriter(enabled=self.diagnostics_enabled, directory=self.diagnostics_dir,
+                                             logger=self.logger)
         self.init_slidescore_api()
 
     @classmethod
@@ -87,6 +104,17 @@ class Application():
                 obj.set_active_slice_by_id(-1)
             else:
                 obj.set_active_slice_by_id(application.active_slice.id)
+            # if the coupes are still loading, the remaining coupes go to the new reconstruction
+            if application.coupe_loader is not None and application.coupe_loader.isRunning():
+                application.coupe_loader.coupe_loaded.disconnect()
+                obj.coupe_loader = application.coupe_loader
+                obj.coupe_loader.coupe_loaded.connect(obj.add_loaded_coupe)
+            # running segmentations are for the slices of the old reconstruction, so these are cancelled
+            application.cancel_segmentation()
+            obj.segmentation_workers = application.segmentation_workers
+            # the autosave continues in the same journal
+            obj.journal = application.journal
+            obj.autosave_coupe_ids = application.autosave_coupe_ids
             return obj
         except:
             application.logger.error(
@@ -95,7 +123,16 @@ class Application():
 
     def init_slidescore_api(self):
         try:
-            self.slide_score_api = APIClient(self.slide_score_server, self.slide_score_api_token)
+            shared_tile_memory.set_max_size_mb(self.tile_memory_max_mb)
+            if self.use_tile_cache:
+                tile_cache = TileCache(cache_dir=self.tile_cache_dir, max_size_mb=self.tile_cache_max_mb)
+            else:
+                tile_cache = None
+            self.slide_score_api = APIClient(self.slide_score_server, self.slide_score_api_token,
+                                             pool_size=self.slide_score_pool_size,
+                                             max_retries=self.slide_score_max_retries,
+                                             tile_cache=tile_cache,
+                                             tile_server_ttl=self.tile_server_ttl)
         except:
             self.logger.error(
                 f'Unexpected error: {sys.exc_info()[0]} \n {traceback.format_exc()}')
@@ -105,6 +142,11 @@ class Application():
         try:
             self.logger.info("Starting Application..")
 
+            if self.autosave_enabled and self.restore_autosave():
+                # continue the journal of the restored session
+                self.start_autosave(compact=False)
+                return
+
             if self.auto_reload:
                 self.load_reconstruction_from_pickle()
 
@@ -115,12 +157,69 @@ class Application():
                 self.reconstruction.set_slide_score_study_and_case_id(slide_score_study_id=self.slide_score_study_id,
                                                                       slide_score_case_id=self.slide_score_case_id)
                 self.reconstruction.set_macro_photo(macro_photo_path=self.macro_photo_path)
-                self.reconstruction.load_coupes(max_cnt_coupes=self.max_cnt_coupes)
+                self.start_loading_coupes()
+            if self.autosave_enabled:
+                self.start_autosave()
         except:
             self.logger.error(
                 f'Unexpected error: {sys.exc_info()[0]} \n {traceback.format_exc()}')
             pass
 
+    def start_loading_coupes(self):
+        '''
+        Starts loading the coupes of the reconstruction in a background thread. The coupes are added to the
+        reconstruction and the Coupe Table Widget one by one, as they come in. In the meantime the gui can be used.
+        :return: None
+        '''
+        try:
+            self.stop_loading_coupes()
+            self.coupe_loader = CoupeLoader(reconstruction=self.reconstruction,
+                                            max_cnt_coupes=self.max_cnt_coupes,
+                                            num_tile_workers=self.num_tile_workers,
+                                            num_coupe_workers=self.num_coupe_workers,
+                                            logger=self.logger,
+                                            local_slide_dir=self.local_slide_dir if self.local_slide_dir else None)
+            self.coupe_loader.coupe_loaded.connect(self.add_loaded_coupe)
+            self.coupe_loader.start()
+        except:
+            self.logger.error(sys.exc_info()[0])
+            self.logger.error(traceback.format_exc())
+
+    def stop_loading_coupes(self):
+        '''
+        Stops adding coupes from the background thread, e.g. because the reconstruction is replaced
+        :return: None
+        '''
+        try:
+            if self.coupe_loader is not None and self.coupe_loader.isRunning():
+                self.coupe_loader.coupe_loaded.disconnect()
+                self.coupe_loader.requestInterruption()
+                self.coupe_loader.wait()
+        except:
+            self.logger.error(sys.exc_info()[0])
+            self.logger.error(traceback.format_exc())
+
+    def add_loaded_coupe(self, coupe, cnt, total):
+        '''
+        Called in the GUI thread for every coupe loaded by the coupe_loader
+        :param coupe: the coupe, None if the coupe failed to load
+        :param cnt: the number of coupes loaded so far
+        :param total: the total number of coupes to load
+        :return: None
+        '''
+        try:
+            if coupe is not None:
+                coupe.get_pixmaps_from_img()
+                self.reconstruction.add_coupe(coupe)
+                self.gui.coupe_table_widget.update_table_widget()
+            self.logger.info(f"Loaded {cnt} of {total} coupes")
+            if cnt == total:
+                # the coupes are not in the journal, so they are saved with a new autosave snapshot
+                self.compact_autosave()
+        except:
+            self.logger.error(sys.exc_info()[0])
+            self.logger.error(traceback.format_exc())
+
     def read_config(self):
         parser = configparser.ConfigParser()
 
@@ -162,6 +261,37 @@ class Application():
             self.slide_score_case_id = 13
             pass
 
+        try:
+            self.num_tile_workers = int(parser.get("SLIDESCORE", "num_tile_workers"))
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            self.num_tile_workers = 8
+            pass
+
+        try:
+            self.num_coupe_workers = int(parser.get("SLIDESCORE", "num_coupe_workers"))
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            self.num_coupe_workers = 4
+            pass
+
+        try:
+            self.slide_score_pool_size = int(parser.get("SLIDESCORE", "pool_size"))
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            # enough connections for num_coupe_workers x num_tile_workers simultaneous downloads
+            self.slide_score_pool_size = 32
+            pass
+
+        try:
+            self.slide_score_max_retries = int(parser.get("SLIDESCORE", "max_retries"))
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            self.slide_score_max_retries = 3
+            pass
+
+        try:
+            self.tile_server_ttl = int(parser.get("SLIDESCORE", "tile_server_ttl"))
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            self.tile_server_ttl = 600
+            pass
+
         try:
             self.auto_reload = (parser.get("APPLICATION", "auto_reload")) in ["true",
                                                                               "True", "1",
@@ -183,6 +313,95 @@ class Application():
             self.max_cnt_coupes = 2
             pass
 
+        try:
+            # when set, the coupes are read from the slides in this directory instead of from Slide Score
+            self.local_slide_dir = parser.get("RECONSTRUCTION", "local_slide_dir")
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            self.local_slide_dir = ""
+            pass
+
+        try:
+            self.use_tile_cache = (parser.get("CACHE", "use_tile_cache")) in ["true",
+                                                                             "True", "1",
+                                                                             "yes",
+                                                                             "Yes"]
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            self.use_tile_cache = True
+            pass
+
+        try:
+            self.tile_cache_dir = parser.get("CACHE", "tile_cache_dir")
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            self.tile_cache_dir = r"tile_cache"
+            pass
+
+        try:
+            self.tile_cache_max_mb = int(parser.get("CACHE", "tile_cache_max_mb"))
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            self.tile_cache_max_mb = 2048
+            pass
+
+        try:
+            # the decoded tiles of all coupes kept in memory, see tile_memory
+            self.tile_memory_max_mb = int(parser.get("CACHE", "tile_memory_max_mb"))
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            self.tile_memory_max_mb = 256
+            pass
+
+        try:
+            # the pixel classifier used for segmenting the slices: lookup_table (fast) or svc
+            self.pixel_classifier = parser.get("SEGMENTATION", "pixel_classifier")
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            self.pixel_classifier = "lookup_table"
+            pass
+
+        try:
+            # keep the decision values of the pixel classifier with the slice, for later refinement of the mask
+            self.keep_score_map = (parser.get("SEGMENTATION", "keep_score_map")) in ["true",
+                                                                                     "True", "1",
+                                                                                     "yes",
+                                                                                     "Yes"]
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            self.keep_score_map = False
+            pass
+
+        try:
+            # the slices are first segmented at 1/coarse_factor resolution, 1 segments at full resolution only
+            self.coarse_factor = int(parser.get("SEGMENTATION", "coarse_factor"))
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            self.coarse_factor = 4
+            pass
+
+        try:
+            # the half width in pixels of the band around the coarse boundary that is segmented at full resolution
+            self.band_width = int(parser.get("SEGMENTATION", "band_width"))
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            self.band_width = 8
+            pass
+
+        try:
+            # the number of processes used when segmenting all slices, 0 uses all cores
+            self.num_segmentation_workers = int(parser.get("SEGMENTATION", "num_segmentation_workers"))
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            self.num_segmentation_workers = 0
+            pass
+
+        try:
+            # write figures of the masks used in the segmentation to diagnostics_dir
+            self.diagnostics_enabled = (parser.get("DIAGNOSTICS", "enabled")) in ["true",
+                                                                                 "True", "1",
+                                                                                 "yes",
+                                                                                 "Yes"]
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            self.diagnostics_enabled = False
+            pass
+
+        try:
+            self.diagnostics_dir = parser.get("DIAGNOSTICS", "diagnostics_dir")
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            self.diagnostics_dir = r"diagnostics"
+            pass
+
         try:
             self.json_file_path = parser.get("FILES", "json_file_path")
         except (configparser.NoOptionError, configparser.NoSectionError):
@@ -195,6 +414,63 @@ class Application():
             self.pickle_file_path = r"reconstr.pkl"
             pass
 
+        try:
+            self.project_file_path = parser.get("FILES", "project_file_path")
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            self.project_file_path = r"reconstr.project"
+            pass
+
+        try:
+            # memory map the coupe images and the masks from the project file, rather than reading them into memory
+            self.memory_map_project_file = (parser.get("FILES", "memory_map_project_file")) in ["true",
+                                                                                               "True", "1",
+                                                                                               "yes",
+                                                                                               "Yes"]
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            self.memory_map_project_file = True
+            pass
+
+        try:
+            # the encoding of the masks in the json file: varint_base64 (compact) or list
+            self.mask_encoding = parser.get("FILES", "mask_encoding")
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            self.mask_encoding = "varint_base64"
+            pass
+
+        try:
+            # decode every mask again after encoding, to check the encoding
+            self.verify_mask_encoding = (parser.get("FILES", "verify_mask_encoding")) in ["true",
+                                                                                         "True", "1",
+                                                                                         "yes",
+                                                                                         "Yes"]
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            self.verify_mask_encoding = False
+            pass
+
+        try:
+            # keep a journal of all changes, and snapshots, such that a session survives a crash
+            self.autosave_enabled = (parser.get("AUTOSAVE", "enabled")) in ["true",
+                                                                           "True", "1",
+                                                                           "yes",
+                                                                           "Yes"]
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            self.autosave_enabled = True
+            pass
+
+        try:
+            # the autosave of every case is kept in its own subdirectory, see get_autosave_dir
+            self.autosave_dir = parser.get("AUTOSAVE", "autosave_dir")
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            self.autosave_dir = r"autosave"
+            pass
+
+        try:
+            # the number of journal entries after which a new snapshot is written
+            self.autosave_compact_after = int(parser.get("AUTOSAVE", "compact_after"))
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            self.autosave_compact_after = 5000
+            pass
+
     def write_config(self):
         try:
             parser = configparser.ConfigParser()
@@ -204,14 +480,42 @@ class Application():
             parser.set("SLIDESCORE", "api_token", str(self.slide_score_api_token))
             parser.set("SLIDESCORE", "study_id", str(self.slide_score_study_id))
             parser.set("SLIDESCORE", "case_id", str(self.slide_score_case_id))
+            parser.set("SLIDESCORE", "num_tile_workers", str(self.num_tile_workers))
+            parser.set("SLIDESCORE", "num_coupe_workers", str(self.num_coupe_workers))
+            parser.set("SLIDESCORE", "pool_size", str(self.slide_score_pool_size))
+            parser.set("SLIDESCORE", "max_retries", str(self.slide_score_max_retries))
+            parser.set("SLIDESCORE", "tile_server_ttl", str(self.tile_server_ttl))
             parser.add_section("APPLICATION")
             parser.set("APPLICATION", "auto_reload", str(self.auto_reload))
             parser.add_section("RECONSTRUCTION")
             parser.set("RECONSTRUCTION", "macro_photo_path", str(self.macro_photo_path))
             parser.set("RECONSTRUCTION", "max_cnt_coupes", str(self.max_cnt_coupes))
+            parser.set("RECONSTRUCTION", "local_slide_dir", str(self.local_slide_dir))
+            parser.add_section("CACHE")
+            parser.set("CACHE", "use_tile_cache", str(self.use_tile_cache))
+            parser.set("CACHE", "tile_cache_dir", str(self.tile_cache_dir))
+            parser.set("CACHE", "tile_cache_max_mb", str(self.tile_cache_max_mb))
+            parser.set("CACHE", "tile_memory_max_mb", str(self.tile_memory_max_mb))
+            parser.add_section("SEGMENTATION")
+            parser.set("SEGMENTATION", "pixel_classifier", str(self.pixel_classifier))
+            parser.set("SEGMENTATION", "keep_score_map", str(self.keep_score_map))
+            parser.set("SEGMENTATION", "coarse_factor", str(self.coarse_factor))
+            parser.set("SEGMENTATION", "band_width", str(self.band_width))
+            parser.set("SEGMENTATION", "num_segmentation_workers", str(self.num_segmentation_workers))
+            parser.add_section("DIAGNOSTICS")
+            parser.set("DIAGNOSTICS", "enabled", str(self.diagnostics_enabled))
+            parser.set("DIAGNOSTICS", "diagnostics_dir", str(self.diagnostics_dir))
             parser.add_section("FILES")
             parser.set("FILES", "json_file_path", str(self.json_file_path))
             parser.set("FILES", "pickle_file_path", str(self.pickle_file_path))
+            parser.set("FILES", "project_file_path", str(self.project_file_path))
+            parser.set("FILES", "memory_map_project_file", str(self.memory_map_project_file))
+            parser.add_section("AUTOSAVE")
+            parser.set("AUTOSAVE", "enabled", str(self.autosave_enabled))
+            parser.set("AUTOSAVE", "autosave_dir", str(self.autosave_dir))
+            parser.set("AUTOSAVE", "compact_after", str(self.autosave_compact_after))
+            parser.set("FILES", "mask_encoding", str(self.mask_encoding))
+            parser.set("FILES", "verify_mask_encoding", str(self.verify_mask_encoding))
             f = open(self.config_file, "w")
             parser.write(f)
             f.close()
@@ -228,6 +532,7 @@ class Application():
         '''
         try:
             new_slice = self.reconstruction.add_slice_from_rect(rect=rect)
+            self.record_change("add_slice", rect=list(rect.getRect()), id=new_slice.id)
             self.set_active_slice_by_id(new_slice.id)
             self.logger.info(f"adding slice with rect {rect}")
             # note that set_active_slice already performs a gui update
@@ -238,6 +543,7 @@ class Application():
     def delete_slice(self, id):
         try:
             new_active_slice = self.reconstruction.delete_slice(id)
+            self.record_change("delete_slice", id=id)
             if new_active_slice is None:
                 self.set_active_slice_by_id(-1)
             else:
@@ -270,7 +576,9 @@ class Application():
         :return:
         '''
         try:
+            self.cancel_segmentation()
             self.active_slice.remove_latest_trace()
+            self.record_slice_change("remove_latest_trace", self.active_slice)
             self.gui.update()
         except:
             self.logger.error(sys.exc_info()[0])
@@ -278,9 +586,11 @@ class Application():
 
     def load_reconstruction_from_pickle(self):
         try:
+            self.stop_loading_coupes()
 
             self.reconstruction = Reconstruction.load_from_pickle(pickle_file_path=self.pickle_file_path, parent=self, logger=self.logger,
                                                                   macro_photo_path=self.macro_photo_path)
+            self.compact_autosave()
             self.gui.update()
         except:
             self.logger.error(sys.exc_info()[0])
@@ -294,11 +604,129 @@ class Application():
             self.logger.error(traceback.format_exc())
 
 
+    def load_reconstruction_from_project_file(self):
+        '''
+        Loading the reconstruction from the project_file_path, and update the GUI
+        :return: None
+        '''
+        try:
+            self.stop_loading_coupes()
+            reconstruction = Reconstruction.load_from_project_file(project_file_path=self.project_file_path,
+                                                                   slide_score_api=self.slide_score_api,
+                                                                   slide_score_user=self.slide_score_user,
+                                                                   parent=self, logger=self.logger,
+                                                                   macro_photo_path=self.macro_photo_path,
+                                                                   mmap_mode="r" if self.memory_map_project_file else None)
+            if reconstruction is not None:
+                self.reconstruction = reconstruction
+                self.active_slice = None
+                self.compact_autosave()
+            self.gui.update()
+        except:
+            self.logger.error(sys.exc_info()[0])
+            self.logger.error(traceback.format_exc())
+
+    def save_reconstruction_to_project_file(self):
+        try:
+            self.reconstruction.save_to_project_file(project_file_path=self.project_file_path)
+        except:
+            self.logger.error(sys.exc_info()[0])
+            self.logger.error(traceback.format_exc())
+
     def calc_foreground_background_mask(self):
+        '''
+        Starts the segmentation of the active slice in a SegmentationWorker. The seed masks and the pixels are
+        prepared here, in the GUI thread, the mask is set on the slice when the worker is done.
+        A segmentation that is still running is cancelled.
+        :return: None
+        '''
         try:
             self.logger.info("Calc Foreground/Background Mask")
-            self.active_slice.calc_foreground_background_mask()
-            self.gui.slice_photo_widget.set_show_traces(False)
+            self.cancel_segmentation()
+            slice = self.active_slice
+            inner_mask, outer_mask = slice.create_inner_and_outer_mask(diagnostics=self.diagnostics)
+            worker = SegmentationWorker(slice=slice, pixels=slice.get_np_array(), inner_mask=inner_mask,
+                                        outer_mask=outer_mask,
+                                        segmentation_parameters=dict(self.get_segmentation_parameters(),
+                                                                     max_num_train_pixels=slice.max_num_train_pixels),
+                                        logger=self.logger, diagnostics=self.diagnostics)
+            worker.progress.connect(self.show_segmentation_progress)
+            worker.mask_ready.connect(self.set_segmentation_result)
+            workers = self.segmentation_workers
+            worker.finished.connect(lambda: workers.remove(worker))
+            workers.append(worker)
+            worker.start()
+        except:
+            self.logger.error(sys.exc_info()[0])
+            self.logger.error(traceback.format_exc())
+
+    def calc_all_foreground_background_masks(self):
+        '''
+        Starts the segmentation of all slices with traces in a BatchSegmentationWorker, distributed over the cores.
+        The masks are set on the slices one by one, as they come in. Segmentations that are still running are
+        cancelled.
+        :return: None
+        '''
+        try:
+            self.logger.info("Calc Foreground/Background Mask of all slices")
+            self.cancel_segmentation()
+            jobs = self.reconstruction.get_segmentation_jobs(segmentation_parameters=self.get_segmentation_parameters(),
+                                                             diagnostics=self.diagnostics)
+            if len(jobs) == 0:
+                return
+            max_workers = self.num_segmentation_workers if self.num_segmentation_workers > 0 else None
+            worker = BatchSegmentationWorker(jobs=jobs, max_workers=max_workers, logger=self.logger,
+                                             diagnostics=self.diagnostics)
+            worker.progress.connect(self.show_segmentation_progress)
+            worker.mask_ready.connect(self.set_segmentation_result)
+            workers = self.segmentation_workers
+            worker.finished.connect(lambda: workers.remove(worker))
+            workers.append(worker)
+            worker.start()
+        except:
+            self.logger.error(sys.exc_info()[0])
+            self.logger.error(traceback.format_exc())
+
+    def get_segmentation_parameters(self):
+        '''
+        :return: the keyword arguments for segmentation.calc_foreground_background_mask, as configured
+        '''
+        return {'classifier': self.pixel_classifier,
+                'keep_score_map': self.keep_score_map,
+                'coarse_factor': self.coarse_factor,
+                'band_width': self.band_width}
+
+    def cancel_segmentation(self):
+        '''
+        Cancels the running segmentations, e.g. because the user started a new trace
+        :return: None
+        '''
+        try:
+            for worker in self.segmentation_workers:
+                worker.cancel()
+        except:
+            self.logger.error(sys.exc_info()[0])
+            self.logger.error(traceback.format_exc())
+
+    def show_segmentation_progress(self, percentage, message):
+        self.logger.info(f"Segmentation {percentage}%: {message}")
+
+    def set_segmentation_result(self, slice, mask, score_map):
+        '''
+        Called in the GUI thread when a SegmentationWorker is done, or a BatchSegmentationWorker has segmented a slice
+        :param slice: the segmented slice
+        :param mask: the mask
+        :param score_map: the decision values of the classifier, or None
+        :return: None
+        '''
+        try:
+            if self.reconstruction is None or slice not in self.reconstruction.slices:
+                # the slice was deleted in the mean time
+                return
+            slice.set_mask(mask, score_map)
+            self.record_mask(slice)
+            if slice is self.active_slice:
+                self.gui.slice_photo_widget.set_show_traces(False)
             self.gui.update()
         except:
             self.logger.error(sys.exc_info()[0])
@@ -312,18 +740,164 @@ class Application():
         try:
             self.logger.info(f"{ruler_end_point}")
             self.reconstruction.add_ruler_point(ruler_end_point)
+            self.record_change("ruler_point", x=ruler_end_point.x(), y=ruler_end_point.y())
+            self.gui.update()
+        except:
+            self.logger.error(sys.exc_info()[0])
+            self.logger.error(traceback.format_exc())
+
+    def get_autosave_dir(self, slide_score_study_id, slide_score_case_id):
+        '''
+        :return: the directory with the autosave (snapshot, coupes and journal) of a case. Every case has its own
+        directory, such that the autosave of one case never overwrites that of another
+        '''
+        return Path(self.autosave_dir) / f"{slide_score_study_id}_{slide_score_case_id}"
+
+    def start_autosave(self, compact=True):
+        '''
+        Opens the autosave journal, see journal
+        :param compact: if True, a snapshot of the current reconstruction is written first and the journal is
+        started anew. Should be False when the reconstruction was just restored from the autosave
+        :return: None
+        '''
+        try:
+            self.open_journal()
+            if compact:
+                self.compact_autosave()
+        except:
+            self.logger.error(sys.exc_info()[0])
+            self.logger.error(traceback.format_exc())
+
+    def open_journal(self):
+        '''
+        Opens the journal in the autosave directory of the case of the reconstruction, unless it is open already.
+        When the reconstruction is replaced by one of another case, the journal of the other case is opened
+        :return: None
+        '''
+        journal_path = self.get_autosave_dir(self.reconstruction.slide_score_study_id,
+                                             self.reconstruction.slide_score_case_id) / "reconstr.journal"
+        if self.journal is not None and self.journal.path == journal_path:
+            return
+        if self.journal is not None:
+            self.journal.close()
+            # the coupes file of the other case is in the other directory
+            self.autosave_coupe_ids = None
+        # reconstructions loaded from a pickle have no journal_seq
+        seq = getattr(self.reconstruction, "journal_seq", 0)
+        self.journal = Journal(journal_path, seq=seq, logger=self.logger)
+
+    def restore_autosave(self):
+        '''
+        Restores the session of the configured case from its autosave snapshot and journal. The coupes that were not
+        loaded yet when the snapshot was written are loaded in the background
+        :return: True if the session was restored
+        '''
+        try:
+            autosave_dir = self.get_autosave_dir(self.slide_score_study_id, self.slide_score_case_id)
+            if not (autosave_dir / "reconstr.project").exists():
+                return False
+            reconstruction = Reconstruction.load_from_project_file(project_file_path=autosave_dir / "reconstr.project",
+                                                                   slide_score_api=self.slide_score_api,
+                                                                   slide_score_user=self.slide_score_user,
+                                                                   parent=self, logger=self.logger,
+                                                                   macro_photo_path=self.macro_photo_path,
+                                                                   mmap_mode="r" if self.memory_map_project_file else None)
+            if reconstruction is None:
+                return False
+            reconstruction.replay_journal(read_journal(autosave_dir / "reconstr.journal", logger=self.logger))
+            self.reconstruction = reconstruction
+            self.active_slice = None
+            self.logger.info(f"Restored the session from {autosave_dir}")
+            # the coupes in the snapshot are the ones that were loaded when the coupes were last saved, the loader
+            # skips these and loads the others
+            self.start_loading_coupes()
+            self.autosave_coupe_ids = list(self.reconstruction.coupes)
             self.gui.update()
+            return True
+        except:
+            self.logger.error(sys.exc_info()[0])
+            self.logger.error(traceback.format_exc())
+            return False
+
+    def compact_autosave(self):
+        '''
+        Writes the reconstruction as a new autosave snapshot, after which the journal is started anew.
+        The coupes are kept in a separate file, which is only written again when the coupes have changed, such that
+        the snapshot holds only the slices and the ruler
+        :return: None
+        '''
+        try:
+            if self.journal is None or self.reconstruction is None:
+                return
+            # no snapshot is written in the middle of a stroke, the next change after the stroke writes it
+            if self.gui.slice_photo_widget.tracing:
+                return
+            self.open_journal()
+            autosave_dir = self.get_autosave_dir(self.reconstruction.slide_score_study_id,
+                                                 self.reconstruction.slide_score_case_id)
+            coupe_ids = list(self.reconstruction.coupes)
+            if coupe_ids != self.autosave_coupe_ids:
+                if not self.reconstruction.save_coupes_to_project_file(autosave_dir / "coupes.project"):
+                    return
+                self.autosave_coupe_ids = coupe_ids
+            if self.reconstruction.save_to_project_file(project_file_path=autosave_dir / "reconstr.project",
+                                                        journal_seq=self.journal.seq,
+                                                        coupes_file_path=autosave_dir / "coupes.project"):
+                self.reconstruction.journal_seq = self.journal.seq
+                self.journal.restart()
         except:
             self.logger.error(sys.exc_info()[0])
             self.logger.error(traceback.format_exc())
 
+    def record_change(self, event, **data):
+        '''
+        Records a change of the reconstruction in the autosave journal. When the journal has grown long, a new
+        snapshot is written
+        :param event: the name of the change, see Reconstruction.apply_journal_entry
+        :param data: the data of the change
+        :return: None
+        '''
+        try:
+            if self.journal is None:
+                return
+            self.journal.record(event, **data)
+            if self.journal.num_entries >= self.autosave_compact_after:
+                self.compact_autosave()
+        except:
+            self.logger.error(sys.exc_info()[0])
+            self.logger.error(traceback.format_exc())
+
+    def record_slice_change(self, event, slice, **data):
+        '''
+        Records a change of a slice in the autosave journal. The slice is identified by its position in the list of
+        slices, as the ids of the slices are not necessarily unique
+        :param event: the name of the change
+        :param slice: the slice
+        :param data: the data of the change
+        :return: None
+        '''
+        if self.journal is None or slice not in self.reconstruction.slices:
+            return
+        self.record_change(event, slice_index=self.reconstruction.slices.index(slice), **data)
+
+    def record_mask(self, slice):
+        '''
+        Records the mask of a slice in the autosave journal
+        :param slice: the slice
+        :return: None
+        '''
+        if self.journal is None:
+            return
+        self.record_slice_change("mask", slice, mask=mask_codec.encode_mask(slice.mask.to_array()))
+
     def save_reconstruction_as_json(self):
         '''
         Saving the reconstruction as json
         :return:
         '''
         try:
-            data = self.reconstruction.get_dict_for_serialisation()
+            data = self.reconstruction.get_dict_for_serialisation(mask_encoding=self.mask_encoding,
+                                                                  verify_masks=self.verify_mask_encoding)
 
             s = json.dumps(data, indent='\t')
             # the section below removes some of the white spacing and new lines to make the json shorter and more readable
@@ -346,14 +920,17 @@ class Application():
         '''
         try:
             self.logger.info(f"Loading reconstruction from {self.json_file_path}")
+            self.stop_loading_coupes()
             with open(self.json_file_path) as json_file:
                 data = json.load(json_file)
             self.reconstruction = Reconstruction.create_from_dict(data,
                                                                   slide_score_api=self.slide_score_api,
                                                                   slide_score_user=self.slide_score_user,
                                                                   parent=self,
-                                                                  logger=self.logger)
+                                                                  logger=self.logger,
+                                                                  num_tile_workers=self.num_tile_workers)
             self.active_slice = None
+            self.compact_autosave()
             self.gui.update()
             return
         except:
@@ -0,0 +1,188 @@
+'''
+Benchmarks for loading coupes from Slide Score, run against the local stand-in server (slide_score_stand_in.py)
+or against a real server.
+
+Reported are:
+    -the throughput of APIClient.perform_request (requests/s)
+    -the time for Coupe.get_metadata for all coupes of the case
+    -the throughput of the tile downloads in Coupe.get_image and Coupe.get_region (tiles/s and MB/s)
+    -the wall time for loading the complete case, as done by the CoupeLoader, with a cold and a warm tile cache
+
+Example:
+    python benchmark_loading.py --latency 0.02 --num-images 8
+'''
+
+import argparse
+import json
+import logging
+import tempfile
+import threading
+import time
+
+from coupe import Coupe
+from reconstruction import Reconstruction
+from slide_score_api.slidescore import APIClient
+from slide_score_api.tile_cache import TileCache
+from slide_score_stand_in import SlideScoreStandIn
+from tile_memory import shared_tile_memory
+
+
+class CountingAPIClient(APIClient):
+    '''
+    An APIClient that counts the tiles and bytes it returns
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.counter_lock = threading.Lock()
+        self.num_tiles = 0
+        self.num_bytes = 0
+
+    def get_tile(self, imageid, level, x, y):
+        content = super().get_tile(imageid, level, x, y)
+        with self.counter_lock:
+            self.num_tiles += 1
+            self.num_bytes += len(content)
+        return content
+
+
+def benchmark_perform_request(api, image_ids, num_requests):
+    start = time.perf_counter()
+    for i in range(num_requests):
+        api.perform_request("GetImageMetadata?imageId=" + str(image_ids[i % len(image_ids)]), None, method="GET").json()
+    duration = time.perf_counter() - start
+    return {'requests': num_requests, 'seconds': duration, 'requests_per_second': num_requests / duration}
+
+
+def benchmark_get_metadata(api, study_id, case_id, image_ids, logger):
+    start = time.perf_counter()
+    for image_id in image_ids:
+        coupe = Coupe(slide_score_api=api, slide_score_study_id=study_id, slide_score_case_id=case_id,
+                      slide_score_image_id=image_id, logger=logger)
+        coupe.get_metadata()
+    duration = time.perf_counter() - start
+    return {'coupes': len(image_ids), 'seconds': duration, 'seconds_per_coupe': duration / len(image_ids)}
+
+
+def benchmark_get_image(api, study_id, case_id, image_id, num_tile_workers, logger, zoom_level=None):
+    '''
+    times Coupe.get_image, or Coupe.get_region for the complete coupe if a zoom_level is given
+    '''
+    coupe = Coupe(slide_score_api=api, slide_score_study_id=study_id, slide_score_case_id=case_id,
+                  slide_score_image_id=image_id, logger=logger)
+    coupe.get_metadata()
+    # the decoded tiles of an earlier phase would otherwise not be fetched again
+    shared_tile_memory.clear()
+    api.num_tiles, api.num_bytes = 0, 0
+    start = time.perf_counter()
+    if zoom_level is None:
+        coupe.get_image(num_workers=num_tile_workers, create_pixmaps=False)
+    else:
+        coupe.get_region(zoom_level=zoom_level, rect=[[0, 0], [coupe.width, coupe.height]], num_workers=num_tile_workers)
+    duration = time.perf_counter() - start
+    return {'tiles': api.num_tiles, 'seconds': duration, 'tiles_per_second': api.num_tiles / duration,
+            'mb_per_second': api.num_bytes / duration / 1024 / 1024}
+
+
+def benchmark_case_load(api, user, study_id, case_id, num_tile_workers, num_coupe_workers, logger):
+    reconstruction = Reconstruction(slide_score_api=api, slide_score_user=user, logger=logger)
+    reconstruction.set_slide_score_study_and_case_id(slide_score_study_id=study_id, slide_score_case_id=case_id)
+    # the decoded tiles of an earlier phase (or the cold run) would otherwise not be fetched again, such that the
+    # warm run would not measure the tile cache on disk
+    shared_tile_memory.clear()
+    api.num_tiles, api.num_bytes = 0, 0
+    start = time.perf_counter()
+    # the same steps as the CoupeLoader, without the gui
+    reconstruction.get_coupe_ids()
+    coupes = [coupe for _, coupe, _, _ in reconstruction.iterate_coupes(num_tile_workers=num_tile_workers,
+                                                                        num_coupe_workers=num_coupe_workers)]
+    duration = time.perf_counter() - start
+    return {'coupes': len([coupe for coupe in coupes if coupe is not None]), 'tiles': api.num_tiles,
+            'seconds': duration}
+
+
+def run_benchmarks(server_url, api_token, user, study_id, case_id, image_ids, num_tile_workers, num_coupe_workers,
+                   num_requests, pool_size, zoom_level):
+    logger = logging.getLogger("benchmark")
+    logger.setLevel(logging.WARNING)
+    results = {}
+
+    api = CountingAPIClient(server_url, api_token, pool_size=pool_size)
+    results['perform_request'] = benchmark_perform_request(api, image_ids, num_requests)
+    results['get_metadata'] = benchmark_get_metadata(api, study_id, case_id, image_ids, logger)
+    results['get_image'] = benchmark_get_image(api, study_id, case_id, image_ids[0], num_tile_workers, logger)
+    results['get_region'] = benchmark_get_image(api, study_id, case_id, image_ids[-1], num_tile_workers, logger,
+                                                zoom_level=zoom_level)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        tile_cache = TileCache(cache_dir=cache_dir)
+        api = CountingAPIClient(server_url, api_token, pool_size=pool_size, tile_cache=tile_cache)
+        results['case_load_cold'] = benchmark_case_load(api, user, study_id, case_id, num_tile_workers,
+                                                        num_coupe_workers, logger)
+        api = CountingAPIClient(server_url, api_token, pool_size=pool_size, tile_cache=tile_cache)
+        results['case_load_warm'] = benchmark_case_load(api, user, study_id, case_id, num_tile_workers,
+                                                        num_coupe_workers, logger)
+    return results
+
+
+def print_results(results):
+    r = results['perform_request']
+    print(f"perform_request:   {r['requests_per_second']:8.1f} requests/s ({r['requests']} requests)")
+    r = results['get_metadata']
+    print(f"get_metadata:      {r['seconds_per_coupe'] * 1000:8.1f} ms/coupe ({r['coupes']} coupes)")
+    r = results['get_image']
+    print(f"get_image:         {r['tiles_per_second']:8.1f} tiles/s, {r['mb_per_second']:.2f} MB/s ({r['tiles']} tiles)")
+    r = results['get_region']
+    print(f"get_region:        {r['tiles_per_second']:8.1f} tiles/s, {r['mb_per_second']:.2f} MB/s ({r['tiles']} tiles)")
+    r = results['case_load_cold']
+    print(f"case load (cold):  {r['seconds']:8.2f} s ({r['coupes']} coupes, {r['tiles']} tiles)")
+    r = results['case_load_warm']
+    print(f"case load (warm):  {r['seconds']:8.2f} s ({r['coupes']} coupes, {r['tiles']} tiles)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark loading coupes from Slide Score")
+    parser.add_argument("--server", default=None, help="benchmark against this server instead of the local stand-in")
+    parser.add_argument("--api-token", default="stand-in")
+    parser.add_argument("--user", default="stand-in")
+    parser.add_argument("--study-id", type=int, default=2)
+    parser.add_argument("--case-id", type=int, default=13)
+    parser.add_argument("--image-ids", type=int, nargs="*", default=None, help="image ids, needed with --server")
+    parser.add_argument("--latency", type=float, default=0.02, help="latency of the stand-in server in seconds")
+    parser.add_argument("--pyramid-dir", default=None, help="let the stand-in serve the pyramids in this directory")
+    parser.add_argument("--num-images", type=int, default=4, help="number of synthetic images of the stand-in")
+    parser.add_argument("--num-tile-workers", type=int, default=8)
+    parser.add_argument("--num-coupe-workers", type=int, default=4)
+    parser.add_argument("--pool-size", type=int, default=32)
+    parser.add_argument("--num-requests", type=int, default=50)
+    parser.add_argument("--zoom-level", type=int, default=4, help="zoom level of the get_region benchmark")
+    parser.add_argument("--json", default=None, help="also write the results to this json file")
+    args = parser.parse_args()
+
+    stand_in = None
+    if args.server is None:
+        if args.pyramid_dir is not None:
+            stand_in = SlideScoreStandIn.create_from_directory(args.pyramid_dir, case_id=args.case_id,
+                                                               latency=args.latency).start()
+        else:
+            stand_in = SlideScoreStandIn.create_synthetic(num_images=args.num_images, case_id=args.case_id,
+                                                          latency=args.latency).start()
+        server_url = stand_in.server_url
+        image_ids = sorted(stand_in.pyramids)
+    else:
+        server_url = args.server
+        image_ids = args.image_ids
+
+    try:
+        results = run_benchmarks(server_url=server_url, api_token=args.api_token, user=args.user,
+                                 study_id=args.study_id, case_id=args.case_id, image_ids=image_ids,
+                                 num_tile_workers=args.num_tile_workers, num_coupe_workers=args.num_coupe_workers,
+                                 num_requests=args.num_requests, pool_size=args.pool_size,
+                                 zoom_level=args.zoom_level)
+    finally:
+        if stand_in is not None:
+            stand_in.stop()
+    print_results(results)
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent='\t')
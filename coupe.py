@@ -1,10 +1,10 @@
-from PIL import Image
 import numpy as np
-import requests
-import io
 import sys,traceback
 from PyQt5.QtGui import QPixmap, QImage
 
+from region_reader import RegionReader
+from tile_memory import shared_tile_memory
+
 
 class Coupe:
 
@@ -24,6 +24,9 @@ class Coupe:
 
     '''
 
+    # the decoded tiles of all coupes, used by get_region, see tile_memory
+    tile_memory = shared_tile_memory
+
     def __init__(self, slide_score_api,   slide_score_study_id, slide_score_case_id, slide_score_image_id,parent=None, logger=None):
 
         '''
@@ -43,6 +46,11 @@ class Coupe:
         self.slide_score_study_id=slide_score_study_id
         self.slide_score_api=slide_score_api
         self.img=None
+        # the semi transparent version of img, see get_trans_array
+        self.img_trans=None
+        # the QPixmaps of img and img_trans, see the properties pixmap and pixmap_trans
+        self.cached_pixmap=None
+        self.cached_pixmap_trans=None
         self.meta_data={}
 
 
@@ -57,109 +65,162 @@ class Coupe:
         obj.get_pixmaps_from_img()
         return obj
 
-    def get_image(self):
+    def get_image(self, num_workers=8, create_pixmaps=True):
         '''
         retreiving the image from slide score, using the tiles
+        the image is the overview of the complete coupe at zoom level 8, as read by get_region()
         the image is stored in self.img, which is a numpy array
         then get_pixmaps_from_img()  is called to get the QPicMap
+        :param num_workers: the number of tiles that are downloaded simultaneously
+        :param create_pixmaps: whether to call get_pixmaps_from_img(). Should be False when get_image is called
+        outside the GUI thread, as QPixmaps can not be created safely outside the GUI thread.
+        When True, a blue placeholder image is used if the image can not be read. When False, the exception is
+        raised, such that the loader (see Reconstruction.iterate_coupes) can skip the coupe
         :return:
         '''
 
         try:
-            zoom_level = 8
-            rect = [[0, 0], [self.width, self.height]]
-            max_level = max(self.width, self.height).bit_length()
-            x_from = int(rect[0][0] // (self.tile_width * 2 ** zoom_level))
-            x_to = int((rect[1][0]) // (self.tile_width * 2 ** zoom_level)) + 1
-            y_from = int(rect[0][1] // (self.tile_height * 2 ** zoom_level))
-            y_to = int((rect[1][1]) // (self.tile_height * 2 ** zoom_level)) + 1
-            img_width = (rect[1][0] - rect[0][0]) // (2 ** zoom_level) + 1
-            img_height = (rect[1][1] - rect[0][1]) // (2 ** zoom_level) + 1
-            self.img = np.zeros((img_height, img_width, 3), dtype=np.uint8)
-            self.logger.info(f"Getting image {self.slide_score_image_id}. Size: {img_width} x {img_height}")
-
-            for x in range(x_from, x_to):
-
-                left_img = min(max((x * self.tile_width * 2 ** zoom_level - rect[0][0]) // (2 ** zoom_level), 0), img_width - 1)
-                right_img = min(max((((x + 1) * self.tile_width - 1) * 2 ** zoom_level - rect[0][0]) // (2 ** zoom_level), 0),
-                                img_width - 1)
-                left_tile = (left_img + rect[0][0] // (2 ** zoom_level)) % self.tile_width
-                right_tile = (right_img + rect[0][0] // (2 ** zoom_level)) % self.tile_width
-
-                for y in range(y_from, y_to):
-
-                    url = self.slide_score_api.end_point.replace("/Api/",
-                                                f"/i/{self.slide_score_image_id}/{self.url}/i_files/{max_level - zoom_level}/{x}_{y}.jpeg")
-                    if True:
-                        r = requests.get(url, cookies={'t': self.cookie})
-                    first = False
-                    tile = Image.open(io.BytesIO(r.content))
-                    tile = np.asarray(tile)
-                    top_img = min(max((y * self.tile_height * 2 ** zoom_level - rect[0][1]) // (2 ** zoom_level), 0),
-                                  img_height - 1)
-                    bottom_img = min(
-                        max((((y + 1) * self.tile_height - 1) * 2 ** zoom_level - rect[0][1]) // (2 ** zoom_level), 0),
-                        img_height - 1)
-                    top_tile = (top_img + rect[0][1] // (2 ** zoom_level)) % self.tile_height
-                    bottom_tile = (bottom_img + rect[0][1] // (2 ** zoom_level)) % self.tile_height
-                    self.logger.info(f"Left_image: {left_img}, Right_image {right_img} {2 ** zoom_level}")
-                    self.logger.info(f"Left_tile: {left_tile}, Right_tile {right_tile}")
-                    self.logger.info(f"Top_image: {top_img}, Bottom_image {bottom_img}")
-                    self.logger.info(f"Top_tile: {top_tile}, Bottom_tile {bottom_tile}")
-
-                    self.img[top_img:bottom_img + 1, left_img: right_img + 1] = tile[top_tile:bottom_tile + 1,
-                                                                           left_tile: right_tile + 1]
-
+            self.img = self.get_region(zoom_level=8, rect=[[0, 0], [self.width, self.height]], num_workers=num_workers)
         except:
-
-            self.img=np.ones((100,100,3), dtype=np.uint8) * np.array([50,50,250], dtype=np.uint8).reshape((1,1,3))
             self.logger.error(sys.exc_info()[0])
             self.logger.error(traceback.format_exc())
-        self.get_pixmaps_from_img()
+            if not create_pixmaps:
+                raise
+            self.img=np.ones((100,100,3), dtype=np.uint8) * np.array([50,50,250], dtype=np.uint8).reshape((1,1,3))
+        if create_pixmaps:
+            self.get_pixmaps_from_img()
 
+    def get_region(self, zoom_level, rect, num_workers=8, out=None):
+        '''
+        reads a region of the coupe at a given zoom level from the Slide Score pyramid.
+        Only the tiles intersecting the region are fetched. The decoded tiles are kept in memory (self.tile_memory), such
+        that zooming in and out or panning over the same region does not fetch the same tiles again.
+        :param zoom_level: the zoom level, i.e. the region is downsampled by a factor 2**zoom_level.
+        zoom_level 0 is the full resolution
+        :param rect: the region [[left, top], [right, bottom]] in full resolution (level 0) pixel coordinates
+        :param num_workers: the number of tiles that are downloaded simultaneously
+        :param out: optional buffer (e.g. a memory mapped array) the region is written to. Its shape should be
+        RegionReader(rect, zoom_level, ...).shape
+        :return: the region as a numpy array
+        '''
+        level = self.max_level - zoom_level
+        region_reader = RegionReader(rect=rect, zoom_level=zoom_level, tile_width=self.tile_width, tile_height=self.tile_height)
+        self.logger.info(f"Getting region {rect} at zoom level {zoom_level} of image {self.slide_score_image_id}. Size: {region_reader.width} x {region_reader.height}")
+        return region_reader.read(load_tile=lambda key: self.get_tile_content(level=level, x=key[0], y=key[1]),
+                                  out=out,
+                                  num_workers=num_workers,
+                                  get_cached_tile=lambda key: self.get_tile_from_memory(level, key[0], key[1]),
+                                  on_tile=lambda key, tile: self.add_tile_to_memory(level, key[0], key[1], tile))
+
+    def get_tile_from_memory(self, level, x, y):
+        '''
+        :return: the decoded tile if it is kept in memory, otherwise None
+        '''
+        return self.tile_memory.get((self.slide_score_image_id, level, x, y))
 
-    def get_pixmaps_from_img(self):
+    def add_tile_to_memory(self, level, x, y, tile):
+        '''
+        keeps a decoded tile in memory. The memory is shared by all coupes and capped in size, see tile_memory
+        '''
+        self.tile_memory.put((self.slide_score_image_id, level, x, y), tile)
+
+    def get_tile_content(self, level, x, y):
+        '''
+        downloads a single tile from the Slide Score tile server.
+        This method is called from the worker threads of the TileFetcher, so it should not touch self.img
+        :param level: the level in the Slide Score pyramid
+        :param x: column of the tile
+        :param y: row of the tile
+        :return: the jpeg content of the tile
+        '''
+        return self.slide_score_api.get_tile(imageid=self.slide_score_image_id, level=level, x=x, y=y)
+
+
+    def get_pixmaps_from_img(self, img_trans=None):
         '''
         Creates self.pixmap from numpy array self.img. self.pixmap is a QPixmap which can be used directly
         by PyQt for rendering.
         Also creates self.trans_pixmap. This is similar to self.pixmap, but now it is semi transparent, such that
         it can be used as overlay over the slices for positioning of the coupes.
+        The pixmaps are created right away. When img_trans is known already (e.g. for a coupe read from a project
+        file), the pixmaps can be left to be created when they are first displayed, see the properties pixmap and
+        pixmap_trans.
+        :param img_trans: the semi transparent image as returned by get_trans_array, if it is known already. If None,
+        it is calculated from self.img
         :return: None
         '''
         try:
-            qimage = QImage(self.img, self.img.shape[1], self.img.shape[0], self.img.shape[1] * 3, QImage.Format_RGB888)
-            self.pixmap = QPixmap(qimage)
-            exp_mask = np.ones((self.img.shape[0], self.img.shape[1], 1)) * np.linalg.norm(
-                self.img - np.array([241, 241, 241]).reshape((1, 1, 3)), axis=2, keepdims=True) / 20
-
-            arr_photo = np.concatenate((self.img[:, :, 2:3], self.img[:, :, 1:2], self.img[:, :, 0:1], 255 * exp_mask),
-                                       axis=2).astype(np.uint8)
-            self.logger.info(f"arr_photo {arr_photo.shape}")
-
-            qimage_trans = QImage(arr_photo, arr_photo.shape[1], arr_photo.shape[0],
-                                  QImage.Format_ARGB32)
-            self.pixmap_trans = QPixmap(qimage_trans)
+            self.img_trans = img_trans
+            self.cached_pixmap = self.create_pixmap()
+            self.cached_pixmap_trans = self.create_pixmap_trans()
             return
         except:
 
             self.logger.error(sys.exc_info()[0])
             self.logger.error(traceback.format_exc())
 
+    @property
+    def pixmap(self):
+        '''
+        the image as a QPixmap, created when first used. As QPixmaps can only be created safely in the GUI thread,
+        the property should only be used from the GUI thread
+        '''
+        if self.cached_pixmap is None:
+            self.cached_pixmap = self.create_pixmap()
+        return self.cached_pixmap
+
+    @property
+    def pixmap_trans(self):
+        '''
+        the semi transparent image as a QPixmap, created when first used, from the GUI thread
+        '''
+        if self.cached_pixmap_trans is None:
+            self.cached_pixmap_trans = self.create_pixmap_trans()
+        return self.cached_pixmap_trans
+
+    def create_pixmap(self):
+        '''
+        :return: self.img as a QPixmap
+        '''
+        qimage = QImage(self.img, self.img.shape[1], self.img.shape[0], self.img.shape[1] * 3, QImage.Format_RGB888)
+        return QPixmap(qimage)
+
+    def create_pixmap_trans(self):
+        '''
+        :return: self.img_trans as a QPixmap. self.img_trans is calculated first if it is not known yet
+        '''
+        if self.img_trans is None:
+            # the semi transparent image is kept, such that it can be saved in the project file
+            self.img_trans = self.get_trans_array()
+        self.logger.info(f"arr_photo {self.img_trans.shape}")
+        img_trans = self.img_trans
+        if img_trans.ctypes.data % 4 != 0:
+            # QImage requires 32-bit aligned data for ARGB32, so a mapped array that is not aligned is copied
+            img_trans = np.array(img_trans)
+        qimage_trans = QImage(img_trans, img_trans.shape[1], img_trans.shape[0], QImage.Format_ARGB32)
+        return QPixmap(qimage_trans)
+
+    def get_trans_array(self):
+        '''
+        :return: the semi transparent version of self.img, as an ARGB32 array of shape (h, w, 4): the background
+        (241, 241, 241) is transparent, the more a pixel differs from the background the more opaque it is
+        '''
+        exp_mask = np.ones((self.img.shape[0], self.img.shape[1], 1)) * np.linalg.norm(
+            self.img - np.array([241, 241, 241]).reshape((1, 1, 3)), axis=2, keepdims=True) / 20
+
+        return np.concatenate((self.img[:, :, 2:3], self.img[:, :, 1:2], self.img[:, :, 0:1], 255 * exp_mask),
+                              axis=2).astype(np.uint8)
+
 
     def get_metadata(self):
         '''
         reads the meta data for the coupe from the Slide Score API.
+        The API client caches the meta data, so this only results in a request the first time an image is seen.
+        The url and cookie for reading the tiles are no longer part of the meta data, the API client keeps
+        track of them (and refreshes them when they expire) when the tiles are requested.
         :return:
         '''
-        response = self.slide_score_api.perform_request("GetImageMetadata?imageId=" + str(self.slide_score_image_id), None, method="GET")
-        rjson = response.json()
-        self.meta_data = rjson['metadata']
-
-        # also getting the url and cookie for reading the slices
-        response = self.slide_score_api.perform_request("GetTileServer?imageId=" + str(self.slide_score_image_id), None, method="GET")
-        rjson = response.json()
-        self.meta_data['cookie']=rjson['cookiePart']
-        self.meta_data['url']=rjson['urlPart']
+        self.meta_data = dict(self.slide_score_api.get_image_metadata(self.slide_score_image_id))
         self.process_meta_data()
         return self.meta_data
 
@@ -173,10 +234,10 @@ class Coupe:
         self.width=self.meta_data['level0Width']
         self.height=self.meta_data['level0Height']
         self.size=[self.width,self.height]
+        # the level in the Slide Score pyramid with the full resolution image
+        self.max_level = max(self.width, self.height).bit_length()
         self.mpp_x=self.meta_data['mppX']
         self.mpp_y=self.meta_data['mppY']
-        self.cookie = self.meta_data['cookie']
-        self.url=self.meta_data['url']
 
 
     def remove_non_serializable_objects(self):
@@ -188,8 +249,10 @@ class Coupe:
         del self.parent
         del self.logger
         del self.slide_score_api
-        del self.pixmap_trans
-        del self.pixmap
+        self.cached_pixmap_trans = None
+        self.cached_pixmap = None
+        # the semi transparent image is calculated again when it is needed
+        self.img_trans = None
         return
 
     def restore_non_serializable_objects(self, parent, logger, slide_score_api):
@@ -204,13 +267,54 @@ class Coupe:
         self.parent=parent
         self.logger=logger
         self.slide_score_api=slide_score_api
-        self.get_pixmaps_from_img()
+        # older pickles have no img_trans and no max_level
+        self.img_trans=getattr(self, "img_trans", None)
+        if self.meta_data:
+            self.process_meta_data()
+        # the pixmaps are created when the coupe is first displayed
+        self.cached_pixmap=None
+        self.cached_pixmap_trans=None
         return
 
 
+    def get_project_data(self):
+        '''
+        the meta data of the coupe for the project file (see project_file). The image is stored as an array
+        :return: a json serialisable dict
+        '''
+        return {'id': self.slide_score_image_id, 'meta_data': self.meta_data}
+
+    @classmethod
+    def create_from_project_data(cls, data, img, img_trans, slide_score_api, slide_score_study_id, slide_score_case_id,
+                                 parent=None, logger=None):
+        '''
+        creates a coupe as saved in a project file, without contacting Slide Score
+        :param data: the meta data, as returned by get_project_data
+        :param img: the image
+        :param img_trans: the semi transparent image, or None to calculate it from the image
+        :return: the coupe
+        '''
+        obj = cls(slide_score_api=slide_score_api, slide_score_study_id=slide_score_study_id,
+                  slide_score_case_id=slide_score_case_id, slide_score_image_id=data['id'], parent=parent,
+                  logger=logger)
+        obj.restore_from_project_data(data=data, img=img, img_trans=img_trans)
+        return obj
+
+    def restore_from_project_data(self, data, img, img_trans):
+        '''
+        sets the meta data and the image as saved in a project file. The image may be memory mapped, the pixmaps are
+        only created when the coupe is first displayed
+        '''
+        self.meta_data = data['meta_data']
+        self.process_meta_data()
+        self.img = img
+        self.img_trans = img_trans
+        self.cached_pixmap = None
+        self.cached_pixmap_trans = None
+
     @classmethod
-    def create_from_slide_score(cls, slide_score_api, slide_score_study_id, slide_score_case_id,  slide_score_image_id,  parent=None, logger=None):
+    def create_from_slide_score(cls, slide_score_api, slide_score_study_id, slide_score_case_id,  slide_score_image_id,  parent=None, logger=None, num_workers=8):
         obj=cls(slide_score_api=slide_score_api, slide_score_study_id=slide_score_study_id, slide_score_case_id=slide_score_case_id, slide_score_image_id=slide_score_image_id, parent = parent, logger = logger)
         obj.get_metadata()
-        obj.get_image()
+        obj.get_image(num_workers=num_workers)
         return obj
@@ -0,0 +1,63 @@
+import sys
+import traceback
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+
+class CoupeLoader(QThread):
+    '''
+    The CoupeLoader loads the coupes of a reconstruction in a background thread, such that the gui stays
+    responsive while the coupes are downloaded from Slide Score.
+
+    For every coupe that finishes loading, the signal coupe_loaded is emitted. Qt delivers the signal in the
+    GUI thread, which is where the coupe is added to the reconstruction and its QPixmaps are created.
+    The CoupeLoader itself never modifies the reconstruction's coupes.
+    Loading is stopped with requestInterruption(): the coupes that are still being downloaded are not emitted.
+    '''
+
+    # emitted per finished coupe with (coupe, cnt, total). coupe is None if the coupe failed to load
+    coupe_loaded = pyqtSignal(object, int, int)
+
+    def __init__(self, reconstruction, max_cnt_coupes=-1, num_tile_workers=8, num_coupe_workers=4, logger=None,
+                 local_slide_dir=None):
+        '''
+        :param reconstruction: the reconstruction for which the coupes are loaded
+        :param max_cnt_coupes: maximum number of coupes to be loaded
+        :param num_tile_workers: the number of tiles that are downloaded simultaneously per coupe
+        :param num_coupe_workers: the number of coupes that are loaded simultaneously
+        :param logger: the logger
+        :param local_slide_dir: if set, the coupes are read from the slides in this directory instead of from Slide Score
+        '''
+        super().__init__()
+        self.reconstruction = reconstruction
+        self.max_cnt_coupes = max_cnt_coupes
+        self.num_tile_workers = num_tile_workers
+        self.num_coupe_workers = num_coupe_workers
+        self.logger = logger
+        self.local_slide_dir = local_slide_dir
+        # the coupes the reconstruction has already (e.g. restored from an autosave) are not loaded again
+        self.skip_ids = set(reconstruction.coupes)
+
+    def run(self):
+        try:
+            if self.local_slide_dir is None:
+                self.reconstruction.get_coupe_ids()
+                local_coupes = None
+            else:
+                local_coupes = self.reconstruction.create_local_coupes(self.local_slide_dir)
+            coupes = self.reconstruction.iterate_coupes(max_cnt=self.max_cnt_coupes,
+                                                        num_tile_workers=self.num_tile_workers,
+                                                        num_coupe_workers=self.num_coupe_workers,
+                                                        coupes=local_coupes,
+                                                        skip_ids=self.skip_ids,
+                                                        is_cancelled=self.isInterruptionRequested)
+            for slide_score_image_id, coupe, cnt, total in coupes:
+                if self.isInterruptionRequested():
+                    coupes.close()
+                    break
+                self.coupe_loaded.emit(coupe, cnt, total)
+            if self.isInterruptionRequested():
+                self.logger.info("Loading coupes cancelled")
+        except:
+            self.logger.error(sys.exc_info()[0])
+            self.logger.error(traceback.format_exc())
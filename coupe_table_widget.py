@@ -93,7 +93,7 @@ class CoupeTableWidget(QTableWidget):
                     item = QTableWidgetItem(f"")
                     item.coupe = coupe
                     self.setItem(row_to_add, img_col['col'], item)
-                    self.setCellWidget(row_to_add, img_col['col'], ImageWidget(image=coupe.pixmap, parent=self))
+                    self.setCellWidget(row_to_add, img_col['col'], ImageWidget(coupe=coupe, parent=self))
 
             for j in range(len(coupes_in_widget_present_in_app) - 1, -1, -1):
                 if not coupes_in_widget_present_in_app[j]:
@@ -128,18 +128,21 @@ class CoupeTableWidget(QTableWidget):
 class ImageWidget(QWidget):
     '''
     A simple class for rendering images of the coupes as part of the CoupeTableWidget
+    The pixmap of the coupe is only requested when the widget is painted, i.e. when its row is scrolled into view,
+    such that the pixmaps of coupes that are not displayed are not created.
     '''
 
-    def __init__(self, image, parent):
+    def __init__(self, coupe, parent):
         super(ImageWidget, self).__init__(parent)
-        self.image = image
+        self.coupe = coupe
         self.parent = parent
         self.setFixedWidth(self.parent.image_width)
 
     def paintEvent(self, event):
         painter = QPainter(self)
+        image = self.coupe.pixmap
         # todo: retain aspect ratio
         target = QRect(0, 0, self.width(), self.height())
-        source = QRect(0, 0, self.image.width(), self.image.height())
-        painter.drawPixmap(target, self.image, source)
+        source = QRect(0, 0, image.width(), image.height())
+        painter.drawPixmap(target, image, source)
 
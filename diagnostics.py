@@ -0,0 +1,102 @@
+import itertools
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+
+class DiagnosticsWriter():
+    '''
+    The DiagnosticsWriter writes diagnostic figures, e.g. of the masks used in the segmentation, to png files.
+
+    The figures are built and written in a background thread, with the Agg backend (no pyplot), such that the
+    segmentation never waits for them and no display is needed. When the DiagnosticsWriter is not enabled,
+    which is the default, submitting a figure does nothing at all.
+    '''
+
+    def __init__(self, enabled=False, directory="diagnostics", logger=None):
+        '''
+        :param enabled: if False, no figures are made
+        :param directory: the directory the figures are written to
+        :param logger: the logger
+        '''
+        self.enabled = enabled
+        self.directory = Path(directory)
+        self.logger = logger
+        self.counter = itertools.count()
+        self.executor = ThreadPoolExecutor(max_workers=1) if enabled else None
+
+    def submit(self, name, plot_function, *args):
+        '''
+        schedules a figure to be written
+        :param name: the name of the figure, used in the file name
+        :param plot_function: a function plot_function(fig, *args) drawing on the matplotlib Figure fig
+        :param args: the arguments for plot_function. These should not be modified afterwards
+        :return: None
+        '''
+        if not self.enabled:
+            return
+        file_name = f"{time.strftime('%Y%m%d_%H%M%S')}_{next(self.counter):04d}_{name}.png"
+        self.executor.submit(self.write, self.directory / file_name, plot_function, args)
+
+    def write(self, path, plot_function, args):
+        try:
+            fig = Figure(figsize=(10, 12))
+            FigureCanvasAgg(fig)
+            plot_function(fig, *args)
+            fig.tight_layout()
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fig.savefig(path)
+            self.logger.debug(f"Written diagnostics to {path}")
+        except:
+            self.logger.error(sys.exc_info()[0])
+            self.logger.error(traceback.format_exc())
+
+    def shutdown(self):
+        '''
+        waits for the figures that are still being written
+        :return: None
+        '''
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+
+
+def plot_inner_and_outer_mask(fig, arr, middle_mask, inner_mask, outer_mask):
+    '''
+    the rasterised traces and the masks derived from it, see Slice.create_inner_and_outer_mask
+    '''
+    axs = fig.subplots(2, 2)
+    axs[0, 0].imshow(arr)
+    axs[0, 1].imshow(middle_mask)
+    axs[1, 0].imshow(inner_mask)
+    axs[1, 1].imshow(outer_mask)
+    for axh in axs:
+        for ax in axh:
+            ax.set_aspect('equal')
+
+
+def plot_foreground_background_mask(fig, pixels, inner_mask, outer_mask, mask):
+    '''
+    the seed masks, the slice photo, the resulting mask, and the slice photo with the background resp. the
+    foreground replaced by its mean color
+    '''
+    bool_mask = mask.astype(bool)
+    color_inner = np.mean(pixels[bool_mask], axis=0, dtype=int)
+    color_outer = np.mean(pixels[~bool_mask], axis=0, dtype=int)
+    exp_mask = np.expand_dims(mask, -1).astype(int)
+    axs = fig.subplots(3, 2)
+    axs[0, 0].imshow(1 * inner_mask - 1 * outer_mask)
+    axs[0, 1].imshow(pixels)
+    axs[1, 0].imshow(mask, vmin=0, vmax=1)
+    axs[1, 1].imshow(mask, vmin=0, vmax=1)
+    axs[2, 0].imshow((exp_mask * pixels + (1 - exp_mask) * color_inner).astype(np.uint8))
+    axs[2, 1].imshow(((1 - exp_mask) * pixels + exp_mask * color_outer).astype(np.uint8))
+    for axh in axs:
+        for ax in axh:
+            ax.set_aspect('equal')
+            ax.set_axis_off()
@@ -0,0 +1,92 @@
+'''
+The autosave journal: an append-only file with the changes made to a reconstruction, one json object per line.
+
+Every entry has a sequence number (seq), the name of the change (event) and its data, e.g.
+    {"slice_index": 0, "x": 120, "y": 85, "seq": 42, "event": "trace_point"}
+See Reconstruction.apply_journal_entry for the events.
+
+The journal is the incremental part of the autosave: a full snapshot of the reconstruction is written now and then
+as a project file (see project_file), with the sequence number of the last entry it includes, after which the journal
+is started anew. A session is restored by loading the snapshot and replaying the entries with a higher sequence
+number. Entries are flushed as they are written, so they survive a crash of the application.
+'''
+
+import json
+import logging
+from pathlib import Path
+
+
+class Journal():
+    '''
+    The journal, opened for appending entries
+    '''
+
+    def __init__(self, path, seq=0, logger=None):
+        '''
+        :param path: the path of the journal file. Existing entries are kept
+        :param seq: the sequence number of the last entry written so far
+        :param logger: the logger
+        '''
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.seq = seq
+        # the number of entries in the journal file since it was last started anew
+        self.num_entries = 0
+        self.logger = logger if logger is not None else logging.getLogger('Journal Logger')
+        if self.path.exists():
+            # a last line that was only partly written (see read_journal) is removed, before appending after it
+            with open(self.path, "rb+") as f:
+                f.truncate(f.read().rfind(b"\n") + 1)
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    def record(self, event, **data):
+        '''
+        appends an entry to the journal
+        :param event: the name of the change
+        :param data: the data of the change, json serialisable
+        :return: the sequence number of the entry
+        '''
+        self.seq += 1
+        self.file.write(json.dumps(dict(data, seq=self.seq, event=event)) + "\n")
+        self.file.flush()
+        self.num_entries += 1
+        return self.seq
+
+    def restart(self):
+        '''
+        empties the journal, after all its entries have been written to a snapshot. The sequence numbers continue
+        :return: None
+        '''
+        self.file.close()
+        self.file = open(self.path, "w", encoding="utf-8")
+        self.num_entries = 0
+
+    def close(self):
+        self.file.close()
+
+
+def read_journal(path, logger=None):
+    '''
+    reads the entries of a journal file. A last line that was only partly written (when the application crashed
+    while writing it) is skipped
+    :param path: the path of the journal file
+    :param logger: the logger
+    :return: a list with the entries, in order. Empty if there is no journal file
+    '''
+    path = Path(path)
+    if not path.exists():
+        return []
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    for i, line in enumerate(lines):
+        if line.strip() == "":
+            continue
+        try:
+            entries.append(json.loads(line))
+        except json.JSONDecodeError:
+            if i < len(lines) - 1:
+                raise
+            if logger is not None:
+                logger.warning(f"Skipping the incomplete last entry of {path}")
+    return entries
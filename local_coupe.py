@@ -0,0 +1,156 @@
+from pathlib import Path
+
+import numpy as np
+
+from coupe import Coupe
+
+try:
+    import slideio
+except ImportError:
+    slideio = None
+
+
+class LocalCoupe(Coupe):
+    '''
+    A coupe that is read from a local whole slide image file, e.g. an SVS file downloaded with
+    APIClient.download_slide, instead of from the Slide Score server.
+
+    The LocalCoupe has the same interface as the Coupe (get_metadata, get_image, get_region), such that a case can
+    be reconstructed entirely from local disk. The pixels are read with slideio, which reads the requested block
+    from the most suitable level of the file, so regions can be read at any zoom level without going through tiles.
+    '''
+
+    def __init__(self, slide_path, slide_score_study_id=-1, slide_score_case_id=-1, slide_score_image_id=None,
+                 parent=None, logger=None, driver="SVS"):
+        '''
+        :param slide_path: path to the whole slide image file
+        :param slide_score_study_id: the study id, if known
+        :param slide_score_case_id: the case id, if known
+        :param slide_score_image_id: the image id. If None, the name of the file (without extension) is used, as
+        an int if possible
+        :param parent: the parent
+        :param logger: the logger
+        :param driver: the slideio driver for the file, e.g. "SVS" or "GDAL"
+        '''
+        slide_path = Path(slide_path)
+        if slide_score_image_id is None:
+            slide_score_image_id = int(slide_path.stem) if slide_path.stem.isdigit() else slide_path.stem
+        super().__init__(slide_score_api=None, slide_score_study_id=slide_score_study_id,
+                         slide_score_case_id=slide_score_case_id, slide_score_image_id=slide_score_image_id,
+                         parent=parent, logger=logger)
+        self.slide_path = str(slide_path)
+        self.driver = driver
+        self.scene = None
+
+    @classmethod
+    def create_copy(cls, coupe, parent=None, logger=None):
+        obj = cls(slide_path=coupe.slide_path, slide_score_study_id=coupe.slide_score_study_id,
+                  slide_score_case_id=coupe.slide_score_case_id, slide_score_image_id=coupe.slide_score_image_id,
+                  parent=parent, logger=logger, driver=coupe.driver)
+        obj.img = coupe.img
+        obj.meta_data = coupe.meta_data
+        obj.process_meta_data()
+        obj.get_pixmaps_from_img()
+        return obj
+
+    @classmethod
+    def create_from_directory(cls, slide_dir, slide_score_study_id=-1, slide_score_case_id=-1, parent=None,
+                              logger=None, pattern="*.svs"):
+        '''
+        creates a LocalCoupe for every slide in a directory, without reading them yet
+        :param slide_dir: the directory with the slides
+        :param pattern: the pattern the file names of the slides should match
+        :return: a list of LocalCoupes, sorted on file name
+        '''
+        return [cls(slide_path=slide_path, slide_score_study_id=slide_score_study_id,
+                    slide_score_case_id=slide_score_case_id, parent=parent, logger=logger)
+                for slide_path in sorted(Path(slide_dir).glob(pattern))]
+
+    def open_scene(self):
+        '''
+        opens the slide, if not opened yet
+        :return: the slideio scene
+        '''
+        if self.scene is None:
+            if slideio is None:
+                raise ImportError("slideio is required for reading local slides")
+            self.scene = slideio.open_slide(self.slide_path, self.driver).get_scene(0)
+        return self.scene
+
+    def get_metadata(self):
+        '''
+        reads the meta data from the slide, in the same format as the meta data from Slide Score
+        :return: the meta data
+        '''
+        scene = self.open_scene()
+        width, height = scene.size
+        # slideio gives the resolution in meters per pixel
+        resolution = scene.resolution
+        self.meta_data = {'level0Width': width, 'level0Height': height,
+                          'level0TileWidth': 256, 'level0TileHeight': 256,
+                          'mppX': resolution[0] * 1e6, 'mppY': resolution[1] * 1e6}
+        self.process_meta_data()
+        return self.meta_data
+
+    def get_region(self, zoom_level, rect, num_workers=8, out=None):
+        '''
+        reads a region of the slide at a given zoom level, with one block read
+        The result has the same shape and alignment as Coupe.get_region
+        :param zoom_level: the zoom level, i.e. the region is downsampled by a factor 2**zoom_level.
+        :param rect: the region [[left, top], [right, bottom]] in full resolution (level 0) pixel coordinates
+        :param num_workers: not used, present for compatibility with Coupe.get_region
+        :param out: optional buffer the region is written to
+        :return: the region as a numpy array
+        '''
+        scale = 2 ** zoom_level
+        img_width = (rect[1][0] - rect[0][0]) // scale + 1
+        img_height = (rect[1][1] - rect[0][1]) // scale + 1
+        if out is None:
+            out = np.zeros((img_height, img_width, 3), dtype=np.uint8)
+        elif tuple(out.shape) != (img_height, img_width, 3):
+            raise ValueError(f"Output buffer has shape {out.shape}, expected {(img_height, img_width, 3)}")
+        self.logger.info(f"Getting region {rect} at zoom level {zoom_level} of {self.slide_path}. Size: {img_width} x {img_height}")
+
+        # only read the part of the region that lies within the slide
+        left = max(rect[0][0], 0)
+        top = max(rect[0][1], 0)
+        block_width = min(img_width * scale, self.width - left)
+        block_height = min(img_height * scale, self.height - top)
+        if block_width <= 0 or block_height <= 0:
+            return out
+        size = (-(-block_width // scale), -(-block_height // scale))
+        block = self.open_scene().read_block(rect=(left, top, block_width, block_height), size=size)
+        first_col = (left - rect[0][0]) // scale
+        first_row = (top - rect[0][1]) // scale
+        block = block[:img_height - first_row, :img_width - first_col, :3]
+        out[first_row:first_row + block.shape[0], first_col:first_col + block.shape[1]] = block
+        return out
+
+    def get_project_data(self):
+        '''
+        the meta data of the coupe for the project file, including the path to the slide
+        :return: a json serialisable dict
+        '''
+        return dict(super().get_project_data(), slide_path=self.slide_path, driver=self.driver)
+
+    @classmethod
+    def create_from_project_data(cls, data, img, img_trans, slide_score_api, slide_score_study_id, slide_score_case_id,
+                                 parent=None, logger=None):
+        '''
+        creates a local coupe as saved in a project file, without opening the slide
+        :return: the coupe
+        '''
+        obj = cls(slide_path=data['slide_path'], slide_score_study_id=slide_score_study_id,
+                  slide_score_case_id=slide_score_case_id, slide_score_image_id=data['id'], parent=parent,
+                  logger=logger, driver=data.get('driver', "SVS"))
+        obj.restore_from_project_data(data=data, img=img, img_trans=img_trans)
+        return obj
+
+    def remove_non_serializable_objects(self):
+        '''
+        removing the non serializable objects, including the opened slide
+        :return: None
+        '''
+        super().remove_non_serializable_objects()
+        self.scene = None
+        return
@@ -0,0 +1,127 @@
+'''
+Run length encoding of binary masks, for storing the masks of the slices in the json file.
+
+A mask is raveled and stored as the lengths of its runs of equal values, alternating between runs of zeros and runs
+of ones and always starting with a run of zeros (which has length 0 if the mask starts with a one).
+The run lengths are written either as a plain list of ints, or, more compactly, as LEB128 varints (7 bits per byte,
+the high bit marking that more bytes follow) in a base64 string.
+
+All encoding and decoding is vectorized with numpy, without Python loops over the runs.
+'''
+
+import base64
+
+import numpy as np
+
+
+def encode_runs(mask):
+    '''
+    :param mask: a binary mask, of any shape
+    :return: the run lengths of the raveled mask, starting with a run of zeros
+    '''
+    flat = np.asarray(mask).ravel().astype(bool)
+    if flat.size == 0:
+        return np.zeros(0, dtype=np.int64)
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    runs = np.diff(np.concatenate(([0], changes, [flat.size])))
+    if flat[0]:
+        runs = np.concatenate(([0], runs))
+    return runs.astype(np.int64)
+
+
+def decode_runs(runs, shape):
+    '''
+    :param runs: the run lengths, as returned by encode_runs
+    :param shape: the shape of the mask
+    :return: the mask as a boolean array
+    '''
+    runs = np.asarray(runs, dtype=np.int64)
+    values = np.arange(len(runs)) % 2 == 1
+    flat = np.repeat(values, runs)
+    if flat.size != int(np.prod(shape)):
+        raise ValueError(f"The runs add up to {flat.size} pixels, expected {int(np.prod(shape))} for shape {shape}")
+    return flat.reshape(shape)
+
+
+def encode_varints(values):
+    '''
+    :param values: non-negative integers
+    :return: the values as LEB128 varints, in bytes
+    '''
+    values = np.asarray(values, dtype=np.uint64)
+    if values.size == 0:
+        return b""
+    num_bytes = np.ones(values.size, dtype=np.int64)
+    remainder = values >> np.uint64(7)
+    while remainder.any():
+        num_bytes += remainder > 0
+        remainder >>= np.uint64(7)
+    byte_index = np.arange(num_bytes.max())
+    groups = ((values[:, None] >> (np.uint64(7) * byte_index.astype(np.uint64))) & np.uint64(0x7f)).astype(np.uint8)
+    # the high bit is set on all bytes of a value but its last
+    groups[byte_index[None, :] < num_bytes[:, None] - 1] |= 0x80
+    return groups[byte_index[None, :] < num_bytes[:, None]].tobytes()
+
+
+def decode_varints(data):
+    '''
+    :param data: LEB128 varints, in bytes
+    :return: the values as an int64 array
+    '''
+    data = np.frombuffer(data, dtype=np.uint8)
+    if data.size == 0:
+        return np.zeros(0, dtype=np.int64)
+    ends = np.flatnonzero(data < 0x80)
+    if len(ends) == 0 or ends[-1] != data.size - 1:
+        raise ValueError("Truncated varint data")
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    # the position of every byte within its value
+    position = np.arange(data.size) - np.repeat(starts, ends - starts + 1)
+    parts = (data & 0x7f).astype(np.uint64) << (np.uint64(7) * position.astype(np.uint64))
+    return np.add.reduceat(parts, starts).astype(np.int64)
+
+
+def encode_mask(mask, encoding="varint_base64"):
+    '''
+    :param mask: a binary mask
+    :param encoding: "varint_base64" for a compact base64 string, or "list" for a plain list of run lengths
+    :return: a json serialisable dict with the shape, the encoding and the runs
+    '''
+    runs = encode_runs(mask)
+    if encoding == "varint_base64":
+        payload = base64.b64encode(encode_varints(runs)).decode("ascii")
+    elif encoding == "list":
+        payload = runs.tolist()
+    else:
+        raise ValueError(f"Unknown mask encoding {encoding}")
+    return {'shape': list(np.shape(mask)), 'encoding': encoding, 'runs': payload}
+
+
+def decode_mask(data):
+    '''
+    :param data: a dict as returned by encode_mask
+    :return: the mask as a boolean array
+    '''
+    if data['encoding'] == "varint_base64":
+        runs = decode_varints(base64.b64decode(data['runs']))
+    elif data['encoding'] == "list":
+        runs = data['runs']
+    else:
+        raise ValueError(f"Unknown mask encoding {data['encoding']}")
+    return decode_runs(runs, tuple(data['shape']))
+
+
+def decode_transitions(shape, mask_ones, mask_minus_ones):
+    '''
+    decodes the older mask format, with the distances between the 0 to 1 transitions (mask_ones) and between the
+    1 to 0 transitions (mask_minus_ones) of the raveled mask
+    :param shape: the shape of the mask
+    :param mask_ones: the distances between positions in the raveled mask for 0 to 1 transitions
+    :param mask_minus_ones: the distances between positions in the raveled mask for 1 to 0 transitions
+    :return: the mask as a boolean array
+    '''
+    steps = np.zeros(int(np.prod(shape)) + 1, dtype=np.int8)
+    # the first distance is counted from the position before the first pixel
+    steps[np.cumsum(mask_ones, dtype=np.int64) + 1] = 1
+    steps[np.cumsum(mask_minus_ones, dtype=np.int64) + 1] = -1
+    return (np.cumsum(steps[:-1]) > 0).reshape(shape)
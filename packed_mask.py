@@ -0,0 +1,66 @@
+import numpy as np
+
+
+class PackedMask():
+    '''
+    A binary mask, stored compactly: only the bounding box of the foreground is kept, with 1 bit per pixel
+    (np.packbits). Outside the bounding box the mask is 0.
+
+    Compared to an int64 array this is 64 times smaller, and smaller still when the foreground covers only part of
+    the slice. The full mask is unpacked on request, with to_array, or by numpy (np.asarray(mask)).
+    '''
+
+    def __init__(self, shape, bbox=(0, 0, 0, 0), bits=None):
+        '''
+        :param shape: the shape (h, w) of the full mask
+        :param bbox: the bounding box (top, left, height, width) of the foreground
+        :param bits: the packed bits of the mask within the bounding box
+        '''
+        self.shape = tuple(int(i) for i in shape)
+        self.bbox = tuple(int(i) for i in bbox)
+        self.bits = bits if bits is not None else np.zeros(0, dtype=np.uint8)
+
+    @classmethod
+    def create_from_array(cls, mask):
+        '''
+        :param mask: a mask as a numpy array, any non zero value is foreground
+        :return: the PackedMask
+        '''
+        mask = np.asarray(mask).astype(bool, copy=False)
+        rows = np.flatnonzero(mask.any(axis=1))
+        if len(rows) == 0:
+            return cls(shape=mask.shape)
+        cols = np.flatnonzero(mask.any(axis=0))
+        top, left = rows[0], cols[0]
+        crop = mask[top:rows[-1] + 1, left:cols[-1] + 1]
+        return cls(shape=mask.shape, bbox=(top, left, crop.shape[0], crop.shape[1]), bits=np.packbits(crop, axis=None))
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    def get_crop(self):
+        '''
+        :return: the mask within the bounding box, as a boolean array
+        '''
+        top, left, height, width = self.bbox
+        return np.unpackbits(self.bits, count=height * width).reshape((height, width)).astype(bool)
+
+    def to_array(self, dtype=bool):
+        '''
+        :param dtype: the dtype of the result
+        :return: the full mask as a numpy array, with 1 (or True) for the foreground
+        '''
+        out = np.zeros(self.shape, dtype=dtype)
+        top, left, height, width = self.bbox
+        out[top:top + height, left:left + width] = self.get_crop()
+        return out
+
+    def count(self):
+        '''
+        :return: the number of foreground pixels
+        '''
+        return int(np.unpackbits(self.bits).sum())
+
+    def __array__(self, dtype=None, copy=None):
+        return self.to_array(dtype=bool if dtype is None else dtype)
@@ -0,0 +1,127 @@
+import cv2
+import numpy as np
+from sklearn.svm import SVC
+
+
+class SVCPixelClassifier():
+    '''
+    Classifies pixels as foreground (1) or background (0) on their RGB color with an RBF SVM.
+    The SVM is evaluated on every pixel, which costs O(pixels x support vectors): exact, but slow on large slices.
+    '''
+
+    def __init__(self):
+        self.svm = None
+
+    def fit(self, X, y):
+        '''
+        :param X: the training pixels, an array of shape (n, 3)
+        :param y: the labels, 1 for foreground and 0 for background
+        :return: the classifier itself
+        '''
+        self.svm = SVC().fit(X=X, y=np.ravel(y))
+        return self
+
+    def predict(self, pixels):
+        '''
+        :param pixels: an array of shape (n, 3)
+        :return: the labels of the pixels
+        '''
+        return self.svm.predict(pixels)
+
+    def decision_function(self, pixels):
+        '''
+        :param pixels: an array of shape (n, 3)
+        :return: the decision values of the pixels, positive for foreground
+        '''
+        return self.svm.decision_function(pixels)
+
+
+class LookupTablePixelClassifier(SVCPixelClassifier):
+    '''
+    Trains the same SVM as the SVCPixelClassifier, but evaluates it only once, on a grid of quantized RGB colors.
+    Classifying the pixels of a slice is then a single vectorized table lookup, independent of the number of
+    support vectors.
+
+    With the default of 5 bits per channel the table has 32768 entries, and the colors are quantized in steps of 8,
+    which is small compared to the width of the RBF kernel on RGB pixels.
+    '''
+
+    def __init__(self, bits=5):
+        '''
+        :param bits: the number of bits per color channel used for quantizing the colors
+        '''
+        super().__init__()
+        self.bits = bits
+        self.table = None
+
+    def fit(self, X, y):
+        super().fit(X=X, y=y)
+        # evaluate the SVM on the center of every bin of the quantized RGB cube
+        step = 2 ** (8 - self.bits)
+        centers = np.arange(2 ** self.bits) * step + (step - 1) / 2
+        r, g, b = np.meshgrid(centers, centers, centers, indexing='ij')
+        grid = np.stack((r.ravel(), g.ravel(), b.ravel()), axis=-1)
+        self.table = self.svm.decision_function(grid).astype(np.float32)
+        return self
+
+    def get_indices(self, pixels):
+        '''
+        :param pixels: an array of shape (n, 3) with uint8 RGB colors
+        :return: the index of every pixel in the lookup table
+        '''
+        quantized = np.asarray(pixels, dtype=np.uint8) >> (8 - self.bits)
+        quantized = quantized.astype(np.int32)
+        return (quantized[..., 0] << (2 * self.bits)) | (quantized[..., 1] << self.bits) | quantized[..., 2]
+
+    def predict(self, pixels):
+        return (self.decision_function(pixels) > 0).astype(int)
+
+    def decision_function(self, pixels):
+        return self.table[self.get_indices(pixels)]
+
+
+def decision_function_coarse_to_fine(classifier, pixels, coarse_factor=4, band_width=8):
+    '''
+    calculates the decision values of all pixels of an image, by first classifying a downsampled copy of the image
+    and then re-classifying at full resolution only the pixels within band_width pixels of the coarse boundary.
+    Away from the boundary the upsampled coarse decision values are used, which there have the same sign as the full
+    resolution ones, apart from isolated noisy pixels. After the removal of small objects and holes the mask is
+    therefore the same, while the classifier only sees a fraction of the pixels.
+    :param classifier: a trained pixel classifier
+    :param pixels: the image, an array of shape (h, w, 3)
+    :param coarse_factor: the downsampling factor of the coarse pass. 1 classifies all pixels at full resolution
+    :param band_width: the half width in (full resolution) pixels of the band around the coarse boundary
+    :return: the decision values, an array of shape (h, w)
+    '''
+    h, w = pixels.shape[:2]
+    if coarse_factor <= 1 or h < 2 * coarse_factor or w < 2 * coarse_factor:
+        return classifier.decision_function(pixels.reshape((-1, 3))).reshape((h, w))
+
+    small = cv2.resize(pixels, (w // coarse_factor, h // coarse_factor), interpolation=cv2.INTER_AREA)
+    small_scores = classifier.decision_function(small.reshape((-1, 3))).reshape(small.shape[:2])
+    scores = cv2.resize(small_scores.astype(np.float32), (w, h), interpolation=cv2.INTER_LINEAR)
+
+    # the band: all coarse pixels within reach of a coarse pixel with the other label
+    radius = -(-band_width // coarse_factor) + 1
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * radius + 1, 2 * radius + 1))
+    coarse_labels = (small_scores > 0).astype(np.uint8)
+    small_band = cv2.dilate(coarse_labels, kernel) != cv2.erode(coarse_labels, kernel)
+    band = cv2.resize(small_band.astype(np.uint8), (w, h), interpolation=cv2.INTER_NEAREST).astype(bool)
+
+    scores[band] = classifier.decision_function(pixels[band])
+    return scores
+
+
+# the available classifiers, by the name used in config.ini
+pixel_classifiers = {'svc': SVCPixelClassifier,
+                     'lookup_table': LookupTablePixelClassifier}
+
+
+def create_pixel_classifier(name="lookup_table"):
+    '''
+    :param name: the name of the classifier, one of the keys of pixel_classifiers
+    :return: a new, untrained classifier
+    '''
+    if name not in pixel_classifiers:
+        raise ValueError(f"Unknown pixel classifier {name}, expected one of {list(pixel_classifiers)}")
+    return pixel_classifiers[name]()
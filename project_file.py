@@ -0,0 +1,164 @@
+'''
+The project file: a versioned binary format for saving a reconstruction, replacing the pickle file.
+
+The project file is a zip archive, without compression, with
+    - manifest.json: the version of the format and all meta data of the reconstruction (the slices, the coupes,
+      the ruler), as json
+    - one .npy entry per array (the coupe images, the traces and the masks of the slices), as raw chunks
+
+As the arrays are not compressed, they can be memory mapped directly from the project file (see
+ProjectFile.get_array), such that a project is opened without reading all images into memory.
+
+Only numpy arrays and plain python objects are written, so saving never touches the live Qt objects of the
+reconstruction. The file is written next to the target and moved in place when complete, such that a crash while
+saving leaves the previous project file intact. The manifest is written last: a file without a manifest is incomplete.
+'''
+
+import json
+import os
+import struct
+import zipfile
+
+import numpy as np
+
+# the version of the format that is written. Files with a newer version can not be read
+PROJECT_FILE_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+# the size of the fixed part of the local file header of a zip entry
+LOCAL_HEADER_SIZE = 30
+# the size of the zip64 extra field that zipfile adds to the local file header
+ZIP64_EXTRA_SIZE = 20
+# the data of every array starts at a multiple of ALIGNMENT bytes in the file, such that the mapped arrays are aligned
+ALIGNMENT = 64
+# the id of the extra field used for padding the local file header (as used by zipalign)
+PADDING_EXTRA_ID = 0xD935
+
+
+def save_project_file(path, manifest, arrays):
+    '''
+    writes a project file, atomically
+    :param path: the path of the project file
+    :param manifest: the meta data, a json serialisable dict
+    :param arrays: dict of name: numpy array. The names may contain "/" to group the arrays
+    :return: None
+    '''
+    tmp_path = f"{path}.tmp"
+    try:
+        with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for name, array in arrays.items():
+                info = zipfile.ZipInfo(f"{name}.npy")
+                info.compress_type = zipfile.ZIP_STORED
+                # pad the local file header, such that the .npy data starts aligned. The .npy header itself is padded
+                # to a multiple of 64 bytes, so the array data is aligned as well
+                data_offset = archive.start_dir + LOCAL_HEADER_SIZE + len(info.filename.encode()) + ZIP64_EXTRA_SIZE
+                padding = -(data_offset + 4) % ALIGNMENT
+                info.extra = struct.pack("<HH", PADDING_EXTRA_ID, padding) + bytes(padding)
+                with archive.open(info, "w", force_zip64=True) as f:
+                    np.lib.format.write_array(f, np.ascontiguousarray(array), allow_pickle=False)
+            archive.writestr(MANIFEST_NAME, json.dumps(dict(manifest, version=PROJECT_FILE_VERSION)))
+        # make sure the new file is on disk before it replaces the old one
+        with open(tmp_path, "rb+") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except:
+        # an incomplete file is not left behind, e.g. when the disk is full
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def read_if_mapped(array, path):
+    '''
+    A memory mapped file can not be replaced on all platforms, so before a project file is overwritten the arrays
+    mapped from it are read into memory.
+    :param array: an array, or None
+    :param path: the path of the project file
+    :return: a copy in memory if the array is mapped from the file at path, otherwise the array itself
+    '''
+    if isinstance(array, np.memmap) and array.filename is not None and os.path.exists(path) \
+            and os.path.samefile(array.filename, path):
+        return np.array(array)
+    return array
+
+
+class ProjectFile():
+    '''
+    An opened project file, for reading the manifest and the arrays. Use as a context manager, or call close().
+    '''
+
+    def __init__(self, path):
+        '''
+        :param path: the path of the project file
+        '''
+        self.path = path
+        self.archive = zipfile.ZipFile(path, "r")
+        try:
+            self.manifest = json.loads(self.archive.read(MANIFEST_NAME))
+        except KeyError:
+            self.archive.close()
+            raise ValueError(f"{path} has no manifest, the project file is incomplete")
+        if self.manifest.get('version', 0) > PROJECT_FILE_VERSION:
+            self.archive.close()
+            raise ValueError(f"{path} has version {self.manifest.get('version')}, only versions up to "
+                             f"{PROJECT_FILE_VERSION} can be read")
+
+    def has_array(self, name):
+        '''
+        :return: True if the project file contains the array
+        '''
+        return f"{name}.npy" in self.archive.NameToInfo
+
+    def get_array(self, name, mmap_mode=None):
+        '''
+        :param name: the name of the array, as passed to save_project_file
+        :param mmap_mode: None to read the array into memory, or the mode for np.memmap (e.g. "r") to map the array
+        from the project file. Arrays that can not be mapped are read into memory
+        :return: the array, or None if the project file does not contain it
+        '''
+        if not self.has_array(name):
+            return None
+        info = self.archive.getinfo(f"{name}.npy")
+        if mmap_mode is not None and info.compress_type == zipfile.ZIP_STORED:
+            array = self.map_array(info, mmap_mode)
+            if array is not None:
+                return array
+        with self.archive.open(info) as f:
+            return np.lib.format.read_array(f, allow_pickle=False)
+
+    def map_array(self, info, mmap_mode):
+        '''
+        maps an uncompressed .npy entry of the archive with np.memmap
+        :param info: the ZipInfo of the entry
+        :param mmap_mode: the mode for np.memmap
+        :return: the mapped array, or None if the array can not be mapped (an empty array, or an unknown .npy version)
+        '''
+        with open(self.path, "rb") as f:
+            # the data of the entry follows the local file header, which has its own file name and extra field
+            f.seek(info.header_offset)
+            local_header = f.read(LOCAL_HEADER_SIZE)
+            if local_header[:4] != b"PK\x03\x04":
+                raise ValueError(f"Invalid local file header for {info.filename} in {self.path}")
+            name_length, extra_length = struct.unpack("<HH", local_header[26:30])
+            f.seek(info.header_offset + LOCAL_HEADER_SIZE + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            elif version == (2, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            else:
+                return None
+            offset = f.tell()
+        if dtype.hasobject or int(np.prod(shape)) == 0:
+            return None
+        return np.memmap(self.path, dtype=dtype, mode=mmap_mode, shape=shape, order="F" if fortran_order else "C",
+                         offset=offset)
+
+    def close(self):
+        self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
@@ -1,9 +1,8 @@
 from  slide_score_api.slidescore import APIClient
+from region_reader import RegionReader
 from PIL import Image
 import io
-import numpy as np
 import matplotlib.pyplot as plt
-import requests
 
 import pandas as pd
 
@@ -78,20 +77,13 @@ if USE_ASAP:
 level=10
 
 def get_tile(api, imageid, level,x,y):
-   response = api.perform_request("GetTileServer?imageId=" + str(imageid), None, method="GET")
-   rjson = response.json()
-   cookie=  rjson['cookiePart']
-   url= api.end_point.replace("/Api/", f"/i/{imageid}/{rjson['urlPart']}/i_files/{level}/{x}_{y}.jpeg")
-   r = requests.get(url, cookies={'t': cookie})
-   img = Image.open(io.BytesIO(r.content))
+   # the api client caches the tile server cookie, so this no longer requests it for every tile
+   img = Image.open(io.BytesIO(api.get_tile(imageid, level, x, y)))
    return img
 
 
 def get_metadata(api, imageid):
-   response = api.perform_request("GetImageMetadata?imageId=" + str(imageid), None, method="GET")
-   rjson = response.json()
-   metadata=rjson['metadata']
-   return metadata
+   return api.get_image_metadata(imageid)
 
 
 def get_size(api, imageid):
@@ -132,53 +124,11 @@ zoom_level=4
 rect=[[10000,10000],[14023,14103]]
 
 
-x_from=int(rect[0][0]//(tile_width*2**zoom_level))
-x_to=int((rect[1][0])//(tile_width*2**zoom_level))+1
-y_from=int(rect[0][1]//(tile_height*2**zoom_level))
-y_to=int((rect[1][1])//(tile_height*2**zoom_level))+1
+region_reader = RegionReader(rect=rect, zoom_level=zoom_level, tile_width=tile_width, tile_height=tile_height)
 
-img_width=(rect[1][0]-rect[0][0])//(2**zoom_level)+1
-img_height=(rect[1][1]-rect[0][1])//(2**zoom_level)+1
-img=np.zeros((img_height, img_width,3), dtype=np.uint8)
+print(region_reader.width,region_reader.height)
 
-
-print(img_width,img_height)
-
-response = api.perform_request("GetTileServer?imageId=" + str(imageid), None, method="GET")
-rjson = response.json()
-cookie = rjson['cookiePart']
-
-
-verbose=False
-first=True
-
-for x in range (x_from, x_to):
-
-   left_img = min(max((x * tile_width * 2 ** zoom_level - rect[0][0]) // (2 ** zoom_level), 0), img_width - 1)
-   right_img = min(max((((x + 1) * tile_width - 1) * 2 ** zoom_level - rect[0][0]) // (2 ** zoom_level), 0),
-                   img_width - 1)
-   left_tile = (left_img + rect[0][0] // (2 ** zoom_level)) % tile_width
-   right_tile = (right_img + rect[0][0] // (2 ** zoom_level)) % tile_width
-
-   for y in range(y_from, y_to):
-
-      url = api.end_point.replace("/Api/", f"/i/{imageid}/{rjson['urlPart']}/i_files/{max_level-zoom_level}/{x}_{y}.jpeg")
-      if True:
-         r = requests.get(url, cookies={'t': cookie})
-      first = False
-      tile = Image.open(io.BytesIO(r.content))
-      tile = np.asarray(tile)
-      top_img  = min(max((y*tile_height*2**zoom_level-rect[0][1])//(2**zoom_level),0),img_height-1)
-      bottom_img = min(max((((y+1)*tile_height-1)*2**zoom_level-rect[0][1])//(2**zoom_level),0),img_height-1)
-      top_tile = (top_img +rect[0][1]//(2**zoom_level))%tile_height
-      bottom_tile = (bottom_img + rect[0][1]//(2**zoom_level))%tile_height
-      if verbose:
-         print(f"Left_image: {left_img}, Right_image {right_img} {2**zoom_level}")
-         print(f"Left_tile: {left_tile}, Right_tile {right_tile}")
-         print(f"Top_image: {top_img}, Bottom_image {bottom_img}")
-         print(f"Top_tile: {top_tile}, Bottom_tile {bottom_tile}")
-
-      img[top_img:bottom_img+1,left_img: right_img+1] = tile[top_tile:bottom_tile+1,left_tile: right_tile+1]
+img = region_reader.read(load_tile=lambda key: api.get_tile(imageid, max_level-zoom_level, key[0], key[1]))
 
 
 
@@ -1,12 +1,18 @@
 import importlib
 import logging
+import os
 import pickle
 import sys
 import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
+from PyQt5.QtCore import QPoint, QRect
 from PyQt5.QtGui import QPixmap
 
 from coupe import Coupe
+from local_coupe import LocalCoupe
+import mask_codec
+from project_file import ProjectFile, read_if_mapped, save_project_file
 from slice import Slice
 
 
@@ -32,6 +38,8 @@ class Reconstruction:
         self.slide_score_user=slide_score_user
         self.slide_score_case_id=-1
         self.slide_score_study_id=-1
+        # the sequence number of the last journal entry included, for a reconstruction loaded from an autosave snapshot
+        self.journal_seq=0
 
 
         if logger is not None:
@@ -68,11 +76,15 @@ class Reconstruction:
                                                 slide_score_case_id = reconstruction.slide_score_case_id)
         # reload the coupes
         import coupe
+        import local_coupe
         obj.logger.warning("Reloading Coupes")
         importlib.reload(coupe)
+        importlib.reload(local_coupe)
         from coupe import Coupe
+        from local_coupe import LocalCoupe
         for miro_photo_id in reconstruction.coupes:
-            obj.coupes[miro_photo_id] = Coupe.create_copy(
+            coupe_class = LocalCoupe if hasattr(reconstruction.coupes[miro_photo_id], "slide_path") else Coupe
+            obj.coupes[miro_photo_id] = coupe_class.create_copy(
                 coupe=reconstruction.coupes[miro_photo_id],
                 parent=parent,
                 logger=logger)
@@ -102,59 +114,92 @@ class Reconstruction:
         return
 
 
-    def load_coupes(self, max_cnt_coupes=-1):
+    def load_coupes(self, max_cnt_coupes=-1, num_tile_workers=8, num_coupe_workers=4, progress_callback=None):
         '''
         loads the coupes from Slide Score
         :param max_cnt_coupes: maximum number of coupes to be reloaded
+        :param num_tile_workers: the number of tiles that are downloaded simultaneously per coupe
+        :param num_coupe_workers: the number of coupes that are loaded simultaneously
+        :param progress_callback: optional function progress_callback(slide_score_image_id, cnt, total),
+        called after each coupe is loaded
         :return:
         '''
 
         self.get_coupe_ids()
-        self.get_coupes(max_cnt=max_cnt_coupes)
+        self.get_coupes(max_cnt=max_cnt_coupes, num_tile_workers=num_tile_workers,
+                        num_coupe_workers=num_coupe_workers, progress_callback=progress_callback)
 
 
-    def get_coupe_ids(self):
+    def load_coupes_from_directory(self, slide_dir, max_cnt_coupes=-1, num_coupe_workers=4, progress_callback=None):
         '''
-        get the id's of all the coupes in slide score
+        loads the coupes from the whole slide image files in a local directory instead of from Slide Score
+        :param slide_dir: the directory with the slides
+        :param max_cnt_coupes: maximum number of coupes to be loaded
+        :param num_coupe_workers: the number of coupes that are loaded simultaneously
+        :param progress_callback: optional function progress_callback(slide_score_image_id, cnt, total),
+        called after each coupe is loaded
         :return:
         '''
+        self.get_coupes(max_cnt=max_cnt_coupes, num_coupe_workers=num_coupe_workers,
+                        progress_callback=progress_callback, coupes=self.create_local_coupes(slide_dir))
 
-        response = self.slide_score_api.perform_request("Scores",
-                                                        {"studyid": self.slide_score_study_id, "question": None,
-                                                         "email": self.slide_score_user, "imageid": None,
-                                                         "caseid": self.slide_score_case_id})
-        rjson = response.json()
+    def create_local_coupes(self, slide_dir):
+        '''
+        :param slide_dir: the directory with the slides
+        :return: a list of (not yet loaded) LocalCoupes, one for each slide in the directory
+        '''
+        return LocalCoupe.create_from_directory(slide_dir=slide_dir,
+                                                slide_score_study_id=self.slide_score_study_id,
+                                                slide_score_case_id=self.slide_score_case_id,
+                                                parent=self.parent,
+                                                logger=self.logger)
+
+    def get_coupe_ids(self):
+        '''
+        get the id's of all the coupes in slide score. When Slide Score can not be reached, the ids are taken from
+        the tile cache, if the case was opened before
+        :return:
+        '''
 
-        self.slide_score_image_ids = set()
+        image_ids = self.slide_score_api.get_case_image_ids(studyid=self.slide_score_study_id,
+                                                            caseid=self.slide_score_case_id,
+                                                            email=self.slide_score_user)
+        self.slide_score_image_ids = set(image_ids)
         self.slide_score_case_name = ""
-        for r in rjson:
-            self.slide_score_image_ids.add(int(r['imageID']))
         return
 
 
-    def get_coupes(self, max_cnt=-1):
+    def get_coupes(self, max_cnt=-1, num_tile_workers=8, num_coupe_workers=4, progress_callback=None, coupes=None):
         '''
         Reads all coupes from Slide Score, and stores the resulting Coupe object in the dictionary self.coupes
+        The coupes are loaded in parallel by a pool of num_coupe_workers threads. The coupes are added to
+        self.coupes in order of their id, regardless of the order in which they finish loading.
         :param max_cnt: the maximum number of coupes to load. -1 for all. Limiting the total amount of coupes is
         mainly a development feature to accelerate the reading
+        :param num_tile_workers: the number of tiles that are downloaded simultaneously per coupe
+        :param num_coupe_workers: the number of coupes that are loaded simultaneously
+        :param progress_callback: optional function progress_callback(slide_score_image_id, cnt, total),
+        called from this thread after each coupe is loaded
+        :param coupes: optional list of coupes to load, e.g. LocalCoupes. If None, the coupes with the ids in
+        self.slide_score_image_ids are loaded from Slide Score
         :return:
         '''
-        cnt=0
         try:
-            for slide_score_image_id in self.slide_score_image_ids:
-                if cnt < max_cnt or max_cnt==-1:
-                    self.coupes[slide_score_image_id] = Coupe(
-                        slide_score_image_id=slide_score_image_id,
-                        slide_score_case_id=self.slide_score_case_id,
-                        slide_score_study_id=self.slide_score_study_id,
-                        slide_score_api=self.slide_score_api,
-                        logger=self.logger,
-                        parent=self.parent)
-                    self.coupes[slide_score_image_id].get_metadata()
-                    self.coupes[slide_score_image_id].get_image()
-
-                    cnt +=1
-                    self.active_coupe=slide_score_image_id
+            loaded = {}
+            for slide_score_image_id, coupe, cnt, total in self.iterate_coupes(max_cnt=max_cnt,
+                                                                               num_tile_workers=num_tile_workers,
+                                                                               num_coupe_workers=num_coupe_workers,
+                                                                               coupes=coupes):
+                if coupe is not None:
+                    # the QPixmaps are created here, as they can only be created safely in the GUI thread
+                    coupe.get_pixmaps_from_img()
+                    loaded[slide_score_image_id] = coupe
+                if progress_callback is not None:
+                    progress_callback(slide_score_image_id, cnt, total)
+
+            for slide_score_image_id in sorted(loaded, key=self.coupe_sort_key):
+                self.coupes[slide_score_image_id] = loaded[slide_score_image_id]
+                self.active_coupe = slide_score_image_id
             return None
 
 
@@ -163,6 +208,97 @@ class Reconstruction:
             self.logger.error(traceback.format_exc())
             return None
 
+    def iterate_coupes(self, max_cnt=-1, num_tile_workers=8, num_coupe_workers=4, coupes=None, skip_ids=None,
+                       is_cancelled=None):
+        '''
+        A generator that loads the coupes in parallel, and yields them one by one as they finish loading.
+        The coupes are not added to self.coupes and have no QPixmaps yet, such that the generator can also be
+        consumed from a thread other than the GUI thread. Closing the generator cancels the coupes that have not
+        started loading yet, the coupes that are loading finish in the background without being yielded.
+        :param max_cnt: the maximum number of coupes to load. -1 for all.
+        :param num_tile_workers: the number of tiles that are downloaded simultaneously per coupe
+        :param num_coupe_workers: the number of coupes that are loaded simultaneously
+        :param coupes: optional list of coupes to load. If None, the coupes with the ids in
+        self.slide_score_image_ids are loaded from Slide Score
+        :param skip_ids: optional ids of coupes that are not loaded, e.g. because they are present already
+        :param is_cancelled: optional function that returns True when loading should stop. It is checked while
+        waiting for the coupes, such that the generator stops promptly
+        :return: yields tuples (slide_score_image_id, coupe, cnt, total), with coupe None if loading failed
+        '''
+        if coupes is None:
+            coupes = [Coupe(slide_score_image_id=slide_score_image_id,
+                            slide_score_case_id=self.slide_score_case_id,
+                            slide_score_study_id=self.slide_score_study_id,
+                            slide_score_api=self.slide_score_api,
+                            logger=self.logger,
+                            parent=self.parent) for slide_score_image_id in sorted(self.slide_score_image_ids)]
+        if max_cnt != -1:
+            coupes = coupes[:max_cnt]
+        if skip_ids is not None:
+            coupes = [coupe for coupe in coupes if coupe.slide_score_image_id not in skip_ids]
+
+        executor = ThreadPoolExecutor(max_workers=max(1, num_coupe_workers))
+        futures = {}
+        for coupe in coupes:
+            futures[executor.submit(self.load_coupe, coupe, num_tile_workers)] = coupe.slide_score_image_id
+        try:
+            cnt = 0
+            pending = set(futures)
+            while len(pending) > 0:
+                # wake up now and then to check whether loading is cancelled
+                done, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                if is_cancelled is not None and is_cancelled():
+                    return
+                for future in done:
+                    cnt += 1
+                    slide_score_image_id = futures[future]
+                    try:
+                        coupe = future.result()
+                        self.logger.info(f"Loaded coupe {slide_score_image_id} ({cnt}/{len(futures)})")
+                    except:
+                        coupe = None
+                        self.logger.error(f"Failed to load coupe {slide_score_image_id} ({cnt}/{len(futures)})")
+                        self.logger.error(traceback.format_exc())
+                    yield slide_score_image_id, coupe, cnt, len(futures)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def add_coupe(self, coupe):
+        '''
+        adds a loaded coupe to self.coupes, keeping self.coupes in order of id
+        As in get_coupes, the last coupe in order of id is the active coupe, unless another coupe was made active
+        in the mean time
+        :param coupe: the coupe
+        :return: None
+        '''
+        last_coupe_id = next(reversed(self.coupes), None)
+        self.coupes[coupe.slide_score_image_id] = coupe
+        self.coupes = dict(sorted(self.coupes.items(), key=lambda item: self.coupe_sort_key(item[0])))
+        if self.active_coupe is None or self.active_coupe == last_coupe_id:
+            self.active_coupe = next(reversed(self.coupes))
+
+    @staticmethod
+    def coupe_sort_key(slide_score_image_id):
+        '''
+        The ids of the coupes from Slide Score are ints, the ids of LocalCoupes can also be strings (the file name,
+        see LocalCoupe), which can not be compared with ints. The ints come first, in numerical order, then the strings
+        :param slide_score_image_id: the id of a coupe
+        :return: the key for sorting coupes on their id
+        '''
+        return isinstance(slide_score_image_id, str), slide_score_image_id
+
+    @staticmethod
+    def load_coupe(coupe, num_tile_workers=8):
+        '''
+        loads the meta data and the image of a single coupe, runs in a worker thread of get_coupes
+        :param coupe: the coupe to load
+        :param num_tile_workers: the number of tiles that are downloaded simultaneously
+        :return: the coupe
+        '''
+        coupe.get_metadata()
+        coupe.get_image(num_workers=num_tile_workers, create_pixmaps=False)
+        return coupe
+
 
     def set_macro_photo(self, macro_photo_path):
         '''
@@ -227,6 +363,168 @@ class Reconstruction:
             logger.error(traceback.format_exc())
             return None
 
+    def save_to_project_file(self, project_file_path, journal_seq=None, coupes_file_path=None):
+        '''
+        Saving the reconstruction to a project file (see project_file). Unlike save_to_pickle, the reconstruction is
+        left as it is: only the arrays and the meta data are read
+        :param project_file_path: file name of the project file
+        :param journal_seq: for an autosave snapshot, the sequence number of the last journal entry included
+        :param coupes_file_path: if set, the coupes are not written to the project file, the project file refers to
+        this file instead, as written by save_coupes_to_project_file. The coupes change rarely, so a project file
+        without them is much faster to write
+        :return: True if the project file was written
+        '''
+        try:
+            self.logger.info(f"Saving to project file {project_file_path}")
+            self.read_mapped_arrays(project_file_path)
+            manifest = {'macro_photo_path': self.macro_photo_path,
+                        'slide_score_case_id': self.slide_score_case_id,
+                        'slide_score_study_id': self.slide_score_study_id,
+                        'ruler_points': [[point.x(), point.y()] for point in self.ruler_points],
+                        'active_coupe': self.active_coupe,
+                        'journal_seq': journal_seq if journal_seq is not None else 0,
+                        'coupes': [],
+                        'slices': []}
+            arrays = {}
+            if coupes_file_path is None:
+                manifest['coupes'], arrays = self.get_coupes_project_data()
+            else:
+                # the path is stored relative to the project file, such that the files can be moved together
+                manifest['coupes_file'] = os.path.relpath(coupes_file_path,
+                                                          os.path.dirname(os.path.abspath(project_file_path)))
+            for i, slice in enumerate(self.slices):
+                slice_data, slice_arrays = slice.get_project_data()
+                manifest['slices'].append(slice_data)
+                for name in slice_arrays:
+                    arrays[f"slices/{i}/{name}"] = slice_arrays[name]
+            save_project_file(project_file_path, manifest, arrays)
+            self.logger.info(f"Saved {len(manifest['coupes'])} coupes and {len(self.slices)} slices to "
+                             f"{project_file_path}")
+            return True
+        except:
+            self.logger.error(sys.exc_info()[0])
+            self.logger.error(traceback.format_exc())
+            return None
+
+    def save_coupes_to_project_file(self, coupes_file_path):
+        '''
+        Saving only the coupes to a project file, to which other project files can refer (see save_to_project_file)
+        :param coupes_file_path: file name of the project file
+        :return: True if the project file was written
+        '''
+        try:
+            self.logger.info(f"Saving the coupes to project file {coupes_file_path}")
+            self.read_mapped_arrays(coupes_file_path)
+            manifest = {'slide_score_case_id': self.slide_score_case_id,
+                        'slide_score_study_id': self.slide_score_study_id}
+            manifest['coupes'], arrays = self.get_coupes_project_data()
+            save_project_file(coupes_file_path, manifest, arrays)
+            return True
+        except:
+            self.logger.error(sys.exc_info()[0])
+            self.logger.error(traceback.format_exc())
+            return None
+
+    def get_coupes_project_data(self):
+        '''
+        :return: the meta data of the coupes, a list, and the images of the coupes, a dict of arrays
+        '''
+        coupes_data = []
+        arrays = {}
+        for i, coupe_id in enumerate(self.coupes):
+            coupe = self.coupes[coupe_id]
+            coupes_data.append(coupe.get_project_data())
+            arrays[f"coupes/{i}/img"] = coupe.img
+            if getattr(coupe, "img_trans", None) is not None:
+                arrays[f"coupes/{i}/img_trans"] = coupe.img_trans
+        return coupes_data, arrays
+
+    def read_mapped_arrays(self, project_file_path):
+        '''
+        reads the arrays that are memory mapped from the project file into memory, such that the project file can
+        be replaced
+        :param project_file_path: the path of the project file
+        :return: None
+        '''
+        for coupe in self.coupes.values():
+            coupe.img = read_if_mapped(coupe.img, project_file_path)
+            coupe.img_trans = read_if_mapped(coupe.img_trans, project_file_path)
+        for slice in self.slices:
+            if slice.mask is not None:
+                slice.mask.bits = read_if_mapped(slice.mask.bits, project_file_path)
+            slice.score_map = read_if_mapped(slice.score_map, project_file_path)
+
+    @classmethod
+    def load_from_project_file(cls, project_file_path, slide_score_api, slide_score_user, parent, logger,
+                               macro_photo_path=None, mmap_mode="r"):
+        '''
+        creating a reconstruction from a project file. The coupes are restored from the saved images, without
+        contacting Slide Score. The images of the coupes and the masks of the slices are memory mapped from the
+        project file, unless mmap_mode is None, and the pixmaps of the coupes are only created when they are displayed
+
+        :param project_file_path: the path to the project file
+        :param slide_score_api: the slide score api
+        :param slide_score_user: the slide score user
+        :param parent: the parent
+        :param logger: the logger
+        :param macro_photo_path: the path to the macro_photo. If None, the path saved in the project file is used
+        :param mmap_mode: the mode for memory mapping the arrays (see np.memmap), or None to read them into memory
+        :return: the reconstruction as loaded from the project file
+        '''
+        try:
+            logger.info(f"Loading Reconstruction from {project_file_path}")
+            with ProjectFile(project_file_path) as project_file:
+                manifest = project_file.manifest
+                obj = cls(slide_score_api=slide_score_api, slide_score_user=slide_score_user, parent=parent,
+                          logger=logger)
+                obj.set_macro_photo(macro_photo_path if macro_photo_path is not None else manifest['macro_photo_path'])
+                obj.set_slide_score_study_and_case_id(slide_score_study_id=manifest['slide_score_study_id'],
+                                                      slide_score_case_id=manifest['slide_score_case_id'])
+                obj.ruler_points = [QPoint(x, y) for x, y in manifest['ruler_points']]
+                if 'coupes_file' in manifest:
+                    coupes_file_path = os.path.join(os.path.dirname(os.path.abspath(project_file_path)),
+                                                    manifest['coupes_file'])
+                    with ProjectFile(coupes_file_path) as coupes_file:
+                        obj.add_coupes_from_project_file(coupes_file, mmap_mode=mmap_mode)
+                else:
+                    obj.add_coupes_from_project_file(project_file, mmap_mode=mmap_mode)
+                obj.active_coupe = manifest.get('active_coupe')
+                obj.journal_seq = manifest.get('journal_seq', 0)
+                for i, slice_data in enumerate(manifest['slices']):
+                    # the traces are copied into the growable buffers of the Trace objects, so they are not mapped
+                    arrays = {name: project_file.get_array(f"slices/{i}/{name}",
+                                                           None if name == 'traces' else mmap_mode)
+                              for name in ['traces', 'mask_bits', 'score_map']
+                              if project_file.has_array(f"slices/{i}/{name}")}
+                    obj.slices.append(Slice.create_from_project_data(data=slice_data, arrays=arrays,
+                                                                     macro_photo=obj.macro_photo, logger=logger))
+            logger.info(f"Loaded {len(obj.coupes)} coupes and {len(obj.slices)} slices")
+            return obj
+        except:
+            logger.error(sys.exc_info()[0])
+            logger.error(traceback.format_exc())
+            return None
+
+    def add_coupes_from_project_file(self, project_file, mmap_mode="r"):
+        '''
+        adds the coupes saved in a project file
+        :param project_file: the opened ProjectFile
+        :param mmap_mode: the mode for memory mapping the images, or None to read them into memory
+        :return: None
+        '''
+        for i, coupe_data in enumerate(project_file.manifest['coupes']):
+            coupe_class = LocalCoupe if 'slide_path' in coupe_data else Coupe
+            coupe = coupe_class.create_from_project_data(data=coupe_data,
+                                                         img=project_file.get_array(f"coupes/{i}/img", mmap_mode),
+                                                         img_trans=project_file.get_array(f"coupes/{i}/img_trans",
+                                                                                          mmap_mode),
+                                                         slide_score_api=self.slide_score_api,
+                                                         slide_score_study_id=self.slide_score_study_id,
+                                                         slide_score_case_id=self.slide_score_case_id,
+                                                         parent=self.parent,
+                                                         logger=self.logger)
+            self.coupes[coupe.slide_score_image_id] = coupe
+
     def add_slice_from_rect(self, rect):
         '''
         Create a new slice from bounding box (rect) based on self.macro_photo
@@ -247,6 +545,26 @@ class Reconstruction:
             return None
 
 
+    def get_segmentation_jobs(self, segmentation_parameters=None, diagnostics=None):
+        '''
+        Prepares the segmentation of all slices that have traces, see segmentation_worker.BatchSegmentationWorker.
+        The seed masks and the pixels are prepared here, in the GUI thread, as numpy arrays, since the QPixmaps of
+        the slices can not be used in other threads or passed to other processes.
+        :param segmentation_parameters: dict of keyword arguments for segmentation.calc_foreground_background_mask
+        :param diagnostics: optional DiagnosticsWriter, to which figures of the seed masks are written
+        :return: a list of tuples (slice, pixels, inner_mask, outer_mask, segmentation_parameters)
+        '''
+        if segmentation_parameters is None:
+            segmentation_parameters = {}
+        jobs = []
+        for slice in self.slices:
+            if len(slice.traces) == 0:
+                continue
+            inner_mask, outer_mask = slice.create_inner_and_outer_mask(diagnostics=diagnostics)
+            jobs.append((slice, slice.get_np_array(), inner_mask, outer_mask,
+                         dict(segmentation_parameters, max_num_train_pixels=slice.max_num_train_pixels)))
+        return jobs
+
     def delete_slice(self, id):
         '''
         deleting a slice, based on its id
@@ -305,6 +623,61 @@ class Reconstruction:
 
 
 
+    def replay_journal(self, entries):
+        '''
+        applies the entries of the autosave journal (see journal) that are not included in the reconstruction yet,
+        i.e. those with a sequence number above self.journal_seq
+        :param entries: the journal entries, as read by journal.read_journal
+        :return: the number of entries applied
+        '''
+        cnt = 0
+        for entry in entries:
+            if entry['seq'] <= self.journal_seq:
+                continue
+            try:
+                self.apply_journal_entry(entry)
+                cnt += 1
+            except:
+                self.logger.error(f"Could not apply journal entry {entry['seq']} ({entry['event']})")
+                self.logger.error(sys.exc_info()[0])
+                self.logger.error(traceback.format_exc())
+            self.journal_seq = entry['seq']
+        self.logger.info(f"Applied {cnt} journal entries")
+        return cnt
+
+    def apply_journal_entry(self, entry):
+        '''
+        applies a single change, as recorded in the journal. The events are:
+            add_slice: a slice with the rect (left, top, width, height) is added
+            delete_slice: the slice(s) with the id are deleted
+            start_trace, trace_point, finish_trace, remove_latest_trace: editing the traces of the slice at
+            slice_index, trace_point adds the point (x, y) to the latest trace
+            ruler_point: the point (x, y) is added to the ruler
+            mask: the mask of the slice at slice_index is set, the mask is encoded with mask_codec.encode_mask
+        :param entry: the entry, a dict with the event and its data
+        :return: None
+        '''
+        event = entry['event']
+        if event == "add_slice":
+            new_slice = self.add_slice_from_rect(QRect(*entry['rect']))
+            new_slice.id = entry['id']
+        elif event == "delete_slice":
+            self.delete_slice(entry['id'])
+        elif event == "start_trace":
+            self.slices[entry['slice_index']].start_trace()
+        elif event == "trace_point":
+            self.slices[entry['slice_index']].add_to_trace(QPoint(entry['x'], entry['y']))
+        elif event == "finish_trace":
+            self.slices[entry['slice_index']].finish_trace()
+        elif event == "remove_latest_trace":
+            self.slices[entry['slice_index']].remove_latest_trace()
+        elif event == "ruler_point":
+            self.add_ruler_point(QPoint(entry['x'], entry['y']))
+        elif event == "mask":
+            self.slices[entry['slice_index']].set_mask(mask_codec.decode_mask(entry['mask']))
+        else:
+            raise ValueError(f"Unknown journal event {event}")
+
     def add_ruler_point(self, ruler_end_point):
         '''
         adds an end-point to the list self.ruler_points
@@ -320,7 +693,8 @@ class Reconstruction:
                          slide_score_api,
                          slide_score_user,
                          parent=None,
-                         logger=None
+                         logger=None,
+                         num_tile_workers=8
                          ):
         '''
         :param data: input dictionary
@@ -328,6 +702,7 @@ class Reconstruction:
         :param slide_score_user: the slide socre user
         :param parent: parent object
         :param logger: logger
+        :param num_tile_workers: the number of tiles that are downloaded simultaneously per coupe
         :return: the reconstruction as created from the dict
         '''
         obj = cls(parent=parent,
@@ -344,7 +719,18 @@ class Reconstruction:
                 slide_score_case_id=obj.slide_score_case_id,
                 slide_score_image_id=coupe_id,
                 parent=parent,
-                logger=logger)
+                logger=logger,
+                num_workers=num_tile_workers)
+        for coupe_data in data.get('local_coupes', []):
+            coupe = LocalCoupe(slide_path=coupe_data['slide_path'],
+                               slide_score_study_id=obj.slide_score_study_id,
+                               slide_score_case_id=obj.slide_score_case_id,
+                               slide_score_image_id=coupe_data['id'],
+                               parent=parent,
+                               logger=logger)
+            obj.load_coupe(coupe)
+            coupe.get_pixmaps_from_img()
+            obj.coupes[coupe.slide_score_image_id] = coupe
 
         for slice_data in data['slices']:
             obj.slices.append(Slice.create_from_dict(data=slice_data,
@@ -352,18 +738,23 @@ class Reconstruction:
                                                      logger=logger))
         return obj
 
-    def get_dict_for_serialisation(self):
+    def get_dict_for_serialisation(self, mask_encoding="varint_base64", verify_masks=False):
         '''
         obtain a dictionary describing the reconstruction object.
+        :param mask_encoding: the encoding of the masks of the slices, see mask_codec.encode_mask
+        :param verify_masks: if True, every encoded mask is decoded again and compared with the mask
         :return: a dict
         '''
 
         data = {}
-        data['slices']=[slice.get_dict_for_serialisation() for slice in self.slices]
+        data['slices']=[slice.get_dict_for_serialisation(mask_encoding=mask_encoding, verify_mask=verify_masks)
+                        for slice in self.slices]
         data['ruler_points']=[[point.x(), point.y()] for point in self.ruler_points]
         data['macro_photo_path']=self.macro_photo_path
         data['slide_score_case_id']=self.slide_score_case_id
         data['slide_score_study_id']=self.slide_score_study_id
-        data['coupe_ids']=[coupe_id for coupe_id in self.coupes]
+        data['coupe_ids']=[coupe_id for coupe_id in self.coupes if not isinstance(self.coupes[coupe_id], LocalCoupe)]
+        data['local_coupes']=[{'id': coupe_id, 'slide_path': self.coupes[coupe_id].slide_path}
+                              for coupe_id in self.coupes if isinstance(self.coupes[coupe_id], LocalCoupe)]
 
         return data
\ No newline at end of file
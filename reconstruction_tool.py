@@ -3,7 +3,7 @@ import sys
 import traceback
 import logging
 
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QObject, pyqtSignal
 from PyQt5.QtGui import QKeyEvent
 from PyQt5.QtWidgets import QApplication, QHBoxLayout, QWidget, QTabWidget, QTextEdit, QVBoxLayout
 
@@ -47,8 +47,7 @@ class ReconstructionGui(QWidget):
         self.logger_box = QTextEdit()
         self.logger_box.setUndoRedoEnabled(False)
         self.logger_box.setReadOnly(True)
-        h = GuiLogger()
-        h.edit = self.logger_box
+        h = GuiLogger(edit=self.logger_box)
         # attaching the logger box to the logger
         logging.getLogger().addHandler(h)
 
@@ -96,9 +95,12 @@ class ReconstructionGui(QWidget):
 
 
         Ctrl+C: Perform the semi-automatic foreground-background segmentation on slices
+        Ctrl+Shift+C: Perform the segmentation on all slices with traces, using all cores
         Ctrl+L: Load a Reconstruction object from the pickle file (as configured in app.pickle_file_path)
+        Ctrl+Shift+L: Load a Reconstruction object from the project file (as configured in app.project_file_path)
         Alt+L:  Load a Reconstruction object from the json file (as configured in app.json_file_path)
         Ctrl+S: Save the Reconstruction object to the  pickle file (as configured in app.pickle_file_path)
+        Ctrl+Shift+S: Save the Reconstruction object to the project file (as configured in app.project_file_path)
         Alt+L:  Load a Reconstruction object to the json file (as configured in app.json_file_path)
         Ctrl+Z: Removes the latest trace from the slice
         Ctrl+R: Reloads and updates the code for the Application and the Reconstruction
@@ -117,10 +119,16 @@ class ReconstructionGui(QWidget):
             alt = bool(modifiers & Qt.AltModifier)
             shift = bool(modifiers & Qt.ShiftModifier)
 
-            if event.key() in [Qt.Key_C] and control:
+            if event.key() in [Qt.Key_C] and control and shift:
+                self.app.logger.info("Calculate all")
+                self.app.calc_all_foreground_background_masks()
+            elif event.key() in [Qt.Key_C] and control:
                 self.app.logger.info("Calculate")
                 if self.tabs_left.currentWidget() == self.slice_photo_widget:
                     self.app.calc_foreground_background_mask()
+            elif event.key() in [Qt.Key_L] and control and shift:
+                self.app.logger.info("Load Reconstruction from project file")
+                self.app.load_reconstruction_from_project_file()
             elif event.key() in [Qt.Key_L] and control:
                 self.app.logger.info("Load Reconstruction from pickle")
                 self.app.load_reconstruction_from_pickle()
@@ -129,6 +137,9 @@ class ReconstructionGui(QWidget):
                 self.app.load_reconstruction_from_json()
 
 
+            elif event.key() in [Qt.Key_S] and control and shift:
+                self.app.logger.info("Save Reconstruction as project file")
+                self.app.save_reconstruction_to_project_file()
             elif event.key() in [Qt.Key_S] and control:
                 self.app.logger.info("Save Reconstruction as pickle")
                 self.app.save_reconstruction_to_pickle()
@@ -207,12 +218,24 @@ class ReconstructionGui(QWidget):
 
 
 
+class GuiLogSignal(QObject):
+    message = pyqtSignal(str)
+
+
 class GuiLogger(logging.Handler):
     '''
     A class based on logging.handler, used for capturing the logger output and send it to the logger box
+    Records can also be logged from worker threads (e.g. while loading coupes), so the text is passed on to the
+    logger box through a signal, which Qt delivers in the GUI thread.
     '''
+    def __init__(self, edit):
+        super().__init__()
+        self.edit = edit
+        self.signal = GuiLogSignal()
+        self.signal.message.connect(self.edit.append)
+
     def emit(self, record):
-        self.edit.append(self.format(record))
+        self.signal.message.emit(self.format(record))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,107 @@
+import numpy as np
+
+from tile_fetcher import TileFetcher
+
+
+class RegionReader:
+    '''
+    The RegionReader reads a rectangular region from a tiled image pyramid, such as the pyramids served by the
+    Slide Score tile server.
+
+    On construction, the grid of tiles intersecting the region is computed once: for every tile column the
+    destination columns in the region and the source columns in the tile, and likewise for every tile row.
+    Reading the region then only copies each tile into its place in the output buffer.
+    The output buffer can be supplied by the caller, e.g. a memory mapped array, in which case nothing of the size
+    of the region is allocated.
+    '''
+
+    def __init__(self, rect, zoom_level, tile_width, tile_height):
+        '''
+        :param rect: the region [[left, top], [right, bottom]] in full resolution (level 0) pixel coordinates
+        :param zoom_level: the zoom level, i.e. the region is downsampled by a factor 2**zoom_level.
+        :param tile_width: the width of the tiles
+        :param tile_height: the height of the tiles
+        '''
+        self.rect = rect
+        self.zoom_level = zoom_level
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        scale = 2 ** zoom_level
+        self.width = (rect[1][0] - rect[0][0]) // scale + 1
+        self.height = (rect[1][1] - rect[0][1]) // scale + 1
+        self.shape = (self.height, self.width, 3)
+        # per tile column x: (first column in region, first column in tile, number of columns)
+        self.columns = self.get_placements(rect[0][0], rect[1][0], tile_width, self.width, scale)
+        # per tile row y: (first row in region, first row in tile, number of rows)
+        self.rows = self.get_placements(rect[0][1], rect[1][1], tile_height, self.height, scale)
+
+    @staticmethod
+    def get_placements(start, end, tile_size, img_size, scale):
+        '''
+        calculates where the tiles along one axis go in the region
+        :param start: start of the region in level 0 pixels
+        :param end: end of the region in level 0 pixels
+        :param tile_size: the size of the tiles along this axis
+        :param img_size: the size of the region along this axis, in pixels at the zoom level
+        :param scale: the downsampling factor of the zoom level
+        :return: a dict mapping the tile index to a tuple (first pixel in region, first pixel in tile, number of pixels)
+        '''
+        indices = np.arange(int(start // (tile_size * scale)), int(end // (tile_size * scale)) + 1)
+        first_img = np.clip((indices * tile_size * scale - start) // scale, 0, img_size - 1)
+        last_img = np.clip((((indices + 1) * tile_size - 1) * scale - start) // scale, 0, img_size - 1)
+        first_tile = (first_img + start // scale) % tile_size
+        return {index: (first, first_in_tile, last - first + 1) for index, first, first_in_tile, last in
+                zip(indices.tolist(), first_img.tolist(), first_tile.tolist(), last_img.tolist())}
+
+    @property
+    def keys(self):
+        '''
+        :return: the (x, y) indices of all tiles intersecting the region
+        '''
+        return [(x, y) for x in self.columns for y in self.rows]
+
+    def place(self, out, key, tile):
+        '''
+        copies the part of a tile that falls in the region into the output buffer
+        Tiles at the border of the pyramid can be smaller than tile_width x tile_height, in which case only the
+        part that is present is copied.
+        :param out: the output buffer, with shape self.shape
+        :param key: the (x, y) index of the tile
+        :param tile: the decoded tile
+        :return: None
+        '''
+        first_col, first_col_in_tile, num_cols = self.columns[key[0]]
+        first_row, first_row_in_tile, num_rows = self.rows[key[1]]
+        part = tile[first_row_in_tile:first_row_in_tile + num_rows, first_col_in_tile:first_col_in_tile + num_cols]
+        out[first_row:first_row + part.shape[0], first_col:first_col + part.shape[1]] = part
+
+    def read(self, load_tile, out=None, num_workers=8, get_cached_tile=None, on_tile=None):
+        '''
+        reads the region
+        :param load_tile: a function load_tile(key) returning the encoded content of the tile with index key=(x, y)
+        :param out: optional output buffer with shape self.shape, e.g. a numpy memmap. If None, a new array is allocated
+        :param num_workers: the number of tiles that are downloaded simultaneously
+        :param get_cached_tile: optional function get_cached_tile(key) returning an already decoded tile, or None
+        :param on_tile: optional function on_tile(key, tile) called for every tile that is fetched, e.g. to cache it
+        :return: the output buffer
+        '''
+        if out is None:
+            out = np.zeros(self.shape, dtype=np.uint8)
+        elif tuple(out.shape) != self.shape:
+            raise ValueError(f"Output buffer has shape {out.shape}, expected {self.shape}")
+
+        keys_to_fetch = []
+        for key in self.keys:
+            tile = get_cached_tile(key) if get_cached_tile is not None else None
+            if tile is None:
+                keys_to_fetch.append(key)
+            else:
+                self.place(out, key, tile)
+
+        def place_tile(key, tile):
+            if on_tile is not None:
+                on_tile(key, tile)
+            self.place(out, key, tile)
+
+        TileFetcher(num_workers=num_workers).fetch(keys=keys_to_fetch, load_tile=load_tile, on_tile=place_tile)
+        return out
@@ -0,0 +1,162 @@
+import cv2
+import numpy as np
+from skimage import morphology
+
+from pixel_classifier import create_pixel_classifier, decision_function_coarse_to_fine
+
+
+class SegmentationCancelled(Exception):
+    '''
+    Raised when a segmentation is cancelled before it is finished
+    '''
+    pass
+
+
+def draw_trace(canvas, points, pen_width):
+    '''
+    draws a trace as a black line of pen_width, with round caps, on a single channel canvas
+    :param canvas: a uint8 array of shape (h, w), drawn on in place
+    :param points: the points of the trace, an array of shape (n, 2) with x, y coordinates
+    :param pen_width: the width of the line
+    :return: None
+    '''
+    points = np.asarray(points, dtype=np.int32).reshape((-1, 1, 2))
+    if len(points) == 1:
+        cv2.circle(canvas, (int(points[0, 0, 0]), int(points[0, 0, 1])), pen_width // 2, 0, thickness=-1)
+    elif len(points) > 1:
+        cv2.polylines(canvas, [points], isClosed=False, color=0, thickness=pen_width)
+
+
+class TraceCanvas():
+    '''
+    The traces of a slice, drawn with draw_trace on a canvas that is white (255) elsewhere, together with the sum
+    of all trace points for finding the center. The TraceCanvas is kept up to date point by point while the user
+    traces, such that the seed masks can be derived without re-drawing the earlier traces.
+    '''
+
+    def __init__(self, shape, pen_width):
+        '''
+        :param shape: the shape (h, w) of the slice
+        :param pen_width: the width of the traces
+        '''
+        self.pen_width = pen_width
+        self.canvas = np.full(shape, 255, dtype=np.uint8)
+        self.point_sum = np.zeros(2)
+        self.num_points = 0
+
+    @classmethod
+    def create_from_traces(cls, traces, shape, pen_width):
+        '''
+        :param traces: a list of traces, each an array of shape (n, 2) with x, y coordinates
+        :return: a TraceCanvas with all traces drawn
+        '''
+        obj = cls(shape=shape, pen_width=pen_width)
+        for trace in traces:
+            trace = np.asarray(trace).reshape((-1, 2))
+            draw_trace(obj.canvas, trace, pen_width)
+            obj.point_sum += trace.sum(axis=0)
+            obj.num_points += len(trace)
+        return obj
+
+    def add_point(self, point, previous_point=None):
+        '''
+        draws the segment from the previous point of the trace to the new point
+        :param point: the new (x, y) point
+        :param previous_point: the previous point of the same trace, None for the first point of a trace
+        :return: None
+        '''
+        if previous_point is None:
+            draw_trace(self.canvas, [point], self.pen_width)
+        else:
+            draw_trace(self.canvas, [previous_point, point], self.pen_width)
+        self.point_sum += point
+        self.num_points += 1
+
+    @property
+    def center(self):
+        '''
+        :return: the mean of all trace points
+        '''
+        return self.point_sum / max(self.num_points, 1)
+
+
+def create_inner_and_outer_mask(canvas, center):
+    '''
+    derives the seed masks from the rasterised traces, by flood filling the shape enclosed by the traces
+    :param canvas: the rasterised traces, see TraceCanvas
+    :param center: the (x, y) point from which the shape is filled, normally the mean of all trace points
+    :return: inner_mask, middle_mask and outer_mask: boolean masks of the pixels inside the traces, on the traces
+    and outside the traces
+    '''
+    h, w = canvas.shape
+    x = int(min(max(center[0], 0), w - 1))
+    y = int(min(max(center[1], 0), h - 1))
+    filled = canvas.copy()
+    cv2.floodFill(filled, None, (x, y), 128)
+    # the original QPixmap version tested filled > 100, on a canvas where white had become 84 (np.mean over the
+    # channels with a uint8 accumulator overflows), so only the filled pixels passed. Here white stays 255, so the
+    # filled pixels are selected by their value
+    inner_mask = filled == 128
+    middle_mask = canvas < 32
+    outer_mask = ~inner_mask & ~middle_mask
+    return inner_mask, middle_mask, outer_mask
+
+
+def calc_foreground_background_mask(pixels, inner_mask, outer_mask, max_num_train_pixels=500,
+                                    classifier="lookup_table", keep_score_map=False, coarse_factor=4, band_width=8,
+                                    progress_callback=None, is_cancelled=None):
+    '''
+    Calculates the foreground/background mask of a slice, from the pixels of the slice and the seed masks
+    derived from the traces.
+    Only numpy arrays go in and out, no Qt objects, such that the segmentation can run in a worker thread or
+    a worker process.
+    :param pixels: the slice photo, an RGB array of shape (h, w, 3)
+    :param inner_mask: boolean mask of the pixels marked by the user as definitely inside the slice
+    :param outer_mask: boolean mask of the pixels marked by the user as definitely outside the slice
+    :param max_num_train_pixels: the maximum number of pixels used for training, per class
+    :param classifier: the name of the pixel classifier, see pixel_classifier.pixel_classifiers
+    :param keep_score_map: if True, the decision values of the classifier are returned as well
+    :param coarse_factor: the downsampling factor of the coarse pass, 1 classifies all pixels at full resolution
+    :param band_width: the half width in pixels of the band around the coarse boundary that is re-classified
+    :param progress_callback: optional function progress_callback(percentage, message)
+    :param is_cancelled: optional function returning True when the segmentation should be stopped. In that case
+    SegmentationCancelled is raised.
+    :return: the mask (a boolean array of shape (h, w)) and the score map (float32, or None if not kept)
+    '''
+
+    def progress(percentage, message):
+        if is_cancelled is not None and is_cancelled():
+            raise SegmentationCancelled()
+        if progress_callback is not None:
+            progress_callback(percentage, message)
+
+    progress(0, "Creating training set")
+    # create a trainings set of pixels inside and outside
+    X_in = pixels[inner_mask].reshape((-1, 3))
+    X_out = pixels[outer_mask].reshape((-1, 3))
+    # undersample max_num_train_pixels
+    num_train_pixels = min(len(X_in), len(X_out), max_num_train_pixels)
+    X_in = X_in[np.random.permutation(len(X_in))[:num_train_pixels]]
+    X_out = X_out[np.random.permutation(len(X_out))[:num_train_pixels]]
+    X = np.vstack((X_in, X_out))
+    y = np.concatenate((np.ones(len(X_in)), np.zeros(len(X_out))))
+
+    progress(10, "Training classifier")
+    svm = create_pixel_classifier(classifier).fit(X=X, y=y)
+
+    progress(30, "Classifying pixels")
+    # apply the classifier on all pixels, only once: the label follows from the sign of the decision value
+    scores = decision_function_coarse_to_fine(svm, pixels, coarse_factor=coarse_factor, band_width=band_width)
+    scores = scores.astype(np.float32)
+    mask = scores > 0
+
+    progress(70, "Cleaning up mask")
+    # but have the precalculated masks take precedence
+    mask = (mask | inner_mask) & ~outer_mask
+    # remove objects that are smaller than 100 pixels
+    mask = morphology.remove_small_objects(mask, min_size=100, connectivity=2)
+    # remove holes that are smaller than 100 pixels
+    mask = morphology.remove_small_holes(mask, area_threshold=100, connectivity=2)
+
+    progress(100, "Done")
+    return mask, scores if keep_score_map else None
@@ -0,0 +1,148 @@
+import multiprocessing
+import sys
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from diagnostics import plot_foreground_background_mask
+from segmentation import SegmentationCancelled, calc_foreground_background_mask
+
+
+class SegmentationWorker(QThread):
+    '''
+    The SegmentationWorker calculates the foreground/background mask of a slice in a background thread, such that
+    the gui stays responsive during the segmentation.
+
+    The inputs (the pixels of the slice and the inner and outer mask) are numpy arrays, prepared in the GUI thread.
+    The worker never touches the slice itself: the result is handed back with the signal mask_ready, which Qt
+    delivers in the GUI thread, where the mask is set on the slice.
+    '''
+
+    # emitted with (percentage, message) while segmenting
+    progress = pyqtSignal(int, str)
+    # emitted with (slice, mask, score_map) when the segmentation is finished, and not cancelled
+    mask_ready = pyqtSignal(object, object, object)
+
+    def __init__(self, slice, pixels, inner_mask, outer_mask, segmentation_parameters=None, logger=None,
+                 diagnostics=None):
+        '''
+        :param slice: the slice that is segmented, only passed on with mask_ready
+        :param pixels: the slice photo as a numpy array
+        :param inner_mask: the inner mask, derived from the traces
+        :param outer_mask: the outer mask, derived from the traces
+        :param segmentation_parameters: dict of keyword arguments for segmentation.calc_foreground_background_mask
+        :param logger: the logger
+        :param diagnostics: optional DiagnosticsWriter, to which a figure of the mask is written
+        '''
+        super().__init__()
+        self.slice = slice
+        self.pixels = pixels
+        self.inner_mask = inner_mask
+        self.outer_mask = outer_mask
+        self.segmentation_parameters = segmentation_parameters if segmentation_parameters is not None else {}
+        self.logger = logger
+        self.diagnostics = diagnostics
+        self.cancelled = False
+
+    def cancel(self):
+        '''
+        stops the segmentation at the next step, without emitting mask_ready
+        :return: None
+        '''
+        self.cancelled = True
+
+    def run(self):
+        try:
+            mask, score_map = calc_foreground_background_mask(pixels=self.pixels, inner_mask=self.inner_mask,
+                                                              outer_mask=self.outer_mask,
+                                                              progress_callback=self.progress.emit,
+                                                              is_cancelled=lambda: self.cancelled,
+                                                              **self.segmentation_parameters)
+            if not self.cancelled:
+                self.mask_ready.emit(self.slice, mask, score_map)
+                if self.diagnostics is not None:
+                    self.diagnostics.submit(f"slice_{self.slice.id}_mask", plot_foreground_background_mask, self.pixels,
+                                            self.inner_mask, self.outer_mask, mask)
+        except SegmentationCancelled:
+            self.logger.info(f"Segmentation of slice {self.slice.id} cancelled")
+        except:
+            self.logger.error(sys.exc_info()[0])
+            self.logger.error(traceback.format_exc())
+
+
+class BatchSegmentationWorker(QThread):
+    '''
+    The BatchSegmentationWorker calculates the masks of several slices, in parallel over a pool of processes, from a
+    background thread, such that the gui stays responsive.
+
+    The processes are started with "spawn": forking the application while Qt threads are running can leave the
+    child processes with locks that are never released. As with the SegmentationWorker, the masks are handed back
+    with the signal mask_ready and set on the slices in the GUI thread.
+    '''
+
+    # emitted with (percentage, message) after every slice
+    progress = pyqtSignal(int, str)
+    # emitted with (slice, mask, score_map) for every slice that is segmented, until cancelled
+    mask_ready = pyqtSignal(object, object, object)
+
+    def __init__(self, jobs, max_workers=None, logger=None, diagnostics=None):
+        '''
+        :param jobs: list of tuples (slice, pixels, inner_mask, outer_mask, segmentation_parameters), see
+        Reconstruction.get_segmentation_jobs
+        :param max_workers: the number of processes, None uses all cores
+        :param logger: the logger
+        :param diagnostics: optional DiagnosticsWriter, to which figures of the masks are written
+        '''
+        super().__init__()
+        self.jobs = jobs
+        self.max_workers = max_workers
+        self.logger = logger
+        self.diagnostics = diagnostics
+        self.cancelled = False
+
+    def cancel(self):
+        '''
+        stops the segmentation: the slices that are not started yet are skipped, and no more masks are emitted
+        :return: None
+        '''
+        self.cancelled = True
+
+    def run(self):
+        try:
+            cnt = 0
+            with ProcessPoolExecutor(max_workers=self.max_workers,
+                                     mp_context=multiprocessing.get_context("spawn")) as executor:
+                futures = {}
+                for slice, pixels, inner_mask, outer_mask, segmentation_parameters in self.jobs:
+                    future = executor.submit(calc_foreground_background_mask, pixels=pixels, inner_mask=inner_mask,
+                                             outer_mask=outer_mask, **segmentation_parameters)
+                    futures[future] = (slice, pixels, inner_mask, outer_mask)
+                pending = set(futures)
+                while len(pending) > 0:
+                    # wake up now and then to check whether the segmentation is cancelled
+                    done, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                    if self.cancelled:
+                        for future in pending:
+                            future.cancel()
+                        self.logger.info(f"Segmentation of all slices cancelled, after {cnt} of {len(self.jobs)}")
+                        return
+                    for future in done:
+                        slice, pixels, inner_mask, outer_mask = futures[future]
+                        cnt += 1
+                        try:
+                            mask, score_map = future.result()
+                            self.mask_ready.emit(slice, mask, score_map)
+                            if self.diagnostics is not None:
+                                self.diagnostics.submit(f"slice_{slice.id}_mask", plot_foreground_background_mask,
+                                                        pixels, inner_mask, outer_mask, mask)
+                            self.logger.info(f"Calculated mask of slice {slice.id} ({cnt} of {len(self.jobs)})")
+                        except:
+                            self.logger.error(f"Calculating the mask of slice {slice.id} failed")
+                            self.logger.error(sys.exc_info()[0])
+                            self.logger.error(traceback.format_exc())
+                        self.progress.emit(int(100 * cnt / len(self.jobs)),
+                                           f"Segmented {cnt} of {len(self.jobs)} slices")
+        except:
+            self.logger.error(sys.exc_info()[0])
+            self.logger.error(traceback.format_exc())
@@ -1,15 +1,18 @@
 import sys
 import traceback
 
-import matplotlib.pyplot as plt
-from sklearn.svm import SVC
-from skimage import morphology
+import mask_codec
+import segmentation
 import numpy as np
 import cv2
 
 
 from PyQt5.QtCore import QPoint, QRect, QSize, Qt
-from PyQt5.QtGui import QPixmap, QColor , QPainter, QPolygon, QImage, QPen
+from PyQt5.QtGui import QPixmap, QImage, QPen
+
+from diagnostics import plot_foreground_background_mask, plot_inner_and_outer_mask
+from packed_mask import PackedMask
+from slice_trace import Trace
 
 
 class Slice():
@@ -19,7 +22,7 @@ class Slice():
         -an id, indicating the stacking order
         -possibly a list of "traces", i.e. thick line segments (of pen_width) which show the manually annotated contour
          The list of traces may be empty
-        -possibly a binary mask, distinguishing foreground from background
+        -possibly a binary mask, distinguishing foreground from background, stored as a PackedMask
          if the mask has not been calculated yet, the mask will be None
         -needle markings (not implemented yet)
 
@@ -33,10 +36,14 @@ class Slice():
         self.slice_photo=None
         # id of the slice
         self.id=0
-        # a list of traces, used for manually annotating the
+        # a list of traces (Trace objects), used for manually annotating the
         self.traces=[]
+        # the traces rasterised for the segmentation, updated incrementally. None if it has to be rebuilt
+        self.trace_canvas=None
 
         self.mask=None
+        # the decision values of the classifier (float32), only kept on request, for later refinement of the mask
+        self.score_map=None
         # the pen width is yet assumed to be constant, we may want to change that.
         self.pen_width=45
         self.max_num_train_pixels = 500
@@ -66,6 +73,7 @@ class Slice():
         obj.id=slice.id
         obj.traces=slice.traces
         obj.mask = slice.mask
+        obj.score_map = getattr(slice, "score_map", None)
         obj.pen_width = slice.pen_width
         obj.max_num_train_pixels = slice.max_num_train_pixels
         return obj
@@ -81,6 +89,7 @@ class Slice():
         del self.macro_photo
         del self.slice_photo
         del self.logger
+        self.trace_canvas = None
         return
 
     def restore_non_serializable_objects(self, macro_photo, logger):
@@ -94,6 +103,15 @@ class Slice():
         self.macro_photo=macro_photo
         self.slice_photo=macro_photo.copy(self.rect)
         self.logger=logger
+        self.trace_canvas=None
+        # older pickles have no score_map
+        self.score_map=getattr(self, "score_map", None)
+        # older pickles have the mask as an int array
+        if isinstance(self.mask, np.ndarray):
+            self.mask=PackedMask.create_from_array(self.mask)
+        # older pickles have the traces as lists of QPoints
+        self.traces=[trace if isinstance(trace, Trace) else Trace.create_from_points([(p.x(), p.y()) for p in trace])
+                     for trace in self.traces]
         return
 
     def paint(self, painter, size,show_traces):
@@ -114,9 +132,11 @@ class Slice():
                 # more or less standard work with images
                 arr_photo = self.get_np_array(photo)
                 arr_photo = cv2.cvtColor(arr_photo, cv2.COLOR_BGR2RGB)
-                exp_mask=np.expand_dims(self.mask, -1)
-                #adding the alpha channel:
-                arr_photo=np.concatenate((arr_photo,255*exp_mask),axis=2).astype(np.uint8)
+                #adding the alpha channel, only the bounding box of the mask is unpacked
+                alpha=np.zeros(arr_photo.shape[:2] + (1,), dtype=np.uint8)
+                top, left, height, width = self.mask.bbox
+                alpha[top:top + height, left:left + width, 0] = 255 * self.mask.get_crop()
+                arr_photo=np.concatenate((arr_photo,alpha),axis=2)
                 #creating the QImage
                 qimage = QImage(arr_photo, arr_photo.shape[1], arr_photo.shape[0],
                                 QImage.Format_ARGB32)
@@ -132,7 +152,7 @@ class Slice():
                 pen.setCapStyle(Qt.RoundCap)
                 painter.setPen(pen)
                 for trace in self.traces:
-                    painter.drawPolyline(QPolygon(trace))
+                    painter.drawPolyline(trace.get_polygon())
         except:
             self.logger.error(sys.exc_info()[0])
             self.logger.error(traceback.format_exc())
@@ -146,20 +166,47 @@ class Slice():
         '''
 
         self.traces=self.traces[:-1]
+        # the trace can not be erased from the trace canvas, so it is rebuilt when needed
+        self.trace_canvas=None
 
     def start_trace(self):
         '''
         Starting a new trace, by appending an emtpy trace to the list of traces.
         '''
-        self.traces.append([])
+        self.traces.append(Trace())
 
     def add_to_trace(self,point):
         '''
         Adding a point to the trace
+        Points closer than the trace tolerance to the previous point are skipped, as they make no visible difference
+        with the thick pen.
         :param point: QPoint, location of trace
+        :return: True if the point was added
+        '''
+        trace = self.traces[-1]
+        if trace.is_near_last_point(point.x(), point.y(), self.get_trace_tolerance()):
+            return False
+        trace.append(point.x(), point.y())
+        if self.trace_canvas is not None:
+            previous_point = trace.points[-2] if len(trace) > 1 else None
+            self.trace_canvas.add_point(trace.points[-1], previous_point)
+        return True
+
+    def finish_trace(self):
+        '''
+        Finishing the current trace, by simplifying it with the Ramer-Douglas-Peucker algorithm.
+        The simplified trace lies within the trace tolerance of the drawn one, so the trace canvas is kept as is.
         :return: None
         '''
-        self.traces[-1].append(point)
+        if len(self.traces) > 0:
+            num_dropped = self.traces[-1].simplify(self.get_trace_tolerance())
+            self.logger.debug(f"Simplified trace to {len(self.traces[-1])} points, dropped {num_dropped}")
+
+    def get_trace_tolerance(self):
+        '''
+        :return: the distance in pixels within which trace points are dropped, tied to the pen width
+        '''
+        return self.pen_width / 20
 
 
     def get_np_array(self, pixmap=None):
@@ -183,74 +230,37 @@ class Slice():
         return arr
 
 
-    def calc_foreground_background_mask(self):
+    def calc_foreground_background_mask(self, classifier="lookup_table", keep_score_map=False, coarse_factor=4,
+                                        band_width=8, diagnostics=None):
         '''
         Calculates the mask (self.maks) based on the traces and an SVM
+        The segmentation itself is done by segmentation.calc_foreground_background_mask, which can also run in a
+        SegmentationWorker, to keep the gui responsive
+        :param classifier: the name of the pixel classifier, see pixel_classifier.pixel_classifiers
+        :param keep_score_map: if True, the decision values of the classifier are kept in self.score_map
+        :param coarse_factor: the pixels are first classified on the slice downsampled by this factor, and only the
+        pixels near the coarse boundary are classified at full resolution. 1 classifies all pixels at full resolution
+        :param band_width: the half width in pixels of the band around the coarse boundary that is re-classified
+        :param diagnostics: optional DiagnosticsWriter, to which the figures of the masks are written
         :return:
         '''
         try:
             #first create the inner and the outer mask, marking which pixels have been marked by the user as
             #definitely inside or definitely outside the slice
-            inner_mask, outer_mask = self.create_inner_and_outer_mask()
+            inner_mask, outer_mask = self.create_inner_and_outer_mask(diagnostics=diagnostics)
             # get a numpy array from the image
             pixels = self.get_np_array()
-            # and use this to create a trainings set of pixels inside and outside
-            X_in = pixels[inner_mask].reshape((-1, 3))
-            X_out= pixels[outer_mask].reshape((-1, 3))
-            # undersample max_num_train_pixels
-            X_in_sel=np.arange(len(X_in),dtype=np.int)
-            X_out_sel=np.arange(len(X_out),dtype=np.int)
-            num_train_pixels=min(len(X_in_sel),len(X_out_sel),self.max_num_train_pixels)
-
-            np.random.shuffle(X_in_sel)
-            X_in_sel=X_in_sel[:num_train_pixels]
-            np.random.shuffle(X_out_sel)
-            X_out_sel=X_out_sel[:num_train_pixels]
-
-            X_in=X_in[X_in_sel]
-            X_out=X_out[X_out_sel]
-            Y_in=np.ones((X_in.shape[0],1))
-            Y_out=np.zeros((X_out.shape[0],1))
-            X = np.vstack((X_in, X_out))
-            y = np.vstack((Y_in, Y_out))
-            # and train an SVM
-            svm = SVC().fit(X=X, y=y)
-
-            # apply the SVM on all pixels
-            pred_svm = svm.predict(pixels.reshape((-1, 3))).reshape((pixels.shape[0],pixels.shape[1] ))
-            prob_svm = svm.decision_function(pixels.reshape((-1, 3))).reshape((pixels.shape[0],pixels.shape[1] ))
-
-            # but have the precalculated masks take precedence
-            pred_svm=np.minimum(np.maximum(inner_mask,pred_svm),~outer_mask)
-            prob_svm=np.minimum(np.maximum(inner_mask,prob_svm),~outer_mask)
-
-            #remove objects that are smaller than 100 pixels
-            pred_svm = morphology.remove_small_objects(pred_svm.astype(np.bool), min_size=100, connectivity=2).astype(int)
-            # remove holes  that are smaller than 100 pixels
-            pred_svm = morphology.remove_small_holes(pred_svm.astype(np.bool), area_threshold=100, connectivity=2).astype(int)
-
-            #and that results in the final mask
-            self.mask=pred_svm
-
-            # create a matplotlib visualization, only visible in the IDE
-            color_inner= (pixels.reshape((-1, 3))[pred_svm.reshape((-1)).astype(np.bool)])
-            color_inner=np.mean(color_inner, axis=0, dtype=np.int)
-            color_outer= (pixels.reshape((-1, 3))[~pred_svm.reshape((-1)).astype(np.bool)])
-            color_outer=np.mean(color_outer, axis=0, dtype=np.int)
-            fig, axs = plt.subplots(3, 2)
-            axs[0, 0].imshow(1*inner_mask-1*outer_mask)
-            axs[0, 1].imshow(pixels)
-            axs[1, 0].imshow(self.mask, vmin=0, vmax=1)
-            axs[1,1].imshow(self.mask, vmin=0, vmax=1)
-            axs[2,0].imshow(np.expand_dims(self.mask,-1).astype(np.int)*pixels + np.expand_dims(1-self.mask,-1).astype(np.int)*color_inner)
-            axs[2,1].imshow(np.expand_dims(1-self.mask,-1).astype(np.int)*pixels + np.expand_dims(self.mask,-1).astype(np.int)*color_outer)
-            for axh in axs:
-                for ax in axh:
-                    ax.set_aspect('equal')
-                    ax.set_axis_off()
-
-            fig.tight_layout()
-            plt.show()
+            mask, score_map = segmentation.calc_foreground_background_mask(pixels=pixels, inner_mask=inner_mask,
+                                                                           outer_mask=outer_mask,
+                                                                           max_num_train_pixels=self.max_num_train_pixels,
+                                                                           classifier=classifier,
+                                                                           keep_score_map=keep_score_map,
+                                                                           coarse_factor=coarse_factor,
+                                                                           band_width=band_width)
+            self.set_mask(mask, score_map)
+            if diagnostics is not None:
+                diagnostics.submit(f"slice_{self.id}_mask", plot_foreground_background_mask, pixels, inner_mask,
+                                   outer_mask, mask)
             return None
 
         except:
@@ -258,61 +268,47 @@ class Slice():
             self.logger.error(traceback.format_exc())
             return None
 
+    def set_mask(self, mask, score_map=None):
+        '''
+        sets the result of a segmentation
+        :param mask: the foreground/background mask, a numpy array or a PackedMask
+        :param score_map: the decision values of the classifier, if kept
+        :return: None
+        '''
+        if not isinstance(mask, PackedMask):
+            mask = PackedMask.create_from_array(mask)
+        self.mask = mask
+        self.score_map = score_map
+
+    def get_trace_canvas(self):
+        '''
+        :return: the TraceCanvas with the traces, built from scratch only if it is not up to date
+        '''
+        if self.trace_canvas is None:
+            traces = [trace.points for trace in self.traces]
+            self.trace_canvas = segmentation.TraceCanvas.create_from_traces(
+                traces, shape=(self.slice_photo.height(), self.slice_photo.width()), pen_width=self.pen_width)
+        return self.trace_canvas
 
-    def create_inner_and_outer_mask(self):
+    def create_inner_and_outer_mask(self, diagnostics=None):
         '''
         Based on the traces, this function creates two masks: One ('inner_mask') to mark all pixels inside the shape
         as defined by the traces,  and one mask, 'outer_mask' to mark the pixels outside the shape defined by the traces
+        :param diagnostics: optional DiagnosticsWriter, to which a figure of the masks is written
         :return: inner_mask and outer_mask: Two boolean masks
         '''
 
-        # use the same method to draw the traces
-        pixmap = QPixmap(self.slice_photo.size())
-        pixmap.fill(QColor(255, 255, 255))
-        painter = QPainter()
-        painter.begin(pixmap)
-        pen = QPen()
-        pen.setWidth(self.pen_width)
-        pen.setBrush(Qt.black)
-        pen.setCapStyle(Qt.RoundCap)
-        painter.setPen(pen)
-        for trace in self.traces:
-            painter.drawPolyline(QPolygon(trace))
-        painter.end()
-        # that is us done painting
-        #convert the Qpixmap into a numpy array
-        arr = self.get_np_array(pixmap)
-        # find the center
-        arr = np.mean(arr, axis=-1, dtype=np.uint8)
-        l = []
-        for trace in self.traces:
-            l = l + [[p.x(), p.y()] for p in trace]
-        center = np.mean(np.array(l), axis=0, dtype=np.int)
-
-        # fill the shape ( using floodfill)  starting from the center
-        inner_mask = arr.copy()
-        h, w = inner_mask.shape[:2]
-        mask = np.zeros((h + 2, w + 2), np.uint8)
-        cv2.floodFill(inner_mask, mask, (center[0], center[1]), 128);
-
-        #and calculate the masks
-        inner_mask = (inner_mask > 100).astype(np.bool)
-        middle_mask = (arr < 32).astype(np.bool)
-        outer_mask = np.logical_and(~inner_mask, ~middle_mask)
-
-
-        # for debugging purposes, create a matplotlib image (only visible in IDE)
-        fig, axs = plt.subplots(2, 2)
-        axs[0, 0].imshow(arr)
-        axs[0, 1].imshow(middle_mask)
-        axs[1, 0].imshow(inner_mask)
-        axs[1, 1].imshow(outer_mask)
-
-        for axh in axs:
-            for ax in axh:
-                ax.set_aspect('equal')
-        fig.tight_layout()
-        plt.show()
+        # the traces drawn on a single channel canvas, the same way as they are painted
+        trace_canvas = self.get_trace_canvas()
+        arr = trace_canvas.canvas
+
+        # fill the shape ( using floodfill)  starting from the center, and calculate the masks
+        inner_mask, middle_mask, outer_mask = segmentation.create_inner_and_outer_mask(arr, trace_canvas.center)
+
+        if diagnostics is not None:
+            # for debugging purposes, write a figure of the masks
+            diagnostics.submit(f"slice_{self.id}_seeds", plot_inner_and_outer_mask, arr.copy(), middle_mask,
+                               inner_mask, outer_mask)
 
         return inner_mask, outer_mask
 
@@ -325,13 +321,16 @@ class Slice():
         rect=QRect(data['rect'][0],data['rect'][1],data['rect'][2],data['rect'][3])
         obj=Slice.create_from_photo(macro_photo=macro_photo, rect=rect, id=data['id'], logger=logger)
 
-        if 'mask_ones' in data and'mask_minus_ones' in data:
-            obj.mask = obj.reverse_compressed_json_mask(rect, data['mask_ones'], data['mask_minus_ones'])
+        if 'mask_rle' in data:
+            obj.set_mask(mask_codec.decode_mask(data['mask_rle']))
+            obj.logger.info(f"Shape {obj.mask.shape}")
+        elif 'mask_ones' in data and'mask_minus_ones' in data:
+            obj.set_mask(obj.reverse_compressed_json_mask(rect, data['mask_ones'], data['mask_minus_ones']))
             obj.logger.info(f"Shape {obj.mask.shape}")
         else:
             obj.mask = None
         obj.logger.info(f"rect {rect}")
-        obj.traces =[[QPoint(point[0], point[1]) for point in trace] for trace in data['traces']]
+        obj.traces =[Trace.create_from_serialised(trace) for trace in data['traces']]
         obj.pen_width=data['pen_width']
         obj.max_num_train_pixels=data['max_num_train_pixels'] 
         return obj
@@ -341,23 +340,16 @@ class Slice():
         :param rect: the Qrect object that defines the bounding box of the slice within the macro photo
         :param mask_ones: the distances between positions in the raveled mask for 0 to 1 transitions
         :param mask_minus_ones: the distances between positions in the raveled mask for 1 to 0 transitions
-        :return: the resulting mask, with a shape defined by rect
+        :return: the resulting mask as a boolean array, with a shape defined by rect
         '''
-        mask_ones=mask_ones.copy()
-        mask_minus_ones=mask_minus_ones.copy()
-        mask_ones[0] += 1
-        mask_minus_ones[0] += 1
-        mask = np.zeros((rect.height(), rect.width()), dtype=np.int8).ravel()
-        mask[np.nancumsum(mask_minus_ones)] = -1
-        mask[np.nancumsum(mask_ones)] = 1
-        mask = np.nancumsum(mask)
-        mask = mask.reshape((rect.height(), rect.width()))
-        return mask
+        return mask_codec.decode_transitions((rect.height(), rect.width()), mask_ones, mask_minus_ones)
 
 
-    def get_dict_for_serialisation(self):
+    def get_dict_for_serialisation(self, mask_encoding="varint_base64", verify_mask=False):
         '''
         extract the  contour data as a dict for serialisation.
+        :param mask_encoding: the encoding of the run lengths of the mask, see mask_codec.encode_mask
+        :param verify_mask: if True, the encoded mask is decoded again and compared with the mask
         :return: a dict
         '''
 
@@ -369,35 +361,68 @@ class Slice():
         else:
             data['rect'] = None
 
-        # here we are doing a little trick to compress the mask in a relatively short sequence
-        # the idea is that we first ravel the mask, i.e. make a one dimensional vector out of it
-        # then we count the distance between all transitions from 0 to 1s and put that list of distances in a list
-        # called 'mask_ones'. And for the opposite transition we do the same, putting all distances in a list
-        # called 'mask_minus_ones'
-
-
-
+        # the mask is compressed by run length encoding, see mask_codec
+        # (older files have the distances between the 0 to 1 and 1 to 0 transitions, in 'mask_ones' and
+        # 'mask_minus_ones', these can still be read)
         if self.mask is not None:
             self.logger.info(f"Shape {self.mask.shape}")
-            d=np.diff(self.mask.ravel())
-            ones=np.diff([0]+list(np.where(d == 1)[0]))
-            minus_ones = np.diff([0]+list(np.where(d == -1)[0]))
-            data['mask_ones']=[int(i) for i in list(ones)]
-            data['mask_minus_ones']=[int(i) for i in list(minus_ones)]
+            mask = self.mask.to_array()
+            data['mask_rle']=mask_codec.encode_mask(mask, encoding=mask_encoding)
 
-            # once the masks are generated we use the reverse operation to check we have the same outcome
-            reverse_mask= self.reverse_compressed_json_mask(self.rect, data['mask_ones'], data['mask_minus_ones'])
-            res= np.isclose(reverse_mask,self.mask).all()
-            self.logger.info(f"is OK {res}")
+            if verify_mask:
+                # decode the mask again, to check we have the same outcome
+                res = np.array_equal(mask_codec.decode_mask(data['mask_rle']), mask)
+                self.logger.info(f"is OK {res}")
 
         else:
             data['mask'] = self.mask
         # self.logger.info(f"mask :{data['mask']}")
-        if len (self.traces)>0 :
-            data['traces']=[[(point.x(),point.y()) for point in trace] for trace in self.traces]
-        else:
-            data['traces']=self.traces
+        # every trace as a flat list [x0, y0, x1, y1, ...]
+        data['traces']=[trace.get_serialised() for trace in self.traces]
         data['id']=self.id
         data['pen_width']=self.pen_width
         data['max_num_train_pixels']=self.max_num_train_pixels 
-        return data
\ No newline at end of file
+        return data
+
+    def get_project_data(self):
+        '''
+        extract the slice for the project file (see project_file): the meta data as a json serialisable dict, and the
+        arrays. The points of all traces are stored as one array, with the number of points per trace in the meta data
+        :return: a dict with the meta data, and a dict with the arrays
+        '''
+        data = {'rect': self.rect.getRect(),
+                'id': self.id,
+                'pen_width': self.pen_width,
+                'max_num_train_pixels': self.max_num_train_pixels,
+                'trace_lengths': [len(trace) for trace in self.traces]}
+        arrays = {'traces': np.concatenate([trace.points for trace in self.traces]) if len(self.traces) > 0
+                  else np.zeros((0, 2), dtype=np.int32)}
+        if self.mask is not None:
+            data['mask'] = {'shape': list(self.mask.shape), 'bbox': list(self.mask.bbox)}
+            arrays['mask_bits'] = self.mask.bits
+        if self.score_map is not None:
+            arrays['score_map'] = self.score_map
+        return data, arrays
+
+    @classmethod
+    def create_from_project_data(cls, data, arrays, macro_photo, logger):
+        '''
+        creates a slice as saved in a project file
+        :param data: the meta data, as returned by get_project_data
+        :param arrays: the arrays, as returned by get_project_data. The mask_bits and score_map may be missing
+        :param macro_photo: the macro photo as a QPixmap
+        :param logger: the logger
+        :return: the slice
+        '''
+        rect = QRect(*data['rect'])
+        obj = cls.create_from_photo(macro_photo=macro_photo, rect=rect, id=data['id'], logger=logger)
+        trace_lengths = data['trace_lengths']
+        if len(trace_lengths) > 0:
+            obj.traces = [Trace.create_from_points(points)
+                          for points in np.split(arrays['traces'], np.cumsum(trace_lengths)[:-1])]
+        if 'mask' in data:
+            obj.mask = PackedMask(shape=data['mask']['shape'], bbox=data['mask']['bbox'], bits=arrays['mask_bits'])
+        obj.score_map = arrays.get('score_map')
+        obj.pen_width = data['pen_width']
+        obj.max_num_train_pixels = data['max_num_train_pixels']
+        return obj
@@ -48,10 +48,14 @@ class SlicePhotoWidget(QLabel):
                 self.paint()
             if event.buttons() & Qt.LeftButton:
                 if not self.tracing:
+                    # a running segmentation is outdated by the new trace
+                    self.app.cancel_segmentation()
                     self.slice.start_trace()
+                    self.app.record_slice_change("start_trace", self.slice)
                     self.tracing=True
-                self.slice.add_to_trace(event.pos())
-                self.paint()
+                if self.slice.add_to_trace(event.pos()):
+                    self.app.record_slice_change("trace_point", self.slice, x=event.pos().x(), y=event.pos().y())
+                    self.paint()
         except:
             self.logger.error(sys.exc_info()[0])
             self.logger.error(traceback.format_exc())
@@ -64,6 +68,11 @@ class SlicePhotoWidget(QLabel):
         :return:
         '''
         if event.button() == Qt.LeftButton:
+            if self.tracing:
+                self.tracing=False
+                self.slice.finish_trace()
+                self.app.record_slice_change("finish_trace", self.slice)
+                self.paint()
             self.tracing=False
 
     def set_slice(self, slice):
@@ -0,0 +1,154 @@
+import numpy as np
+
+from PyQt5.QtCore import QPoint
+from PyQt5.QtGui import QPolygon
+
+
+def simplify_polyline(points, tolerance):
+    '''
+    simplifies a polyline with the Ramer-Douglas-Peucker algorithm: the points are dropped that lie within
+    tolerance of the simplified polyline
+    :param points: the points, an array of shape (n, 2)
+    :param tolerance: the maximum distance between a dropped point and the simplified polyline
+    :return: the points that are kept, including the first and the last point
+    '''
+    num_points = len(points)
+    if num_points < 3:
+        return points
+    keep = np.zeros(num_points, dtype=bool)
+    keep[0] = keep[-1] = True
+    coordinates = points.astype(np.float64)
+    # the ranges of points still to be simplified, done with a stack rather than recursion, for long traces
+    stack = [(0, num_points - 1)]
+    while len(stack) > 0:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, end = coordinates[first], coordinates[last]
+        inner = coordinates[first + 1:last]
+        direction = end - start
+        squared_length = direction @ direction
+        # the distance to the segment from start to end, rather than to the line through them: points beyond the
+        # ends (e.g. a stroke that goes out and comes back) are measured to the nearest end
+        if squared_length == 0:
+            u = np.zeros(len(inner))
+        else:
+            u = np.clip((inner - start) @ direction / squared_length, 0, 1)
+        nearest = start + u[:, None] * direction
+        distances = np.hypot(inner[:, 0] - nearest[:, 0], inner[:, 1] - nearest[:, 1])
+        i = int(np.argmax(distances))
+        if distances[i] > tolerance:
+            farthest = first + 1 + i
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    return points[keep]
+
+
+class Trace():
+    '''
+    A trace: a thick polyline, drawn by the user on a slice to annotate its contour.
+
+    The points are stored in a growable int32 numpy array of shape (n, 2) with the x, y coordinates, whose capacity
+    doubles when it is full, such that appending a point is cheap and long traces take 8 bytes per point.
+    A QPolygon of the points is only built for painting, and extended as points are appended.
+    '''
+
+    def __init__(self, capacity=64):
+        '''
+        :param capacity: the initial number of points that fit in the array
+        '''
+        self.buffer = np.zeros((capacity, 2), dtype=np.int32)
+        self.num_points = 0
+        # the QPolygon for painting, None if it still has to be built
+        self.polygon = None
+
+    @classmethod
+    def create_from_points(cls, points):
+        '''
+        :param points: the points, an array like of shape (n, 2) with x, y coordinates
+        :return: the trace
+        '''
+        points = np.asarray(points, dtype=np.int32).reshape((-1, 2))
+        obj = cls(capacity=max(len(points), 64))
+        obj.buffer[:len(points)] = points
+        obj.num_points = len(points)
+        return obj
+
+    @classmethod
+    def create_from_serialised(cls, data):
+        '''
+        :param data: the trace as written by get_serialised, a flat list [x0, y0, x1, y1, ...]. For reading older
+        files, a list of (x, y) pairs is accepted as well
+        :return: the trace
+        '''
+        return cls.create_from_points(np.asarray(data, dtype=np.int32).reshape((-1, 2)))
+
+    def get_serialised(self):
+        '''
+        :return: the points as a flat list [x0, y0, x1, y1, ...], for json serialisation
+        '''
+        return self.points.ravel().tolist()
+
+    @property
+    def points(self):
+        '''
+        :return: a view on the points, an int32 array of shape (n, 2)
+        '''
+        return self.buffer[:self.num_points]
+
+    def __len__(self):
+        return self.num_points
+
+    def append(self, x, y):
+        '''
+        adds a point at the end of the trace
+        :param x: the x coordinate
+        :param y: the y coordinate
+        :return: None
+        '''
+        if self.num_points == len(self.buffer):
+            buffer = np.zeros((2 * len(self.buffer), 2), dtype=np.int32)
+            buffer[:self.num_points] = self.points
+            self.buffer = buffer
+        self.buffer[self.num_points] = (x, y)
+        self.num_points += 1
+        if self.polygon is not None:
+            self.polygon.append(QPoint(x, y))
+
+    def is_near_last_point(self, x, y, distance):
+        '''
+        :return: True if (x, y) lies within distance of the last point of the trace
+        '''
+        if self.num_points == 0:
+            return False
+        last_x, last_y = self.buffer[self.num_points - 1].tolist()
+        return (x - last_x) ** 2 + (y - last_y) ** 2 < distance ** 2
+
+    def simplify(self, tolerance):
+        '''
+        simplifies the trace with simplify_polyline
+        :param tolerance: the maximum distance between a dropped point and the simplified trace
+        :return: the number of points that were dropped
+        '''
+        points = simplify_polyline(self.points, tolerance)
+        num_dropped = self.num_points - len(points)
+        if num_dropped > 0:
+            self.buffer[:len(points)] = points
+            self.num_points = len(points)
+            self.polygon = None
+        return num_dropped
+
+    def get_polygon(self):
+        '''
+        :return: the points as a QPolygon, for painting
+        '''
+        if self.polygon is None:
+            self.polygon = QPolygon([QPoint(x, y) for x, y in self.points.tolist()])
+        return self.polygon
+
+    def __getstate__(self):
+        # the QPolygon is not pickled, it is rebuilt when painting
+        state = self.__dict__.copy()
+        state['polygon'] = None
+        return state
@@ -4,6 +4,10 @@ import requests
 import base64
 import string
 import re
+import threading
+import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
 class SlideScoreErrorException(Exception):
@@ -51,30 +55,129 @@ class SlideScoreResult:
 class APIClient(object):
     print_debug = False
 
-    def __init__(self, server, api_token, disable_cert_checking=False):
+    def __init__(self, server, api_token, disable_cert_checking=False, pool_size=16, max_retries=3, tile_cache=None,
+                 tile_server_ttl=600):
         if (server[-1] == "/"):
             server = server[:-1]
         self.end_point = "{0}/Api/".format(server)
         self.api_token = api_token
         self.disable_cert_checking = disable_cert_checking
+        self.session = self.create_session(pool_size, max_retries)
+        # optional TileCache, consulted by get_tile before going to the tile server
+        self.tile_cache = tile_cache
+        # the metadata of an image never changes, so it is kept for the lifetime of the client
+        self.image_metadata = {}
+        # the url part and cookie of the tile server expire, so they are kept for tile_server_ttl seconds
+        self.tile_server_ttl = tile_server_ttl
+        self.tile_servers = {}
+        self.cache_lock = threading.Lock()
+        # guards tile_servers and tile_server_image_locks, never held during a request
+        self.tile_server_lock = threading.Lock()
+        # one lock per image, held while refreshing the tile server of that image
+        self.tile_server_image_locks = {}
+
+    def create_session(self, pool_size, max_retries):
+        # one session is shared by the api calls and the tile downloads, such that connections are kept alive
+        # and reused instead of doing a new TCP and TLS handshake for every request.
+        # pool_size should be at least the number of threads downloading tiles simultaneously
+        session = requests.Session()
+        retry = Retry(total=max_retries, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.verify = not self.disable_cert_checking
+        return session
 
     def perform_request(self, request, data, method="POST"):
         headers = {'Accept': 'application/json'}
         headers['Authorization'] = 'Bearer {auth}'.format(auth=self.api_token)
         url = "{0}{1}".format(self.end_point, request)
-        verify=True
-        if self.disable_cert_checking:
-            verify=False
 
         if method == "POST":
-            response = requests.post(url, verify=verify, headers=headers, data=data)
+            response = self.session.post(url, headers=headers, data=data)
         else:
-            response = requests.get(url, verify=verify, headers=headers, data=data, stream=True)
+            response = self.session.get(url, headers=headers, data=data, stream=True)
         if response.status_code != 200:
             response.raise_for_status()
 
         return response
 
+    def get_image_metadata(self, imageid):
+        with self.cache_lock:
+            if imageid in self.image_metadata:
+                return self.image_metadata[imageid]
+        metadata = None
+        if self.tile_cache is not None:
+            metadata = self.tile_cache.get_metadata(imageid)
+        if metadata is None:
+            response = self.perform_request("GetImageMetadata?imageId="+str(imageid), None, method="GET")
+            metadata = response.json()['metadata']
+            if self.tile_cache is not None:
+                self.tile_cache.put_metadata(imageid, metadata)
+        with self.cache_lock:
+            self.image_metadata[imageid] = metadata
+        return metadata
+
+    def get_case_image_ids(self, studyid, caseid, email=None):
+        # the ids are kept in the tile cache, such that a case that was opened before can be opened again while
+        # Slide Score can not be reached
+        try:
+            response = self.perform_request("Scores", {"studyid": studyid, "question": None, "email": email,
+                                                       "imageid": None, "caseid": caseid})
+            imageids = sorted(set(int(r['imageID']) for r in response.json()))
+        except requests.exceptions.RequestException:
+            imageids = self.tile_cache.get_case_image_ids(studyid, caseid) if self.tile_cache is not None else None
+            if imageids is None:
+                raise
+            return imageids
+        if self.tile_cache is not None:
+            self.tile_cache.put_case_image_ids(studyid, caseid, imageids)
+        return imageids
+
+    def get_tile_server(self, imageid):
+        with self.tile_server_lock:
+            entry = self.tile_servers.get(imageid)
+            if entry is not None and entry[2] >= time.monotonic():
+                return entry[0], entry[1]
+            image_lock = self.tile_server_image_locks.setdefault(imageid, threading.Lock())
+        # only one thread per image refreshes, the others wait and then use the refreshed entry. Threads of other
+        # images are not held up by the request
+        with image_lock:
+            with self.tile_server_lock:
+                entry = self.tile_servers.get(imageid)
+            if entry is None or entry[2] < time.monotonic():
+                response = self.perform_request("GetTileServer?imageId="+str(imageid), None, method="GET")
+                rjson = response.json()
+                entry = (rjson['urlPart'], rjson['cookiePart'], time.monotonic() + self.tile_server_ttl)
+                with self.tile_server_lock:
+                    self.tile_servers[imageid] = entry
+            return entry[0], entry[1]
+
+    def invalidate_tile_server(self, imageid, cookie):
+        # only drop the entry if nobody refreshed it in the meantime
+        with self.tile_server_lock:
+            entry = self.tile_servers.get(imageid)
+            if entry is not None and entry[1] == cookie:
+                del self.tile_servers[imageid]
+
+    def get_tile(self, imageid, level, x, y):
+        if self.tile_cache is not None:
+            content = self.tile_cache.get(imageid, level, x, y)
+            if content is not None:
+                return content
+        url_part, cookie = self.get_tile_server(imageid)
+        response = self.request_tile(imageid, url_part, cookie, level, x, y)
+        if response.status_code in [401, 403]:
+            # the cookie expired earlier than expected, refresh it and try once more
+            self.invalidate_tile_server(imageid, cookie)
+            url_part, cookie = self.get_tile_server(imageid)
+            response = self.request_tile(imageid, url_part, cookie, level, x, y)
+        if response.status_code != 200:
+            response.raise_for_status()
+        if self.tile_cache is not None:
+            self.tile_cache.put(imageid, level, x, y, response.content)
+        return response.content
+
     def get_images(self, studyid):
         response = self.perform_request("Images", {"studyid": studyid})
         rjson = response.json()
@@ -120,10 +223,13 @@ class APIClient(object):
         if (not rjson['success']):
             raise SlideScoreErrorException(rjson['log'])
 
+    def request_tile(self, imageid, url_part, cookie, level, x, y):
+        url = self.end_point.replace("/Api/", "/i/{0}/{1}/i_files/{2}/{3}_{4}.jpeg".format(imageid, url_part, level, x, y))
+        return self.session.get(url, cookies={'t': cookie})
+
     def get_image_server_url(self, imageid):
-        response = self.perform_request("GetTileServer?imageId="+str(imageid), None,  method="GET")
-        rjson = response.json()
-        return ( self.end_point.replace("/Api/","/i/"+str(imageid)+"/"+rjson['urlPart']+"/_files"), rjson['cookiePart'] )
+        url_part, cookie = self.get_tile_server(imageid)
+        return ( self.end_point.replace("/Api/","/i/"+str(imageid)+"/"+url_part+"/_files"), cookie )
 
     def _get_filename(self, s):
       fname = re.findall("filename\*?=([^;]+)", s, flags=re.IGNORECASE)
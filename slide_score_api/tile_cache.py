@@ -0,0 +1,154 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+
+class TileCache:
+    '''
+    An on-disk cache for the tiles served by the Slide Score tile server.
+
+    Slides never change once they are uploaded, so a tile is fully identified by its image id, its level in
+    the pyramid and its x/y position. The encoded (jpeg) content is stored as-is under
+    cache_dir/<image id>/<level>/<x>_<y>.jpeg
+
+    The metadata of the images is stored next to the tiles, in cache_dir/<image id>/metadata.json, and is never
+    evicted. Neither are the ids of the images of each case, stored in cache_dir/cases/<study id>_<case id>.json,
+    such that a case can be opened again without a connection to Slide Score.
+
+    The total size of the cache is capped at max_size_mb. When the cap is exceeded, the least recently used
+    tiles are evicted. The modification time of a tile is updated whenever the tile is read, such that the
+    LRU order survives a restart of the application.
+
+    The cache is used from the worker threads downloading the tiles, so all bookkeeping is done under a lock.
+    '''
+
+    def __init__(self, cache_dir, max_size_mb=2048):
+        '''
+        :param cache_dir: the directory in which the tiles are stored
+        :param max_size_mb: the maximum size of the cache in MB
+        '''
+        self.cache_dir = Path(cache_dir)
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.lock = threading.Lock()
+        # maps the path of each cached tile to its size, ordered from least to most recently used
+        self.entries = OrderedDict()
+        self.total_size = 0
+        self.scan()
+
+    def scan(self):
+        '''
+        builds the LRU index from the tiles that are already on disk
+        :return: None
+        '''
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tiles = []
+        for path in self.cache_dir.glob("*/*/*.jpeg"):
+            try:
+                stat = path.stat()
+                tiles.append((stat.st_mtime, path, stat.st_size))
+            except FileNotFoundError:
+                pass
+        with self.lock:
+            self.entries.clear()
+            self.total_size = 0
+            for _, path, size in sorted(tiles, key=lambda tile: tile[0]):
+                self.entries[path] = size
+                self.total_size += size
+            self.evict()
+
+    def get_path(self, imageid, level, x, y):
+        return self.cache_dir / str(imageid) / str(level) / "{0}_{1}.jpeg".format(x, y)
+
+    def get(self, imageid, level, x, y):
+        '''
+        :return: the content of the tile, or None if the tile is not in the cache
+        '''
+        path = self.get_path(imageid, level, x, y)
+        with self.lock:
+            if path not in self.entries:
+                return None
+            self.entries.move_to_end(path)
+        try:
+            content = path.read_bytes()
+            os.utime(path)
+            return content
+        except FileNotFoundError:
+            # removed behind our back
+            with self.lock:
+                self.total_size -= self.entries.pop(path, 0)
+            return None
+
+    def put(self, imageid, level, x, y, content):
+        '''
+        stores the content of a tile, and evicts the least recently used tiles if the cache is full
+        :return: None
+        '''
+        path = self.get_path(imageid, level, x, y)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write to a temporary file first, such that a crash never leaves a truncated tile in the cache
+        tmp_path = path.with_name("{0}.{1}.tmp".format(path.name, threading.get_ident()))
+        tmp_path.write_bytes(content)
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.total_size -= self.entries.pop(path, 0)
+            self.entries[path] = len(content)
+            self.total_size += len(content)
+            self.evict()
+
+    def get_metadata(self, imageid):
+        '''
+        :return: the metadata of the image as a dict, or None if the metadata is not in the cache
+        '''
+        path = self.cache_dir / str(imageid) / "metadata.json"
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def put_metadata(self, imageid, metadata):
+        '''
+        stores the metadata of an image
+        :return: None
+        '''
+        path = self.cache_dir / str(imageid) / "metadata.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name("{0}.{1}.tmp".format(path.name, threading.get_ident()))
+        with open(tmp_path, "w") as f:
+            json.dump(metadata, f)
+        os.replace(tmp_path, path)
+
+    def get_case_image_ids(self, studyid, caseid):
+        '''
+        :return: the ids of the images of the case as a list, or None if they are not in the cache
+        '''
+        path = self.cache_dir / "cases" / "{0}_{1}.json".format(studyid, caseid)
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def put_case_image_ids(self, studyid, caseid, imageids):
+        '''
+        stores the ids of the images of a case
+        :return: None
+        '''
+        path = self.cache_dir / "cases" / "{0}_{1}.json".format(studyid, caseid)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name("{0}.{1}.tmp".format(path.name, threading.get_ident()))
+        with open(tmp_path, "w") as f:
+            json.dump(list(imageids), f)
+        os.replace(tmp_path, path)
+
+    def evict(self):
+        # should be called while holding self.lock
+        while self.total_size > self.max_size and len(self.entries) > 0:
+            path, size = self.entries.popitem(last=False)
+            self.total_size -= size
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,246 @@
+import argparse
+import io
+import json
+import re
+import threading
+import time
+import uuid
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from PIL import Image
+
+
+class SyntheticPyramid:
+    '''
+    A synthetic image pyramid, laid out like the pyramids of the Slide Score tile server.
+    The pixels are a smooth pattern that depends on the image id, such that the jpeg tiles have a realistic size.
+    '''
+
+    def __init__(self, image_id, width, height, tile_size=256, mpp=0.25):
+        self.image_id = image_id
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.mpp = mpp
+        self.max_level = max(width, height).bit_length()
+
+    def get_metadata(self):
+        return {'level0Width': self.width, 'level0Height': self.height,
+                'level0TileWidth': self.tile_size, 'level0TileHeight': self.tile_size,
+                'mppX': self.mpp, 'mppY': self.mpp}
+
+    @lru_cache(maxsize=4096)
+    def get_tile(self, level, x, y):
+        '''
+        :return: the jpeg content of the tile, or None if the tile does not exist
+        '''
+        scale = 2 ** (self.max_level - level)
+        level_width = -(-self.width // scale)
+        level_height = -(-self.height // scale)
+        left, top = x * self.tile_size, y * self.tile_size
+        if level < 0 or level > self.max_level or left >= level_width or top >= level_height:
+            return None
+        cols = np.arange(left, min(left + self.tile_size, level_width)) * scale
+        rows = np.arange(top, min(top + self.tile_size, level_height)) * scale
+        pattern = np.sin(rows[:, None] / 700.0 + self.image_id) * np.cos(cols[None, :] / 900.0)
+        tile = np.stack([200 + 40 * pattern, 150 + 80 * pattern, 200 - 30 * pattern], axis=-1).astype(np.uint8)
+        content = io.BytesIO()
+        Image.fromarray(tile).save(content, format="JPEG", quality=80)
+        return content.getvalue()
+
+
+class DiskPyramid:
+    '''
+    An image pyramid read from disk, in the layout of the TileCache: <directory>/<level>/<x>_<y>.jpeg plus
+    <directory>/metadata.json. A tile cache filled while working with the real Slide Score server can therefore
+    be served as is.
+    '''
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        with open(self.directory / "metadata.json", "r") as f:
+            self.metadata = json.load(f)
+
+    def get_metadata(self):
+        return self.metadata
+
+    def get_tile(self, level, x, y):
+        path = self.directory / str(level) / "{0}_{1}.jpeg".format(x, y)
+        if not path.is_file():
+            return None
+        return path.read_bytes()
+
+
+class SlideScoreStandIn:
+    '''
+    A local stand-in for the Slide Score server, for measuring the loading performance without the production
+    server. It serves the parts of the API the reconstruction tool uses:
+        GET  /Api/GetImageMetadata?imageId=...
+        GET  /Api/GetTileServer?imageId=...
+        POST /Api/Scores
+        GET  /i/<image id>/<url part>/i_files/<level>/<x>_<y>.jpeg
+    Every request is delayed by latency seconds, to simulate the round trip to the real server.
+    Tiles are only served with a valid cookie, as handed out by GetTileServer, which expires after cookie_ttl seconds.
+    '''
+
+    def __init__(self, pyramids, case_id=13, port=0, latency=0.0, cookie_ttl=600):
+        '''
+        :param pyramids: dict mapping the image id to a SyntheticPyramid or DiskPyramid
+        :param case_id: the case id all images belong to
+        :param port: the port to listen on, 0 picks a free port
+        :param latency: the delay in seconds added to every request
+        :param cookie_ttl: the number of seconds a tile server cookie stays valid
+        '''
+        self.pyramids = pyramids
+        self.case_id = case_id
+        self.latency = latency
+        self.cookie_ttl = cookie_ttl
+        self.cookies = {}
+        self.lock = threading.Lock()
+        self.request_counts = {}
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self.create_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @classmethod
+    def create_synthetic(cls, num_images=4, width=40000, height=30000, tile_size=256, **kwargs):
+        pyramids = {image_id: SyntheticPyramid(image_id=image_id, width=width, height=height, tile_size=tile_size)
+                    for image_id in range(1, num_images + 1)}
+        return cls(pyramids=pyramids, **kwargs)
+
+    @classmethod
+    def create_from_directory(cls, directory, **kwargs):
+        pyramids = {int(path.name): DiskPyramid(path) for path in Path(directory).iterdir()
+                    if path.is_dir() and path.name.isdigit() and (path / "metadata.json").is_file()}
+        return cls(pyramids=pyramids, **kwargs)
+
+    @property
+    def server_url(self):
+        return "http://127.0.0.1:{0}".format(self.server.server_address[1])
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, name):
+        with self.lock:
+            self.request_counts[name] = self.request_counts.get(name, 0) + 1
+
+    def create_cookie(self):
+        cookie = uuid.uuid4().hex
+        with self.lock:
+            self.cookies[cookie] = time.monotonic() + self.cookie_ttl
+        return cookie
+
+    def is_valid_cookie(self, cookie):
+        with self.lock:
+            return cookie in self.cookies and self.cookies[cookie] > time.monotonic()
+
+    def create_handler(self):
+        stand_in = self
+        tile_pattern = re.compile(r"^/i/(\d+)/[^/]+/i_files/(\d+)/(\d+)_(\d+)\.jpeg$")
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # the headers and the body are written separately, without this delayed acks add ~40 ms per request
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def send(self, status, content, content_type="application/json"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def send_json(self, data):
+                self.send(200, json.dumps(data).encode())
+
+            def get_image_id(self, query):
+                try:
+                    image_id = int(query.get('imageId', query.get('imageid'))[0])
+                except (TypeError, ValueError):
+                    return None
+                return image_id if image_id in stand_in.pyramids else None
+
+            def do_GET(self):
+                time.sleep(stand_in.latency)
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                # the api client sends a (empty) body with GET requests
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                match = tile_pattern.match(url.path)
+                if match is not None:
+                    stand_in.count("tile")
+                    cookies = self.headers.get("Cookie", "")
+                    cookie = dict(c.strip().split("=", 1) for c in cookies.split(";") if "=" in c).get("t")
+                    if not stand_in.is_valid_cookie(cookie):
+                        return self.send(403, b"")
+                    image_id, level, x, y = (int(group) for group in match.groups())
+                    pyramid = stand_in.pyramids.get(image_id)
+                    content = pyramid.get_tile(level, x, y) if pyramid is not None else None
+                    if content is None:
+                        return self.send(404, b"")
+                    return self.send(200, content, content_type="image/jpeg")
+                if url.path == "/Api/GetImageMetadata":
+                    stand_in.count("GetImageMetadata")
+                    image_id = self.get_image_id(query)
+                    if image_id is None:
+                        return self.send(404, b"")
+                    return self.send_json({'success': True, 'metadata': stand_in.pyramids[image_id].get_metadata()})
+                if url.path == "/Api/GetTileServer":
+                    stand_in.count("GetTileServer")
+                    if self.get_image_id(query) is None:
+                        return self.send(404, b"")
+                    return self.send_json({'urlPart': "stand-in", 'cookiePart': stand_in.create_cookie()})
+                self.send(404, b"")
+
+            def do_POST(self):
+                time.sleep(stand_in.latency)
+                url = urlparse(self.path)
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if url.path == "/Api/Scores":
+                    stand_in.count("Scores")
+                    return self.send_json([{'imageID': image_id, 'imageName': str(image_id),
+                                            'caseName': str(stand_in.case_id), 'user': "stand-in",
+                                            'question': "", 'answer': ""}
+                                           for image_id in sorted(stand_in.pyramids)])
+                self.send(404, b"")
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Slide Score server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="delay in seconds added to every request")
+    parser.add_argument("--cookie-ttl", type=float, default=600, help="seconds a tile server cookie stays valid")
+    parser.add_argument("--pyramid-dir", default=None, help="serve the pyramids in this (tile cache) directory")
+    parser.add_argument("--num-images", type=int, default=4, help="number of synthetic images")
+    parser.add_argument("--width", type=int, default=40000, help="width of the synthetic images")
+    parser.add_argument("--height", type=int, default=30000, help="height of the synthetic images")
+    args = parser.parse_args()
+
+    if args.pyramid_dir is not None:
+        stand_in = SlideScoreStandIn.create_from_directory(args.pyramid_dir, port=args.port, latency=args.latency,
+                                                           cookie_ttl=args.cookie_ttl)
+    else:
+        stand_in = SlideScoreStandIn.create_synthetic(num_images=args.num_images, width=args.width,
+                                                      height=args.height, port=args.port, latency=args.latency,
+                                                      cookie_ttl=args.cookie_ttl)
+    print("Serving {0} images on {1}".format(len(stand_in.pyramids), stand_in.server_url))
+    try:
+        stand_in.server.serve_forever()
+    except KeyboardInterrupt:
+        stand_in.stop()
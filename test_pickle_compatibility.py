@@ -0,0 +1,98 @@
+import logging
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+from PyQt5.QtCore import QPoint, QRect
+from PyQt5.QtGui import QColor, QPixmap
+from PyQt5.QtWidgets import QApplication
+
+from coupe import Coupe
+from reconstruction import Reconstruction
+from slice import Slice
+
+logger = logging.getLogger('test')
+
+
+@pytest.fixture(scope="module")
+def qapp():
+    return QApplication.instance() or QApplication([])
+
+
+@pytest.fixture
+def macro_photo_path(qapp, tmp_path):
+    macro_photo = QPixmap(400, 300)
+    macro_photo.fill(QColor(230, 225, 220))
+    path = str(tmp_path / "macro.png")
+    macro_photo.save(path)
+    return path
+
+
+def create_old_coupe():
+    '''
+    :return: a coupe with the attributes a pickle written by the original code has: no img_trans, no max_level and
+    the url and cookie in the meta data
+    '''
+    coupe = Coupe.__new__(Coupe)
+    coupe.__dict__.update({'slide_score_image_id': 5, 'slide_score_case_id': 13, 'slide_score_study_id': 2,
+                           'img': np.random.randint(0, 255, (80, 100, 3), dtype=np.uint8),
+                           'meta_data': {'level0TileWidth': 256, 'level0TileHeight': 256, 'level0Width': 1000,
+                                         'level0Height': 800, 'mppX': 0.5, 'mppY': 0.5, 'cookie': 'c', 'url': 'u'},
+                           'tile_width': 256, 'tile_height': 256, 'width': 1000, 'height': 800,
+                           'size': [1000, 800], 'mpp_x': 0.5, 'mpp_y': 0.5, 'cookie': 'c', 'url': 'u'})
+    return coupe
+
+
+def create_old_slice():
+    '''
+    :return: a slice with the attributes a pickle written by the original code has: the traces as lists of QPoints,
+    the mask as an int array and no score_map
+    '''
+    slice = Slice.__new__(Slice)
+    mask = np.zeros((300, 400), dtype=int)
+    mask[100:200, 150:250] = 1
+    slice.__dict__.update({'rect': QRect(0, 0, 400, 300), 'id': 0, 'mask': mask, 'pen_width': 45,
+                           'max_num_train_pixels': 500,
+                           'traces': [[QPoint(120, 100), QPoint(280, 100), QPoint(280, 200), QPoint(120, 200)]]})
+    return slice
+
+
+def write_old_pickle(path, macro_photo_path, slices=(), coupes=()):
+    '''
+    writes a pickle of a reconstruction as the original code wrote it
+    '''
+    reconstruction = Reconstruction.__new__(Reconstruction)
+    reconstruction.__dict__.update({'slices': list(slices), 'coupes': {coupe.slide_score_image_id: coupe
+                                                                       for coupe in coupes},
+                                    'active_coupe': None, 'ruler_points': [], 'slide_score_api': None,
+                                    'slide_score_user': 'user', 'slide_score_case_id': 13,
+                                    'slide_score_study_id': 2, 'macro_photo_path': macro_photo_path})
+    with open(path, "wb") as f:
+        pickle.dump(reconstruction, f)
+
+
+def test_old_pickle_with_coupes_can_be_saved_as_project_file(macro_photo_path, tmp_path):
+    write_old_pickle(tmp_path / "old.pickle", macro_photo_path, coupes=[create_old_coupe()])
+    reconstruction = Reconstruction.load_from_pickle(pickle_file_path=tmp_path / "old.pickle", parent=None,
+                                                     logger=logger, macro_photo_path=macro_photo_path)
+    coupe = reconstruction.coupes[5]
+    assert coupe.max_level == 10
+    assert coupe.pixmap_trans.width() == 100
+    assert reconstruction.save_to_project_file(tmp_path / "old.project")
+
+
+def test_old_pickle_with_slices_can_be_saved_as_project_file(macro_photo_path, tmp_path):
+    write_old_pickle(tmp_path / "old.pickle", macro_photo_path, slices=[create_old_slice()])
+    reconstruction = Reconstruction.load_from_pickle(pickle_file_path=tmp_path / "old.pickle", parent=None,
+                                                     logger=logger, macro_photo_path=macro_photo_path)
+    slice = reconstruction.slices[0]
+    assert slice.score_map is None
+    assert slice.mask.count() == 100 * 100
+    assert reconstruction.save_to_project_file(tmp_path / "old.project")
+    restored = Reconstruction.load_from_project_file(project_file_path=tmp_path / "old.project", slide_score_api=None,
+                                                     slide_score_user="user", parent=None, logger=logger,
+                                                     macro_photo_path=macro_photo_path)
+    assert len(restored.slices[0].traces) == 1
@@ -0,0 +1,66 @@
+import math
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+from PyQt5.QtCore import QPoint, Qt
+from PyQt5.QtGui import QColor, QImage, QPainter, QPen, QPixmap, QPolygon
+from PyQt5.QtWidgets import QApplication
+
+import segmentation
+
+
+@pytest.fixture(scope="module")
+def qapp():
+    return QApplication.instance() or QApplication([])
+
+
+def create_masks_with_qpainter(traces, size, pen_width):
+    '''
+    the seed masks as the original code derived them: the traces painted on a QPixmap, the channels averaged with
+    a uint8 accumulator and the inner region selected with > 100
+    '''
+    pixmap = QPixmap(*size)
+    pixmap.fill(QColor(255, 255, 255))
+    painter = QPainter(pixmap)
+    pen = QPen()
+    pen.setWidth(pen_width)
+    pen.setBrush(Qt.black)
+    pen.setCapStyle(Qt.RoundCap)
+    painter.setPen(pen)
+    for trace in traces:
+        painter.drawPolyline(QPolygon([QPoint(x, y) for x, y in trace]))
+    painter.end()
+    image = pixmap.toImage().convertToFormat(QImage.Format_RGB888)
+    w, h = image.width(), image.height()
+    arr = np.frombuffer(image.constBits().asstring(image.bytesPerLine() * h), np.uint8)
+    arr = arr.reshape(h, image.bytesPerLine())[:, :w * 3].reshape(h, w, 3)
+    arr = np.mean(arr, axis=-1, dtype=np.uint8)
+    center = np.mean(np.array([point for trace in traces for point in trace]), axis=0).astype(int)
+    filled = arr.copy()
+    cv2.floodFill(filled, np.zeros((h + 2, w + 2), np.uint8), (int(center[0]), int(center[1])), 128)
+    inner_mask = filled > 100
+    middle_mask = arr < 32
+    return inner_mask, middle_mask, ~inner_mask & ~middle_mask
+
+
+def test_seed_masks_match_the_qpainter_version_up_to_the_pen_edge(qapp):
+    traces = [[(int(200 + 90 * math.cos(math.radians(t))), int(150 + 75 * math.sin(math.radians(t))))
+               for t in range(0, 361, 5)]]
+    expected = create_masks_with_qpainter(traces, (400, 300), 45)
+
+    canvas = np.full((300, 400), 255, dtype=np.uint8)
+    for trace in traces:
+        segmentation.draw_trace(canvas, trace, 45)
+    center = np.mean(np.array([point for trace in traces for point in trace]), axis=0)
+    masks = segmentation.create_inner_and_outer_mask(canvas, center)
+
+    # the two rasterisations of the pen may differ by a pixel at the edge of the traces, nowhere else
+    edge = cv2.morphologyEx(masks[1].astype(np.uint8), cv2.MORPH_GRADIENT, np.ones((3, 3), np.uint8))
+    near_edge = cv2.dilate(edge, np.ones((3, 3), np.uint8)).astype(bool)
+    for mask, expected_mask in zip(masks, expected):
+        assert mask.sum() > 0
+        assert not ((mask ^ expected_mask) & ~near_edge).any()
@@ -0,0 +1,33 @@
+import numpy as np
+
+from slice_trace import simplify_polyline
+
+
+def distance_to_polyline(point, polyline):
+    '''
+    :return: the distance of point to the nearest segment of polyline
+    '''
+    distances = []
+    for start, end in zip(polyline[:-1], polyline[1:]):
+        direction = end - start
+        squared_length = direction @ direction
+        u = 0 if squared_length == 0 else np.clip((point - start) @ direction / squared_length, 0, 1)
+        distances.append(np.hypot(*(point - (start + u * direction))))
+    return min(distances)
+
+
+def test_hairpin_stroke_keeps_its_far_end():
+    points = np.array([[0, 0], [1000, 0], [3, 0]])
+    simplified = simplify_polyline(points, 1.0)
+    assert simplified.tolist() == [[0, 0], [1000, 0], [3, 0]]
+
+
+def test_closed_loop_stays_within_tolerance():
+    angles = np.linspace(0, 2 * np.pi, 361)
+    points = np.round(np.stack((200 + 90 * np.cos(angles), 150 + 75 * np.sin(angles)), axis=1)).astype(np.int32)
+    tolerance = 2.0
+    simplified = simplify_polyline(points, tolerance)
+    assert len(simplified) < len(points)
+    assert simplified[0].tolist() == simplified[-1].tolist()
+    for point in points.astype(np.float64):
+        assert distance_to_polyline(point, simplified.astype(np.float64)) <= tolerance
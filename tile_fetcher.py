@@ -0,0 +1,70 @@
+import io
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+from PIL import Image
+
+
+class TileFetcher:
+    '''
+    The TileFetcher downloads and decodes the tiles of a coupe in parallel.
+
+    The tiles are fetched by a bounded pool of worker threads, such that the total loading time scales with
+    the available bandwidth rather than with the latency of the Slide Score server.
+    The workers only download and decode the tiles. Each decoded tile is handed back to the calling thread
+    through a callback, so the caller can place the tile in its image without any locking.
+    '''
+
+    def __init__(self, num_workers=8, logger=None):
+        '''
+        :param num_workers: the maximum number of tiles that are downloaded simultaneously
+        :param logger: the logger
+        '''
+        self.num_workers = max(1, int(num_workers))
+        self.logger = logger
+
+    def fetch(self, keys, load_tile, on_tile):
+        '''
+        Fetches all tiles in keys, and calls on_tile for each tile as soon as it is ready.
+        :param keys: a list of keys identifying the tiles, e.g. (x, y) tuples
+        :param load_tile: a function load_tile(key) returning the encoded (jpeg) content of a tile.
+        This function is called from the worker threads.
+        :param on_tile: a function on_tile(key, tile) with tile the decoded tile as numpy array.
+        This function is called from the calling thread, in order of completion
+        :return: the number of tiles fetched
+        '''
+        cnt = 0
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            futures = {executor.submit(self.fetch_tile, load_tile, key): key for key in keys}
+            try:
+                for future in as_completed(futures):
+                    on_tile(futures[future], future.result())
+                    cnt += 1
+            except:
+                # no need to wait for the remaining tiles if one of them failed
+                for future in futures:
+                    future.cancel()
+                raise
+        return cnt
+
+    @staticmethod
+    def fetch_tile(load_tile, key):
+        '''
+        Loads and decodes a single tile, runs in a worker thread
+        :param load_tile: the function returning the encoded tile
+        :param key: the key of the tile
+        :return: the tile as numpy array
+        '''
+        return decode_tile(load_tile(key))
+
+
+def decode_tile(content):
+    '''
+    Decodes the content of a jpeg tile
+    :param content: the bytes as received from the tile server
+    :return: the tile as an RGB numpy array
+    '''
+    tile = Image.open(io.BytesIO(content))
+    if tile.mode != "RGB":
+        tile = tile.convert("RGB")
+    return np.asarray(tile)
@@ -0,0 +1,79 @@
+import threading
+from collections import OrderedDict
+
+
+class TileMemory:
+    '''
+    Keeps decoded tiles in memory, such that zooming in and out or panning over the same region of a coupe does not
+    fetch and decode the same tiles again (see Coupe.get_region).
+
+    One TileMemory is shared by all coupes (shared_tile_memory), with a cap on the total number of bytes of the
+    tiles, so the memory used does not grow with the number of coupes in a case. When the cap is exceeded, the least
+    recently used tiles are dropped, whichever coupe they belong to.
+
+    The coupes are loaded in parallel, so all bookkeeping is done under a lock.
+    '''
+
+    def __init__(self, max_size_mb=256):
+        '''
+        :param max_size_mb: the maximum total size of the tiles in MB
+        '''
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.lock = threading.Lock()
+        # the decoded tiles, keyed by (image id, level, x, y), ordered from least to most recently used
+        self.tiles = OrderedDict()
+        self.total_size = 0
+
+    def set_max_size_mb(self, max_size_mb):
+        '''
+        changes the cap on the total size, dropping tiles if needed
+        :param max_size_mb: the maximum total size of the tiles in MB
+        :return: None
+        '''
+        with self.lock:
+            self.max_size = int(max_size_mb * 1024 * 1024)
+            self.evict()
+
+    def get(self, key):
+        '''
+        :param key: (image id, level, x, y)
+        :return: the decoded tile if it is kept in memory, otherwise None
+        '''
+        with self.lock:
+            tile = self.tiles.get(key)
+            if tile is not None:
+                self.tiles.move_to_end(key)
+            return tile
+
+    def put(self, key, tile):
+        '''
+        keeps a decoded tile in memory
+        :param key: (image id, level, x, y)
+        :param tile: the decoded tile, a numpy array
+        :return: None
+        '''
+        with self.lock:
+            previous = self.tiles.pop(key, None)
+            if previous is not None:
+                self.total_size -= previous.nbytes
+            self.tiles[key] = tile
+            self.total_size += tile.nbytes
+            self.evict()
+
+    def evict(self):
+        '''
+        drops the least recently used tiles until the total size is within the cap. Called with the lock held
+        :return: None
+        '''
+        while self.total_size > self.max_size and len(self.tiles) > 0:
+            _, tile = self.tiles.popitem(last=False)
+            self.total_size -= tile.nbytes
+
+    def clear(self):
+        with self.lock:
+            self.tiles.clear()
+            self.total_size = 0
+
+
+# the tiles of all coupes are kept in this TileMemory, see Coupe.get_region
+shared_tile_memory = TileMemory()